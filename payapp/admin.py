@@ -1,11 +1,17 @@
 from django.contrib import admin
-from .models import Transaction, CurrencyConversion, TransactionHistory, Card, PaymentRequest
+from django.db.models import Sum
+from django.utils import timezone
+from .models import Transaction, CurrencyConversion, TransactionHistory, Card, PaymentRequest, JournalEntry, JournalLine, MonthlyRollup, OutboxMessage, Notification
+from webapps2024.utils.changelists import ScalableModelAdmin, values_filter
 
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
+class TransactionAdmin(ScalableModelAdmin):
     list_display = ['sender', 'recipient', 'amount']
-    search_fields = ['sender__username', 'recipient__username']
-    list_filter = ['transaction_type']
+    list_select_related = ['sender', 'recipient']
+    search_fields = ['^sender__username', '=sender__email', '^recipient__username', '=recipient__email']
+    user_search_fields = ['sender', 'recipient']
+    list_filter = ['transaction_type', 'status']
+    autocomplete_fields = ['sender', 'recipient']
 
     # def get_currency(self, obj):
     #     return obj.currency
@@ -15,10 +21,17 @@ class TransactionAdmin(admin.ModelAdmin):
 class CurrencyConversionAdmin(admin.ModelAdmin):
     list_display = ['currency_from', 'currency_to', 'exchange_rate']
 
-class TransactionHistoryAdmin(admin.ModelAdmin):
+class TransactionHistoryAdmin(ScalableModelAdmin):
     list_display = ['sender', 'recipient', 'bank_account', 'amount', 'description', 'status']
-    search_fields = ['sender__username', 'recipient__username', 'description']
-    list_filter = ['status']
+    list_select_related = ['sender', 'recipient', 'bank_account']
+    search_fields = ['^sender__username', '=sender__email']
+    # both sides of a transfer get a row with their own user as the sender,
+    # so this finds all of a user's history through the sender index
+    user_search_fields = ['sender']
+    list_filter = [values_filter('status', 'status', [
+        ('✔️', 'Sent'), ('📥', 'Received'), ('Accepted', 'Accepted'), ('Rejected', 'Rejected'),
+    ])]
+    autocomplete_fields = ['sender', 'recipient', 'bank_account']
 
     # def get_acceptance_status(self, obj):
     #     if obj.status == 'Accepted':
@@ -36,9 +49,105 @@ class TransactionHistoryAdmin(admin.ModelAdmin):
 admin.site.register(TransactionHistory, TransactionHistoryAdmin)
 
 @admin.register(Card)
-class CardAdmin(admin.ModelAdmin):
+class CardAdmin(ScalableModelAdmin):
     list_display = ['user', 'card_number', 'expiration_date', 'cvv']
+    list_select_related = ['user']
+    search_fields = ['^user__username', '=user__email']
+    user_search_fields = ['user']
+    autocomplete_fields = ['user']
 
 @admin.register(PaymentRequest)
-class PaymentRequestAdmin(admin.ModelAdmin):
-    list_display = ['sender', 'recipient', 'amount']
+class PaymentRequestAdmin(ScalableModelAdmin):
+    list_display = ['sender', 'recipient', 'amount', 'status']
+    list_select_related = ['sender', 'recipient']
+    search_fields = ['^sender__username', '=sender__email', '^recipient__username', '=recipient__email']
+    user_search_fields = ['sender', 'recipient']
+    list_filter = ['status']
+    autocomplete_fields = ['sender', 'recipient']
+
+
+class JournalLineInline(admin.TabularInline):
+    model = JournalLine
+    fields = ['account', 'system_account', 'currency', 'amount']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def get_queryset(self, request):
+        # an online account is shown by its user's name
+        return super().get_queryset(request).select_related('account__user')
+
+
+@admin.register(JournalEntry)
+class JournalEntryAdmin(ScalableModelAdmin):
+    # the journal is append-only: entries are written by payapp.ledger only
+    list_display = ['created_at', 'transaction_type', 'description']
+    list_filter = ['transaction_type']
+    readonly_fields = ['transaction_type', 'description', 'created_at']
+    inlines = [JournalLineInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+
+@admin.register(MonthlyRollup)
+class MonthlyRollupAdmin(ScalableModelAdmin):
+    # maintained by payapp.ledger; recompute with the rebuild_rollups command
+    list_display = ['month', 'user', 'currency', 'direction', 'count', 'total', 'minimum', 'maximum']
+    list_filter = ['direction', 'currency', 'month']
+    list_select_related = ['user']
+    search_fields = ['^user__username', '=user__email']
+    user_search_fields = ['user']
+    date_hierarchy = 'month'
+    change_list_template = 'admin/payapp/monthlyrollup/change_list.html'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        """Adds the volume per month, currency and direction of the filtered rollups."""
+        response = super().changelist_view(request, extra_context)
+        changelist = getattr(response, 'context_data', {}).get('cl')
+        if changelist is not None:
+            response.context_data['volume'] = (
+                changelist.queryset.order_by().values('month', 'currency', 'direction')
+                .annotate(count=Sum('count'), total=Sum('total'))
+                .order_by('-month', 'currency', 'direction')
+            )
+        return response
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(ScalableModelAdmin):
+    # written with each transfer and payment request; sent by deliver_outbox
+    list_display = ['created_at', 'event', 'channel', 'recipient', 'attempts', 'available_at', 'failed_at', 'last_error']
+    list_select_related = ['recipient']
+    search_fields = ['^recipient__username', '=recipient__email']
+    user_search_fields = ['recipient']
+    list_filter = [('failed_at', admin.EmptyFieldListFilter)]
+    readonly_fields = ['channel', 'event', 'recipient', 'payload', 'attempts', 'created_at', 'last_error']
+    actions = ['retry_now']
+
+    @admin.action(description='Retry the selected messages now')
+    def retry_now(self, request, queryset):
+        retried = queryset.update(failed_at=None, attempts=0, available_at=timezone.now())
+        self.message_user(request, f'{retried} messages will be retried.')
+
+
+@admin.register(Notification)
+class NotificationAdmin(ScalableModelAdmin):
+    list_display = ['created_at', 'user', 'event', 'message', 'read_at']
+    list_select_related = ['user']
+    search_fields = ['^user__username', '=user__email']
+    user_search_fields = ['user']
+    autocomplete_fields = ['user']
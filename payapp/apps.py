@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class PayappConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "payapp"
+
+    def ready(self):
+        import payapp.signals
+        from django.db.backends.signals import connection_created
+        from webapps2024.utils import group_commit
+        connection_created.connect(group_commit.configure_sqlite, dispatch_uid="configure_sqlite")
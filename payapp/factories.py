@@ -0,0 +1,42 @@
+from decimal import Decimal
+
+import factory
+from factory.django import DjangoModelFactory
+
+from payapp.models import Card, PaymentRequest, TransactionHistory
+from register.factories import CustomUserFactory
+from webapps2024.utils.choices import CARD_TYPE, CURRENCY_CHOICES, TRANSACTION_STATUS
+
+
+class CardFactory(DjangoModelFactory):
+    class Meta:
+        model = Card
+
+    user = factory.SubFactory(CustomUserFactory)
+    card_type = factory.Iterator(CARD_TYPE.values)
+    card_number = factory.Faker("numerify", text="##########")
+    expiration_date = factory.Faker("future_date", end_date="+5y")
+    cvv = factory.Faker("numerify", text="###")
+
+
+class TransactionHistoryFactory(DjangoModelFactory):
+    class Meta:
+        model = TransactionHistory
+
+    sender = factory.SubFactory(CustomUserFactory)
+    recipient = factory.SubFactory(CustomUserFactory)
+    description = factory.Faker("sentence", nb_words=4)
+    status = "✔️"
+    amount = factory.Faker("pydecimal", left_digits=3, right_digits=2, positive=True)
+
+
+class PaymentRequestFactory(DjangoModelFactory):
+    class Meta:
+        model = PaymentRequest
+
+    sender = factory.SubFactory(CustomUserFactory)
+    recipient = factory.SubFactory(CustomUserFactory)
+    amount = Decimal("5.00")
+    message = factory.Faker("sentence", nb_words=6)
+    status = TRANSACTION_STATUS.PENDING
+    currency = factory.Iterator(CURRENCY_CHOICES.values)
@@ -0,0 +1,70 @@
+from dataclasses import astuple, dataclass, fields
+from decimal import Decimal
+from typing import ClassVar
+
+
+@dataclass(frozen=True)
+class FlowState:
+    """
+    State carried in the session between the steps of a multi-step flow.
+
+    Each subclass is stored under its own ``session_key`` as a compact list
+    of its field values, with Decimals as strings. It is rebuilt into typed
+    fields when loaded.
+    """
+    session_key: ClassVar[str]
+
+    def dump(self):
+        return [str(value) if isinstance(value, Decimal) else value for value in astuple(self)]
+
+    @classmethod
+    def parse(cls, values):
+        return cls(*(field.type(value) for field, value in zip(fields(cls), values, strict=True)))
+
+
+@dataclass(frozen=True)
+class Deposit(FlowState):
+    """Amount chosen on the deposit page; discarded once it is credited."""
+    session_key: ClassVar[str] = "deposit"
+    amount: Decimal
+
+
+@dataclass(frozen=True)
+class DepositReceipt(FlowState):
+    """Amount last credited by a deposit, shown on its receipt."""
+    session_key: ClassVar[str] = "deposit_receipt"
+    amount: Decimal
+
+
+@dataclass(frozen=True)
+class DirectPayment(FlowState):
+    session_key: ClassVar[str] = "direct_payment"
+    recipient_email: str
+    amount: Decimal
+    currency: str
+
+
+@dataclass(frozen=True)
+class Withdrawal(FlowState):
+    session_key: ClassVar[str] = "withdrawal"
+    bank_account_id: int
+    amount: Decimal
+
+
+def store(session, state):
+    session[state.session_key] = state.dump()
+
+
+def load(session, state_class):
+    """The ``state_class`` stored in ``session``, or None if absent or unreadable."""
+    values = session.get(state_class.session_key)
+    if values is None:
+        return None
+    try:
+        return state_class.parse(values)
+    except (TypeError, ValueError, ArithmeticError):
+        return None
+
+
+def discard(session, state_class):
+    session.pop(state_class.session_key, None)
@@ -0,0 +1,243 @@
+import hashlib
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.messages.storage.base import BaseStorage
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect
+from django.utils import timezone
+
+from payapp.models import IdempotencyKey
+from webapps2024.utils import group_commit
+
+# Browser forms send the key in this field; API clients use the
+# ``Idempotency-Key`` header.
+FIELD = "idempotency_key"
+
+# How long a finished response can be replayed.
+TTL = timedelta(seconds=getattr(settings, "IDEMPOTENCY_KEY_TTL_SECONDS", 24 * 60 * 60))
+
+# How long a duplicate waits for the first request to finish before answering 409.
+WAIT_SECONDS = getattr(settings, "IDEMPOTENCY_WAIT_SECONDS", 5)
+
+_POLL_SECONDS = 0.05
+_UNSIGNED_FIELDS = {"csrfmiddlewaretoken", FIELD}
+_FORM_CONTENT_TYPES = {"application/x-www-form-urlencoded", "multipart/form-data"}
+
+
+def fingerprint(request):
+    """
+    Hash what a retry must repeat exactly: the path and the submitted data,
+    minus the CSRF token and the key itself.
+    """
+    digest = hashlib.sha256(request.path.encode())
+    if request.content_type in _FORM_CONTENT_TYPES:
+        for name, values in sorted(request.POST.lists()):
+            if name not in _UNSIGNED_FIELDS:
+                digest.update(f"\0{name}={values!r}".encode())
+    else:
+        digest.update(request.body)
+    return digest.hexdigest()
+
+
+class _Duplicate(Exception):
+    """The key was claimed by an earlier request; its posting is not repeated."""
+
+    def __init__(self, record):
+        super().__init__(record.key)
+        self.record = record
+
+
+class _Claim:
+    """
+    Claims a key in the transaction of the first posting the view makes.
+
+    ``group_commit.wrapping`` hands it every funneled posting, so the claim
+    commits or rolls back with the posting, on the writer when group commit
+    is on. The view itself runs on the request thread, outside it. The
+    unique ``(user, key)`` constraint decides between concurrent duplicates;
+    a key whose replay window has passed is taken over with a conditional
+    UPDATE, so that too has a single winner.
+    """
+
+    def __init__(self, user, key, digest):
+        self.user = user
+        self.key = key
+        self.digest = digest
+        self.record = None
+
+    def __call__(self, fn, *args, **kwargs):
+        if self.record is not None:
+            # a posting nested in the one that claimed the key
+            return fn(*args, **kwargs)
+        try:
+            with transaction.atomic():
+                self.record = self._claim()
+                return fn(*args, **kwargs)
+        except BaseException:
+            self.record = None
+            raise
+
+    def _claim(self):
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    user=self.user, key=self.key, fingerprint=self.digest, locked_at=now, expires_at=now + TTL,
+                )
+        except IntegrityError:
+            pass
+
+        record = IdempotencyKey.objects.filter(user=self.user, key=self.key).first()
+        if record is None:
+            # pruned in between; claim it afresh
+            return self._claim()
+        if record.expires_at > now:
+            raise _Duplicate(record)
+        reset = dict(
+            fingerprint=self.digest, locked_at=now, expires_at=now + TTL,
+            response_status=None, response_content_type="", response_location="", response_body=b"",
+            response_messages=[],
+        )
+        if not IdempotencyKey.objects.filter(pk=record.pk, expires_at__lte=now).update(**reset):
+            # taken over by a concurrent duplicate
+            raise _Duplicate(IdempotencyKey.objects.get(pk=record.pk))
+        for name, value in reset.items():
+            setattr(record, name, value)
+        return record
+
+
+def _wait(record):
+    """Poll until the request holding ``record`` stores its response, or give up."""
+    deadline = time.monotonic() + WAIT_SECONDS
+    while record is not None and record.response_status is None:
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(_POLL_SECONDS)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+    return record
+
+
+def _messages(request):
+    """
+    The flash messages queued for ``request`` so far, without marking them
+    shown.
+    """
+    storage = messages.get_messages(request)
+    if not isinstance(storage, BaseStorage):
+        # no message middleware
+        return []
+    used = storage.used
+    queued = list(storage)
+    storage.used = used
+    return queued
+
+
+def _discard_messages(request, keep):
+    """Drop the flash messages queued for ``request`` after the first ``keep``."""
+    storage = messages.get_messages(request)
+    if isinstance(storage, BaseStorage):
+        del storage._queued_messages[keep:]
+
+
+def _store(record, response, flashed):
+    record.response_status = response.status_code
+    record.response_content_type = response.get("Content-Type", "")
+    record.response_location = response.get("Location", "")
+    record.response_body = response.content
+    record.response_messages = [[message.level, str(message.message), message.extra_tags] for message in flashed]
+    record.save(update_fields=[
+        "response_status", "response_content_type", "response_location", "response_body", "response_messages",
+    ])
+
+
+def _replay(request, record):
+    for level, message, extra_tags in record.response_messages:
+        messages.add_message(request, level, message, extra_tags=extra_tags, fail_silently=True)
+    if record.response_location:
+        response = HttpResponseRedirect(record.response_location)
+        response.status_code = record.response_status
+    else:
+        response = HttpResponse(
+            bytes(record.response_body), status=record.response_status,
+            content_type=record.response_content_type or None,
+        )
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _answer_duplicate(request, record, digest):
+    if record.fingerprint != digest:
+        return HttpResponse("This idempotency key was already used for a different request.", status=422)
+    record = _wait(record)
+    if record is None:
+        response = HttpResponse("A request with this idempotency key is still in progress.", status=409)
+        response["Retry-After"] = "1"
+        return response
+    return _replay(request, record)
+
+
+def idempotent(view):
+    """
+    Make a money-moving POST view safe to retry.
+
+    A POST carrying an ``Idempotency-Key`` header or an ``idempotency_key``
+    form field posts money at most once per user and key. The key is
+    claimed in the same transaction as the view's first ledger posting, and
+    the view's response, with the flash messages it queued, is stored right
+    after the view returns. Duplicates replay it. A duplicate that arrives
+    before it is stored waits for it, up to ``WAIT_SECONDS``, and gets 409
+    after that. Reusing a key for a different request gets 422. Requests
+    that post nothing claim no key, and requests without a key run as
+    before.
+
+    The view runs on the request thread, with its own transactions; only
+    the claim and the posting go to the group-commit writer. The response
+    is stored outside the posting's transaction, since rendering it is
+    the view's business and may take any time. So the stored response
+    does not depend on whether group commit is on. If storing it fails,
+    the key stays claimed without one: duplicates get 409 until it
+    expires, and the money is still posted only once.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = None
+        if request.method == "POST":
+            key = request.headers.get("Idempotency-Key") or request.POST.get(FIELD)
+        if not key or not request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field("key").max_length:
+            return HttpResponseBadRequest("Idempotency key is too long.")
+
+        digest = fingerprint(request)
+        claim = _Claim(request.user, key, digest)
+        before = len(_messages(request))
+        try:
+            with group_commit.wrapping(claim):
+                response = view(request, *args, **kwargs)
+        except _Duplicate as duplicate:
+            _discard_messages(request, before)
+            return _answer_duplicate(request, duplicate.record, digest)
+
+        if claim.record is None:
+            # nothing was posted; a retry of a request that was still replays it
+            record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+            if record is None:
+                return response
+            _discard_messages(request, before)
+            return _answer_duplicate(request, record, digest)
+        # server errors and streams are not worth replaying
+        if response.status_code < 500 and not response.streaming:
+            _store(claim.record, response, _messages(request)[before:])
+        return response
+
+    return wrapper
+
+
+def prune():
+    """Delete keys whose replay window has passed. Returns how many were deleted."""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
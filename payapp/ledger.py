@@ -0,0 +1,629 @@
+import operator
+from collections import deque
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from functools import reduce
+
+from django.db import connection, transaction
+from django.db.models import (
+    Case, CharField, Count, DateField, DecimalField, F, IntegerField, Max, Min, Q, Sum, Value, When,
+)
+from django.db.models.functions import Abs, Greatest, Least, TruncMonth
+from django.utils import timezone
+
+from payapp import live, outbox, rates
+from payapp.models import (
+    BalanceCheckpoint, JournalEntry, JournalLine, MonthlyRollup, PendingRequestCounter, TransactionHistory,
+)
+from payapp.rates import ExchangeRateNotFound
+from register.models import OnlineAccount
+from webapps2024.utils import fragments, group_commit
+from webapps2024.utils.choices import FLOW_DIRECTION, SYSTEM_ACCOUNT, TRASACTION_TYPE_CHOICES
+
+CENT = Decimal("0.01")
+
+# Accounts credited per UPDATE ... CASE statement in batch postings.
+BATCH_CHUNK = 250
+
+
+class LedgerError(Exception):
+    """Base class for errors raised while posting money movements."""
+
+
+class InsufficientFunds(LedgerError):
+    """The debited account does not hold enough money to cover the posting."""
+
+
+def to_amount(value):
+    """
+    Normalise a user supplied amount to a positive two-decimal Decimal.
+
+    Floats are converted through ``str`` so that values such as ``0.1`` do not
+    pick up binary noise on the way in.
+    """
+    if isinstance(value, float):
+        value = str(value)
+    amount = Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+    if amount <= 0:
+        raise ValueError("Amount must be greater than zero.")
+    return amount
+
+
+def convert(amount, currency_from, currency_to):
+    """
+    Convert ``amount`` between two account currencies, rounded to the cent.
+    """
+    return rates.convert(amount, currency_from, currency_to)
+
+
+def _accounts(*users):
+    """
+    Map each user's id to its ``(account pk, currency)``, in at most one
+    query. Users loaded with their online account, as the session user is,
+    cost none.
+    """
+    accounts = {}
+    for user in users:
+        account = user._state.fields_cache.get("onlineaccount")
+        if account is not None:
+            accounts[user.pk] = (account.pk, account.currency)
+    missing = [user.pk for user in users if user.pk not in accounts]
+    if missing:
+        accounts.update(
+            (user_id, (pk, currency))
+            for user_id, pk, currency in OnlineAccount.objects.filter(user_id__in=missing).values_list(
+                "user_id", "pk", "currency"
+            )
+        )
+    for user in users:
+        if user.pk not in accounts:
+            raise OnlineAccount.DoesNotExist(f"No online account for user {user.pk}")
+    return accounts
+
+
+def _lock_accounts(account_ids):
+    """
+    Take row locks on the online accounts ``account_ids`` in ascending order.
+
+    Every posting locks in the same order so two transfers running in opposite
+    directions between the same pair of accounts can never deadlock. Backends
+    without ``SELECT ... FOR UPDATE`` (SQLite) serialise writers on the
+    database lock instead, so nothing needs to be done there.
+    """
+    if connection.features.has_select_for_update:
+        list(
+            OnlineAccount.objects.select_for_update()
+            .filter(pk__in=account_ids)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+
+
+def _credit(account_id, amount):
+    OnlineAccount.objects.filter(pk=account_id).update(balance=F("balance") + amount)
+
+
+def _credit_many(credits):
+    """
+    Credit many accounts from an ``{account_id: amount}`` mapping using one
+    ``UPDATE ... CASE`` statement per chunk of accounts.
+    """
+    account_ids = sorted(credits)
+    for start in range(0, len(account_ids), BATCH_CHUNK):
+        chunk = account_ids[start:start + BATCH_CHUNK]
+        OnlineAccount.objects.filter(pk__in=chunk).update(
+            balance=F("balance") + Case(
+                *[When(pk=account_id, then=Value(credits[account_id])) for account_id in chunk],
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            )
+        )
+
+
+def _try_debit(account_id, amount):
+    """
+    Debit ``amount`` only if the balance covers it, in a single UPDATE.
+
+    The balance check is part of the statement itself, so a concurrent debit
+    can never observe a stale balance and overdraw the account.
+    """
+    return bool(
+        OnlineAccount.objects.filter(pk=account_id, balance__gte=amount).update(
+            balance=F("balance") - amount
+        )
+    )
+
+
+def _debit(account_id, amount):
+    if not _try_debit(account_id, amount):
+        raise InsufficientFunds("Insufficient funds.")
+
+
+def _balances(account_ids):
+    """
+    Read the balances of ``account_ids`` as this transaction has just left
+    them, and the users owning them, as two ``{account_id: value}`` mappings.
+    The accounts are locked by the posting, so these are the balances right
+    after it.
+    """
+    account_ids = sorted(account_ids)
+    balances, owners = {}, {}
+    for start in range(0, len(account_ids), BATCH_CHUNK):
+        for pk, user_id, balance in OnlineAccount.objects.filter(
+            pk__in=account_ids[start:start + BATCH_CHUNK],
+        ).values_list("pk", "user_id", "balance"):
+            balances[pk] = balance
+            owners[pk] = user_id
+    return balances, owners
+
+
+def _journal(transaction_type, description, lines, balances, owners):
+    """
+    Append a journal entry with its ``(account_id, system_account, currency, amount)``
+    lines, stamping user account lines with their balance from ``balances``,
+    and add it to the monthly rollups of the ``owners`` of those accounts.
+    The owners' open event streams get the new balances on commit.
+    """
+    entry = JournalEntry.objects.create(transaction_type=transaction_type, description=description)
+    # walk back from the balances after the posting, so that an account with
+    # several lines (a batch) gets the balance after each of them
+    after = dict(balances)
+    stamped = []
+    for account_id, system_account, currency, amount in reversed(lines):
+        stamped.append(JournalLine(entry=entry, account_id=account_id, system_account=system_account,
+                                   currency=currency, amount=amount, balance_after=after.get(account_id)))
+        if account_id in after:
+            after[account_id] -= amount
+    JournalLine.objects.bulk_create(reversed(stamped))
+    if all(system_account != SYSTEM_ACCOUNT.OPENING for _, system_account, _, _ in lines):
+        _roll_up(timezone.localdate(entry.created_at).replace(day=1), lines, owners)
+    live.balances_changed(lines, balances, owners)
+    return entry
+
+
+def _roll_up(month, lines, owners):
+    """
+    Add the user account ``lines`` of one posting to their monthly rollups,
+    counting every line, so each item of a batch counts once.
+
+    The accounts are locked by the posting, so nothing else updates these
+    rollups until it commits. Existing rollups are updated with one
+    ``UPDATE ... CASE`` statement per chunk. Only the month's first posting
+    per user, currency and direction inserts the rest, looking up which
+    exist only when some of them were updated.
+    """
+    postings = {}
+    for account_id, _, currency, amount in lines:
+        if account_id is not None:
+            direction = FLOW_DIRECTION.SENT if amount < 0 else FLOW_DIRECTION.RECEIVED
+            postings.setdefault((owners[account_id], currency, direction), []).append(abs(amount))
+
+    keys = sorted(postings)
+    updated = 0
+    for start in range(0, len(keys), BATCH_CHUNK):
+        chunk = [(Q(user_id=user_id, currency=currency, direction=direction), postings[user_id, currency, direction])
+                 for user_id, currency, direction in keys[start:start + BATCH_CHUNK]]
+
+        def per_key(aggregate, output_field=DecimalField(max_digits=12, decimal_places=2)):
+            return Case(*[When(key, then=Value(aggregate(amounts))) for key, amounts in chunk], output_field=output_field)
+
+        total = per_key(sum)
+        if all(len(amounts) == 1 for _, amounts in chunk):
+            # one line per rollup, as in every posting but a batch
+            count, minimum, maximum = 1, total, total
+        else:
+            count, minimum, maximum = per_key(len, IntegerField()), per_key(min), per_key(max)
+        updated += MonthlyRollup.objects.filter(reduce(operator.or_, [key for key, _ in chunk]), month=month).update(
+            count=F("count") + count, total=F("total") + total,
+            minimum=Least("minimum", minimum), maximum=Greatest("maximum", maximum),
+        )
+    if updated == len(keys):
+        return
+
+    existing = set()
+    for start in range(0, len(keys) if updated else 0, BATCH_CHUNK):
+        existing.update(MonthlyRollup.objects.filter(
+            month=month, user_id__in={user_id for user_id, _, _ in keys[start:start + BATCH_CHUNK]},
+        ).values_list("user_id", "currency", "direction"))
+    MonthlyRollup.objects.bulk_create([
+        MonthlyRollup(user_id=user_id, currency=currency, month=month, direction=direction,
+                      count=len(amounts), total=sum(amounts), minimum=min(amounts), maximum=max(amounts))
+        for (user_id, currency, direction), amounts in postings.items()
+        if (user_id, currency, direction) not in existing
+    ])
+
+
+@group_commit.funneled
+def deposit(user, amount, description, bank_account=None, source=SYSTEM_ACCOUNT.BANK):
+    """
+    Credit money coming from outside the system (bank account or card).
+
+    Returns:
+        Decimal: The amount credited to the user's online account.
+    """
+    amount = to_amount(amount)
+    account_id, currency = _accounts(user)[user.pk]
+    with transaction.atomic():
+        _credit(account_id, amount)
+        balances, owners = _balances([account_id])
+        _journal(TRASACTION_TYPE_CHOICES.DEPOSITE, description, [
+            (account_id, None, currency, amount),
+            (None, source, currency, -amount),
+        ], balances, owners)
+        TransactionHistory.objects.create(
+            sender=user, description=description, status="✔️",
+            amount=amount, bank_account=bank_account, balance_after=balances[account_id],
+        )
+    return amount
+
+
+@group_commit.funneled
+def withdraw(user, amount, bank_account, description="Withdrawal to bank account"):
+    """
+    Debit money leaving the system to one of the user's bank accounts.
+
+    Raises:
+        InsufficientFunds: If the balance does not cover ``amount``.
+    """
+    amount = to_amount(amount)
+    account_id, currency = _accounts(user)[user.pk]
+    with transaction.atomic():
+        _debit(account_id, amount)
+        balances, owners = _balances([account_id])
+        _journal(TRASACTION_TYPE_CHOICES.WITHDRAWAL, description, [
+            (account_id, None, currency, -amount),
+            (None, SYSTEM_ACCOUNT.BANK, currency, amount),
+        ], balances, owners)
+        TransactionHistory.objects.create(
+            sender=user, description=description, status="✔️",
+            amount=amount, bank_account=bank_account, balance_after=balances[account_id],
+        )
+    return amount
+
+
+@group_commit.funneled
+def transfer(sender, recipient, amount, sent_description="Transfer (sent)",
+             received_description="Transfer (received)",
+             transaction_type=TRASACTION_TYPE_CHOICES.TRANSFER):
+    """
+    Move ``amount`` (in the sender's currency) from ``sender`` to ``recipient``.
+
+    The recipient is credited the converted amount in their own currency;
+    cross-currency transfers are booked through the currency exchange system
+    account so each currency balances. The balance updates, the journal entry,
+    the history rows for each side and the recipient's notification are
+    written in one database transaction.
+
+    Returns:
+        Decimal: The amount credited to the recipient.
+
+    Raises:
+        InsufficientFunds: If the sender's balance does not cover ``amount``.
+        ExchangeRateNotFound: If the account currencies cannot be converted.
+    """
+    amount = to_amount(amount)
+    if sender.pk == recipient.pk:
+        raise LedgerError("Sender and recipient must be different users.")
+
+    # Accounts are read before the write transaction starts so that on
+    # SQLite the first statement inside it is a write and takes the lock.
+    accounts = _accounts(sender, recipient)
+    sender_id, sender_currency = accounts[sender.pk]
+    recipient_id, recipient_currency = accounts[recipient.pk]
+    credited = convert(amount, sender_currency, recipient_currency)
+
+    if sender_currency == recipient_currency:
+        lines = [
+            (sender_id, None, sender_currency, -amount),
+            (recipient_id, None, recipient_currency, credited),
+        ]
+    else:
+        lines = [
+            (sender_id, None, sender_currency, -amount),
+            (None, SYSTEM_ACCOUNT.FX, sender_currency, amount),
+            (None, SYSTEM_ACCOUNT.FX, recipient_currency, -credited),
+            (recipient_id, None, recipient_currency, credited),
+        ]
+
+    with transaction.atomic():
+        _lock_accounts([sender_id, recipient_id])
+        for account_id in sorted((sender_id, recipient_id)):
+            if account_id == sender_id:
+                _debit(sender_id, amount)
+            else:
+                _credit(recipient_id, credited)
+        balances, owners = _balances([sender_id, recipient_id])
+        _journal(transaction_type, sent_description, lines, balances, owners)
+        TransactionHistory.objects.bulk_create([
+            TransactionHistory(sender=sender, recipient=recipient, status="✔️", amount=amount,
+                               description=sent_description, balance_after=balances[sender_id]),
+            TransactionHistory(sender=recipient, recipient=sender, status="📥", amount=credited,
+                               description=received_description, balance_after=balances[recipient_id]),
+        ])
+        outbox.transfers_received(sender, [(recipient.pk, credited, recipient_currency)])
+        # bulk_create() and update() send no signals
+        fragments.invalidate(sender.pk, recipient.pk)
+    return credited
+
+
+@group_commit.funneled
+def transfer_many(sender, items, sent_description="Batch payout (sent)",
+                  received_description="Batch payout (received)"):
+    """
+    Pay many recipients from ``sender`` in one database transaction.
+
+    ``items`` is an iterable of ``(recipient_email, amount, currency)``; the
+    amount is expressed in ``currency`` (the sender's currency when ``None``).
+    Recipients are resolved in one query, the sender is debited once for all
+    accepted items, recipients are credited with batched UPDATEs, and the
+    journal entry, history rows and notifications are bulk inserted.
+
+    Items that cannot be paid (unknown recipient, missing exchange rate,
+    funds exhausted) are reported as failed without aborting the others.
+    When the balance does not cover the whole batch, items are taken in
+    order and each is accepted if what is left covers it; one that does not
+    fit fails, and later, smaller items may still be paid.
+
+    Returns:
+        list[dict]: One result per item, in input order, with ``index``,
+        ``recipient`` and ``status`` (``"ok"`` or ``"failed"``) plus either
+        ``debited``/``credited`` amounts or an ``error`` message.
+    """
+    items = list(items)
+    sender_id, sender_currency = _accounts(sender)[sender.pk]
+    recipients = {
+        email: (user_id, account_id, currency)
+        for email, user_id, account_id, currency in OnlineAccount.objects.filter(
+            user__email__in={email for email, _, _ in items}
+        ).values_list("user__email", "user_id", "pk", "currency")
+    }
+
+    # one snapshot for the whole batch, even if the rates change meanwhile
+    table = rates.current_table()
+    results = []
+    planned = []
+    for index, (email, amount, currency) in enumerate(items):
+        result = {"index": index, "recipient": email}
+        results.append(result)
+        try:
+            amount = to_amount(amount)
+            if email not in recipients:
+                raise LedgerError("Recipient user not found.")
+            recipient = recipients[email]
+            if recipient[0] == sender.pk:
+                raise LedgerError("You cannot send money to yourself.")
+            debit = table.convert(amount, currency or sender_currency, sender_currency)
+            credit = table.convert(amount, currency or sender_currency, recipient[2])
+        except (LedgerError, ValueError, InvalidOperation) as exc:
+            result.update(status="failed", error=str(exc))
+            continue
+        planned.append((result, recipient, debit, credit))
+
+    with transaction.atomic():
+        _lock_accounts([sender_id, *(recipient[1] for _, recipient, _, _ in planned)])
+        if planned and not _try_debit(sender_id, sum(debit for _, _, debit, _ in planned)):
+            # Not everything fits: accept, in order, each item the rest covers
+            balance = OnlineAccount.objects.values_list("balance", flat=True).get(pk=sender_id)
+            accepted = []
+            for item in planned:
+                if item[2] <= balance:
+                    balance -= item[2]
+                    accepted.append(item)
+                else:
+                    item[0].update(status="failed", error="Insufficient funds.")
+            planned = accepted
+            if planned:
+                _debit(sender_id, sum(debit for _, _, debit, _ in planned))
+        if not planned:
+            return results
+
+        # one entry for the batch, with the lines of each item in turn, so
+        # that every item counts as a posting of its own
+        credits = {}
+        lines = []
+        for result, (user_id, account_id, currency), debit, credit in planned:
+            credits[account_id] = credits.get(account_id, 0) + credit
+            lines.append((sender_id, None, sender_currency, -debit))
+            if currency != sender_currency:
+                lines.append((None, SYSTEM_ACCOUNT.FX, sender_currency, debit))
+                lines.append((None, SYSTEM_ACCOUNT.FX, currency, -credit))
+            lines.append((account_id, None, currency, credit))
+            result.update(status="ok", debited=debit, credited=credit)
+
+        _credit_many(credits)
+        balances, owners = _balances([sender_id, *credits])
+        _journal(TRASACTION_TYPE_CHOICES.TRANSFER, sent_description, lines, balances, owners)
+
+        # replay the items from the balances before the batch to give every
+        # history row the balance right after its own item
+        running = {account_id: balances[account_id] - credit for account_id, credit in credits.items()}
+        running[sender_id] = balances[sender_id] + sum(debit for _, _, debit, _ in planned)
+        history = []
+        for result, (user_id, account_id, currency), debit, credit in planned:
+            running[sender_id] -= debit
+            running[account_id] += credit
+            history.append(TransactionHistory(sender_id=sender.pk, recipient_id=user_id, status="✔️", amount=debit,
+                                              description=sent_description, balance_after=running[sender_id]))
+            history.append(TransactionHistory(sender_id=user_id, recipient_id=sender.pk, status="📥", amount=credit,
+                                              description=received_description, balance_after=running[account_id]))
+        TransactionHistory.objects.bulk_create(history)
+        outbox.transfers_received(sender, [(user_id, credit, currency) for _, (user_id, _, currency), _, credit in planned])
+        fragments.invalidate(sender.pk, *(user_id for _, (user_id, _, _), _, _ in planned))
+    return results
+
+
+@group_commit.funneled
+def open_account(user, currency, opening_balance):
+    """
+    Create the user's online account, or reset an existing one, with an
+    opening balance. The difference from the previous balance is journaled
+    against the opening balances system account.
+    """
+    opening_balance = Decimal(str(opening_balance)).quantize(CENT, rounding=ROUND_HALF_UP)
+    with transaction.atomic():
+        account, created = OnlineAccount.objects.get_or_create(user=user, defaults={"currency": currency})
+        if created:
+            # a new user has no requests to count, so requests never recount them
+            PendingRequestCounter.objects.bulk_create([PendingRequestCounter(user=user)], ignore_conflicts=True)
+        _lock_accounts([account.pk])
+        previous = Decimal("0.00") if created else OnlineAccount.objects.values_list("balance", flat=True).get(pk=account.pk)
+        account.currency = currency
+        account.balance = opening_balance
+        account.save(update_fields=["currency", "balance"])
+        adjustment = opening_balance - previous
+        if adjustment:
+            _journal(TRASACTION_TYPE_CHOICES.DEPOSITE, "Opening balance", [
+                (account.pk, None, currency, adjustment),
+                (None, SYSTEM_ACCOUNT.OPENING, currency, -adjustment),
+            ], {account.pk: opening_balance}, {account.pk: user.pk})
+    return account
+
+
+def rebuild_balance(account):
+    """
+    Recompute an account's balance from the journal.
+
+    Starts from the latest checkpoint and replays only the lines written
+    after it, so the cost is proportional to the postings since the last
+    checkpoint rather than to the whole history.
+    """
+    checkpoint = (
+        BalanceCheckpoint.objects.filter(account=account)
+        .order_by("-last_line_id")
+        .values_list("balance", "last_line_id")
+        .first()
+    )
+    balance, last_line_id = checkpoint or (Decimal("0.00"), 0)
+    replayed = JournalLine.objects.filter(account=account, id__gt=last_line_id).aggregate(
+        total=Sum("amount")
+    )["total"]
+    # SQLite sums decimals as floats, which drift off the cent over many lines
+    return (balance + (replayed or 0)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def checkpoint(account):
+    """
+    Record the account's current balance against its latest journal line.
+    """
+    with transaction.atomic():
+        _lock_accounts([account.pk])
+        last_line_id = JournalLine.objects.filter(account=account).aggregate(last=Max("id"))["last"]
+        balance = OnlineAccount.objects.values_list("balance", flat=True).get(pk=account.pk)
+        return BalanceCheckpoint.objects.create(account=account, balance=balance, last_line_id=last_line_id or 0)
+
+
+def backfill_running_balances(chunk_size=2000):
+    """
+    Fill in the missing ``balance_after`` of journal lines and history rows
+    in one streaming pass.
+
+    Each account's journal lines are replayed in id order from its opening
+    checkpoint. History rows are read in the same account order alongside
+    them. A history row gets the balance after the account's latest posting
+    made before it. Where that posting has several lines for the account (a
+    batch), its history rows take the balance after each line in turn, as
+    the batch recorded them. Rows that moved no money (payment requests)
+    therefore show the balance they left untouched, and rows older than the
+    journal stay empty. Only empty values are written, so the pass can be
+    re-run and can run while new postings arrive.
+
+    Returns:
+        tuple[int, int]: The journal lines and history rows updated.
+    """
+    opening = dict(BalanceCheckpoint.objects.filter(last_line_id=0).values_list("account_id", "balance"))
+    lines = iter(
+        JournalLine.objects.filter(account__isnull=False).order_by("account_id", "id")
+        .values_list("id", "account_id", "entry_id", "amount", "balance_after", "entry__created_at")
+        .iterator(chunk_size=chunk_size)
+    )
+    history = (
+        TransactionHistory.objects.filter(sender__onlineaccount__isnull=False)
+        .order_by("sender__onlineaccount", "created_at", "id")
+        .values_list("id", "sender__onlineaccount", "balance_after", "created_at")
+        .iterator(chunk_size=chunk_size)
+    )
+
+    line_updates, history_updates = [], []
+    counts = [0, 0]
+
+    def flush(model, updates, index, force=False):
+        if updates and (force or len(updates) >= chunk_size):
+            model.objects.bulk_update(updates, ["balance_after"], batch_size=500)
+            counts[index] += len(updates)
+            updates.clear()
+
+    account_id = entry_id = balance = None
+    # balances after the lines of the account's latest posting that no
+    # history row has taken yet
+    unclaimed = deque()
+    line = next(lines, None)
+
+    def replay_until(stop):
+        nonlocal account_id, entry_id, balance, line
+        while line is not None and stop(line):
+            line_id, line_account, line_entry, amount, stored, _ = line
+            if line_account != account_id:
+                account_id, balance = line_account, opening.get(line_account, Decimal("0.00"))
+                entry_id = None
+            if line_entry != entry_id:
+                entry_id = line_entry
+                unclaimed.clear()
+            balance += amount
+            unclaimed.append(balance)
+            if stored is None:
+                line_updates.append(JournalLine(id=line_id, balance_after=balance))
+                flush(JournalLine, line_updates, 0)
+            line = next(lines, None)
+
+    for history_id, history_account, stored, created_at in history:
+        replay_until(lambda line: (line[1], line[5]) <= (history_account, created_at))
+        if account_id != history_account:
+            continue
+        after = unclaimed.popleft() if unclaimed else balance
+        if stored is None:
+            history_updates.append(TransactionHistory(id=history_id, balance_after=after))
+            flush(TransactionHistory, history_updates, 1)
+    replay_until(lambda line: True)
+
+    flush(JournalLine, line_updates, 0, force=True)
+    flush(TransactionHistory, history_updates, 1, force=True)
+    return tuple(counts)
+
+
+def rebuild_rollups(chunk_size=500):
+    """
+    Recompute every monthly rollup from the journal, ``chunk_size`` accounts
+    at a time.
+
+    Each chunk is one transaction that locks its accounts, replaces their
+    rollups with a ``GROUP BY`` over their journal lines, and commits. Every
+    line counts once, as it does when posted, so each item of a batch does.
+    Postings to other accounts go on meanwhile.
+
+    Returns:
+        int: The number of rollups written.
+    """
+    magnitude = Abs("amount")
+    written = 0
+    account_ids = list(OnlineAccount.objects.order_by("pk").values_list("pk", flat=True))
+    for start in range(0, len(account_ids), chunk_size):
+        chunk = account_ids[start:start + chunk_size]
+        with transaction.atomic():
+            _lock_accounts(chunk)
+            MonthlyRollup.objects.filter(user__onlineaccount__in=chunk).delete()
+            totals = (
+                JournalLine.objects.filter(account__in=chunk)
+                .exclude(entry__lines__system_account=SYSTEM_ACCOUNT.OPENING)
+                .values(
+                    user_id=F("account__user_id"), line_currency=F("currency"),
+                    month=TruncMonth("entry__created_at", output_field=DateField()),
+                    direction=Case(
+                        When(amount__lt=0, then=Value(FLOW_DIRECTION.SENT)),
+                        default=Value(FLOW_DIRECTION.RECEIVED), output_field=CharField(),
+                    ),
+                )
+                .annotate(count=Count("id"), total=Sum(magnitude), minimum=Min(magnitude), maximum=Max(magnitude))
+                .order_by()
+            )
+            written += len(MonthlyRollup.objects.bulk_create(
+                [MonthlyRollup(currency=row.pop("line_currency"), **row) for row in totals], batch_size=500,
+            ))
+    return written
@@ -0,0 +1,102 @@
+import asyncio
+
+from django.conf import settings
+from django.db.models import Max
+
+from payapp.models import PaymentRequest
+from register.models import OnlineAccount
+from webapps2024.utils import pubsub
+
+# A comment line is sent after this long without events, so that proxies
+# keep the connection open.
+HEARTBEAT_SECONDS = getattr(settings, "LIVE_EVENTS_HEARTBEAT_SECONDS", 15)
+
+# Streams end after this long and the browser reconnects. Django 4.2 does not
+# notice a client that went away while the response streams, and servers
+# that drop writes to a closed connection give no error either, so this
+# bounds how long an abandoned stream holds its task and subscription.
+STREAM_SECONDS = getattr(settings, "LIVE_EVENTS_STREAM_SECONDS", 60)
+
+# How long the browser waits before reconnecting. Payment requests received
+# in that gap are sent when it does, and the balance is sent afresh.
+RECONNECT_MILLISECONDS = 1000
+
+# Payment requests replayed to a reconnecting stream at most; as many as a
+# connection buffers.
+REPLAY_LIMIT = pubsub.QUEUE_SIZE
+
+
+def balances_changed(lines, balances, owners):
+    """Push the new balance of each user account in a posting's ``lines`` once it commits."""
+    # a batch posts several lines to the same account
+    accounts = {account_id: currency for account_id, _, currency, _ in lines if account_id is not None}
+    pubsub.publish_on_commit([
+        (owners[account_id], "balance", {"balance": balances[account_id], "currency": currency})
+        for account_id, currency in accounts.items()
+    ])
+
+
+def _payment_request_data(payment_request):
+    return {
+        "id": payment_request.pk, "sender": payment_request.sender.username,
+        "amount": payment_request.amount, "currency": payment_request.currency,
+    }
+
+
+def payment_request_received(payment_request):
+    if pubsub.listening([payment_request.recipient_id]):
+        pubsub.publish_on_commit([
+            (payment_request.recipient_id, "payment_request", _payment_request_data(payment_request)),
+        ])
+
+
+def _last_event_id(value):
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+async def stream(user_id, last_event_id=None):
+    """
+    The server-sent events of ``user_id``: their current balance, then
+    every event published for them until ``STREAM_SECONDS`` have passed.
+
+    Payment request events carry the request's id, and the balance sent
+    first carries the latest one the user had received. A browser
+    reconnecting with ``last_event_id`` therefore gets the payment requests
+    it missed, from the database, before the events published since.
+    Balance events need no replay: each holds the whole balance.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STREAM_SECONDS
+    # subscribed before the database is read, so no change falls in between
+    async with pubsub.subscribe(user_id) as queue:
+        yield f"retry: {RECONNECT_MILLISECONDS}\n\n"
+        received = PaymentRequest.objects.filter(recipient_id=user_id)
+        seen = _last_event_id(last_event_id)
+        missed = []
+        if seen is not None:
+            missed = [payment_request async for payment_request in received.filter(pk__gt=seen).select_related(
+                "sender",
+            ).order_by("pk")[:REPLAY_LIMIT]]
+        else:
+            seen = (await received.aaggregate(latest=Max("pk")))["latest"] or 0
+        account = await OnlineAccount.objects.filter(user_id=user_id).values("balance", "currency").afirst()
+        if account is not None:
+            yield pubsub.sse("balance", account, id=seen)
+        for payment_request in missed:
+            seen = payment_request.pk
+            yield pubsub.sse("payment_request", _payment_request_data(payment_request), id=seen)
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                event, data = await asyncio.wait_for(queue.get(), min(HEARTBEAT_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+            else:
+                if event != "payment_request":
+                    yield pubsub.sse(event, data)
+                elif data["id"] > seen:
+                    # not already replayed from the database
+                    seen = data["id"]
+                    yield pubsub.sse(event, data, id=seen)
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from payapp import ledger
+
+
+class Command(BaseCommand):
+    help = 'Fill in the running balance of journal lines and transaction history rows written before it was recorded'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched and updated per batch')
+
+    def handle(self, *args, **options):
+        lines, history = ledger.backfill_running_balances(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Filled in {lines} journal line and {history} history row balances.'
+        ))
@@ -0,0 +1,197 @@
+import asyncio
+import importlib
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import Client, RequestFactory, override_settings
+from django.urls import clear_url_caches, reverse
+
+from payapp import ledger
+from payapp.factories import PaymentRequestFactory, TransactionHistoryFactory
+from payapp.models import TransactionHistory
+from register.factories import CustomUserFactory
+from webapps2024.utils.benchmark import scratch_database
+
+PAGES = ('user_dashboard', 'all_reansaction_history', 'payment_request_list')
+URLCONFS = ('payapp.urls', 'register.urls')
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent throughput of the read-heavy pages under WSGI and under the ASGI profile'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='WSGI worker threads / ASGI event loops')
+        parser.add_argument('--concurrency', type=int, default=16, help='Requests in flight per ASGI event loop')
+        parser.add_argument('--requests', type=int, default=400, help='Requests per page and profile')
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--history', type=int, default=100, help='Transaction history rows per user')
+        parser.add_argument(
+            '--db-latency-ms', type=float, default=0.0,
+            help='Simulated network round trip added to every query, as with a database on another host',
+        )
+
+    def handle(self, *args, **options):
+        static = override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+        with static, scratch_database(), _query_latency(options['db_latency_ms'] / 1000):
+            cookies = self._seed(options['users'], options['history'])
+            rows = []
+            for page in PAGES:
+                with _profile(ASYNC_READ_VIEWS=False):
+                    path = reverse(page)
+                    wsgi = self._run_wsgi(path, cookies, options)
+                asgi_middleware = [name for name in settings.MIDDLEWARE if 'whitenoise' not in name]
+                with _profile(ASYNC_READ_VIEWS=True, MIDDLEWARE=asgi_middleware):
+                    asgi = self._run_asgi(path, cookies, options)
+                rows.append((page, wsgi, asgi))
+
+        self.stdout.write(
+            f"workers: {options['workers']}, ASGI concurrency: {options['concurrency']}, "
+            f"simulated query latency: {options['db_latency_ms']} ms"
+        )
+        self.stdout.write(f"{'page':<26} {'WSGI req/s':>11} {'ASGI req/s':>11} {'gain':>7} {'WSGI p95':>9} {'ASGI p95':>9}")
+        for page, wsgi, asgi in rows:
+            self.stdout.write(
+                f"{page:<26} {wsgi['throughput']:>11.1f} {asgi['throughput']:>11.1f} "
+                f"{asgi['throughput'] / wsgi['throughput']:>6.2f}x {wsgi['p95_ms']:>8.1f}ms {asgi['p95_ms']:>8.1f}ms"
+            )
+
+    def _seed(self, count, history):
+        users = CustomUserFactory.create_batch(count)
+        for user in users:
+            ledger.open_account(user, 'USD', '1000.00')
+        TransactionHistory.objects.bulk_create(
+            TransactionHistoryFactory.build(sender=user, recipient=users[(i + 1) % count])
+            for i, user in enumerate(users) for _ in range(history)
+        )
+        for i, user in enumerate(users):
+            PaymentRequestFactory.create_batch(3, sender=users[(i + 1) % count], recipient=user)
+
+        cookies = []
+        for user in users:
+            client = Client()
+            client.force_login(user)
+            cookies.append(f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}')
+        return cookies
+
+    def _run_wsgi(self, path, cookies, options):
+        handler = WSGIHandler()
+        factory = RequestFactory()
+
+        def get(i):
+            environ = factory.get(path, HTTP_COOKIE=cookies[i % len(cookies)]).environ
+            statuses = []
+            started = time.perf_counter()
+            body = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+            b''.join(body)
+            body.close()
+            assert statuses[0].startswith('200'), statuses[0]
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            latencies = list(pool.map(get, range(options['requests'])))
+        return _summary(latencies, time.perf_counter() - started)
+
+    def _run_asgi(self, path, cookies, options):
+        handler = ASGIHandler()
+
+        async def get(i, semaphore):
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+                'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+                'query_string': b'', 'root_path': '', 'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+                'headers': [(b'host', b'testserver'), (b'cookie', cookies[i % len(cookies)].encode())],
+            }
+            statuses = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+
+            async with semaphore:
+                started = time.perf_counter()
+                await handler(scope, receive, send)
+                assert statuses[0] == 200, statuses[0]
+                return time.perf_counter() - started
+
+        async def event_loop(indexes):
+            semaphore = asyncio.Semaphore(options['concurrency'])
+            return await asyncio.gather(*(get(i, semaphore) for i in indexes))
+
+        latencies = []
+        lock = threading.Lock()
+
+        def worker(indexes):
+            result = asyncio.run(event_loop(indexes))
+            with lock:
+                latencies.extend(result)
+
+        started = time.perf_counter()
+        workers = [
+            threading.Thread(target=worker, args=(range(w, options['requests'], options['workers']),))
+            for w in range(options['workers'])
+        ]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return _summary(latencies, time.perf_counter() - started)
+
+
+@contextmanager
+def _profile(**overrides):
+    """Apply a settings profile, re-importing the URLconfs that depend on it."""
+    try:
+        with override_settings(**overrides):
+            _reload_urlconfs()
+            yield
+    finally:
+        _reload_urlconfs()
+
+
+def _reload_urlconfs():
+    for name in (*URLCONFS, settings.ROOT_URLCONF):
+        importlib.reload(importlib.import_module(name))
+    clear_url_caches()
+
+
+@contextmanager
+def _query_latency(seconds):
+    if not seconds:
+        yield
+        return
+
+    def delay(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def install(sender=None, connection=None, **kwargs):
+        if delay not in connection.execute_wrappers:
+            connection.execute_wrappers.append(delay)
+
+    connection_created.connect(install)
+    for connection in connections.all():
+        install(connection=connection)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(install)
+
+
+def _summary(latencies, elapsed):
+    return {
+        'throughput': len(latencies) / elapsed,
+        'p95_ms': statistics.quantiles(latencies, n=20, method='inclusive')[18] * 1000,
+    }
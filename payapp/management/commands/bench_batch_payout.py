@@ -0,0 +1,64 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.urls import reverse
+
+from payapp import ledger
+from register.models import CustomUser, OnlineAccount, UserProfile
+from webapps2024.utils.benchmark import scratch_database
+from webapps2024.utils.choices import CURRENCY_CHOICES
+
+
+class Command(BaseCommand):
+    help = 'Benchmark batch payouts through the ledger service and the batch transfer API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=2000, help='Payout items per batch')
+        parser.add_argument('--recipients', type=int, default=500, help='Distinct recipients')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with scratch_database():
+            payer, emails = self._seed(options['recipients'])
+            items = [
+                (rng.choice(emails), Decimal(rng.randint(100, 5000)) / 100, None)
+                for _ in range(options['items'])
+            ]
+
+            started = time.perf_counter()
+            results = ledger.transfer_many(payer, items)
+            service_elapsed = time.perf_counter() - started
+            failed = sum(1 for result in results if result['status'] != 'ok')
+
+            client = Client()
+            client.force_login(payer)
+            payload = {'items': [
+                {'recipient_email': email, 'amount': str(amount)} for email, amount, _ in items
+            ]}
+            started = time.perf_counter()
+            response = client.post(reverse('batch_transfer'), payload, content_type='application/json')
+            api_elapsed = time.perf_counter() - started
+
+        self.stdout.write(f"items per batch:  {options['items']}")
+        self.stdout.write(f"recipients:       {options['recipients']}")
+        self.stdout.write(f"service:          {service_elapsed:.3f}s ({options['items'] / service_elapsed:.0f} items/sec, {failed} failed)")
+        self.stdout.write(f"api:              {api_elapsed:.3f}s ({options['items'] / api_elapsed:.0f} items/sec, HTTP {response.status_code})")
+
+    def _seed(self, count):
+        payer = CustomUser.objects.create_user(email='payer@example.com', username='payer')
+        OnlineAccount.objects.create(user=payer, currency='USD', balance=Decimal('99999999.00'))
+
+        # bulk inserts skip the post_save profile signal, which is not needed here
+        users = CustomUser.objects.bulk_create(
+            CustomUser(email=f'payee{i}@example.com', username=f'payee{i}', password='!') for i in range(count)
+        )
+        currencies = [choice for choice, _ in CURRENCY_CHOICES.choices]
+        OnlineAccount.objects.bulk_create(
+            OnlineAccount(user=user, currency=currencies[i % len(currencies)]) for i, user in enumerate(users)
+        )
+        UserProfile.objects.bulk_create(UserProfile(user=user) for user in users)
+        return payer, [user.email for user in users]
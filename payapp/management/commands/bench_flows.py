@@ -0,0 +1,222 @@
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+import django
+import factory.random
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from payapp import ledger
+from payapp.factories import CardFactory, PaymentRequestFactory, TransactionHistoryFactory
+from payapp.models import TransactionHistory
+from register.factories import DEFAULT_PASSWORD, BankAccountFactory, CustomUserFactory
+from webapps2024.utils.benchmark import scratch_database
+from webapps2024.utils.choices import CURRENCY_CHOICES
+
+FLOWS = (
+    'login', 'dashboard', 'deposit_bank', 'deposit_card', 'send_money',
+    'request_money', 'respond_to_request', 'withdraw',
+)
+
+
+class Command(BaseCommand):
+    help = 'Drive the main money flows through the test client and report per-view latency and SQL query counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Synthetic users to seed')
+        parser.add_argument('--history', type=int, default=50, help='Transaction history rows per user')
+        parser.add_argument('--iterations', type=int, default=100, help='Requests per flow')
+        parser.add_argument('--flows', nargs='+', choices=FLOWS, default=FLOWS)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Where to save the JSON results (default: bench-results/flows-<commit>.json)')
+        parser.add_argument('--compare', help='Earlier JSON results to diff against')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 2 or options['users'] < 2:
+            raise CommandError('Need at least 2 users and 2 iterations.')
+        random.seed(options['seed'])
+        factory.random.reseed_random(options['seed'])
+
+        samples = defaultdict(list)
+        # templates are rendered without a collectstatic manifest
+        with override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'), \
+                scratch_database():
+            users = self._seed(options['users'], options['history'], options['iterations'])
+            clients = {}
+            for user in users:
+                clients[user.pk] = Client()
+                clients[user.pk].force_login(user)
+            for flow in options['flows']:
+                run = getattr(self, f'_flow_{flow}')
+                for i in range(options['iterations']):
+                    user, other = users[i % len(users)], users[(i + 1) % len(users)]
+                    run(samples, clients, user, other, i)
+
+        results = {
+            'commit': _git_commit(),
+            'recorded_at': datetime.now(timezone.utc).isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+            },
+            'options': {key: options[key] for key in ('users', 'history', 'iterations', 'seed')},
+            'views': {view: _summarise(timings) for view, timings in samples.items()},
+        }
+        self._report(results['views'])
+
+        output = Path(options['output'] or Path(settings.BASE_DIR) / 'bench-results' / f"flows-{results['commit'] or 'local'}.json")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+        self.stdout.write(f'Results saved to {output}')
+
+        if options['compare']:
+            self._compare(json.loads(Path(options['compare']).read_text())['views'], results['views'])
+
+    def _seed(self, count, history, iterations):
+        users = CustomUserFactory.create_batch(count)
+        currencies = CURRENCY_CHOICES.values
+        self._banks, self._cards = {}, {}
+        for i, user in enumerate(users):
+            ledger.open_account(user, currencies[i % len(currencies)], '100000.00')
+            self._banks[user.pk] = BankAccountFactory(user=user).pk
+            self._cards[user.pk] = CardFactory(user=user).pk
+        TransactionHistory.objects.bulk_create(
+            TransactionHistoryFactory.build(sender=user, recipient=users[(i + 1) % count])
+            for i, user in enumerate(users) for _ in range(history)
+        )
+        # one pending request for every respond_to_request iteration
+        self._requests = [
+            PaymentRequestFactory(sender=users[(i + 1) % count], recipient=users[i % count]).pk
+            for i in range(iterations)
+        ]
+        return users
+
+    def _timed(self, samples, view, call, expected=(200, 302)):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = call()
+            elapsed = time.perf_counter() - started
+        if response.status_code not in expected:
+            raise CommandError(f'{view} returned HTTP {response.status_code}')
+        # a fast failure is not a result worth timing
+        if response.status_code == 302 and response.url == reverse('payment_failed'):
+            raise CommandError(f'{view} redirected to payment_failed')
+        samples[view].append((elapsed, len(queries)))
+        return response
+
+    def _flow_login(self, samples, clients, user, other, i):
+        client = Client()
+        self._timed(samples, 'user_login', lambda: client.post(
+            reverse('user_login'), {'email': user.email, 'password': DEFAULT_PASSWORD},
+        ))
+
+    def _flow_dashboard(self, samples, clients, user, other, i):
+        client = clients[user.pk]
+        self._timed(samples, 'user_dashboard', lambda: client.get(reverse('user_dashboard')), expected=(200,))
+
+    def _flow_deposit_bank(self, samples, clients, user, other, i):
+        client = clients[user.pk]
+        self._timed(samples, 'deposite_money', lambda: client.post(
+            reverse('deposite_money'), {'payment_method': 'Bank Account', 'amount': '10.00'},
+        ))
+        self._timed(samples, 'bank_selection', lambda: client.post(
+            reverse('bank_selection'), {'bank_account': self._banks[user.pk]},
+        ))
+
+    def _flow_deposit_card(self, samples, clients, user, other, i):
+        client = clients[user.pk]
+        self._timed(samples, 'deposite_money', lambda: client.post(
+            reverse('deposite_money'), {'payment_method': 'Credit or Debit Cards', 'amount': '10.00'},
+        ))
+        self._timed(samples, 'card_selection', lambda: client.post(
+            reverse('card_selection'), {'card': self._cards[user.pk]},
+        ))
+
+    def _flow_send_money(self, samples, clients, user, other, i):
+        client = clients[user.pk]
+        self._timed(samples, 'directpayment_or_send_money', lambda: client.post(
+            reverse('directpayment_or_send_money'), {'recipient_email': other.email, 'amount': '1.00'},
+        ))
+        self._timed(samples, 'directpayment_confirmation', lambda: client.post(
+            reverse('directpayment_confirmation'), {},
+        ))
+
+    def _flow_request_money(self, samples, clients, user, other, i):
+        client = clients[user.pk]
+        self._timed(samples, 'request_money', lambda: client.post(reverse('request_money'), {
+            'recipient_email': other.email, 'amount': '2.00', 'message': 'Benchmark', 'currency': 'USD',
+        }))
+
+    def _flow_respond_to_request(self, samples, clients, user, other, i):
+        client = clients[user.pk]
+        self._timed(samples, 'respond_to_payment_request', lambda: client.post(
+            reverse('respond_to_payment_request', kwargs={'pk': self._requests[i]}), {'action': 'accepted'},
+        ))
+
+    def _flow_withdraw(self, samples, clients, user, other, i):
+        client = clients[user.pk]
+        self._timed(samples, 'withdraw_money_confirm', lambda: client.post(
+            reverse('withdraw_money_confirm'), {'bank_account': self._banks[user.pk], 'amount': '1.00'},
+        ))
+
+    def _report(self, views):
+        self.stdout.write(f"{'view':<30} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'queries':>8}")
+        for view, stats in views.items():
+            self.stdout.write(
+                f"{view:<30} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f} "
+                f"{stats['requests_per_second']:>8.1f} {stats['queries_mean']:>8.1f}"
+            )
+
+    def _compare(self, before, after):
+        self.stdout.write('')
+        self.stdout.write(f"{'view':<30} {'p50':>9} {'p95':>9} {'queries':>9}")
+        for view, stats in after.items():
+            if view not in before:
+                continue
+            old = before[view]
+            p50 = _change(old['p50_ms'], stats['p50_ms'])
+            p95 = _change(old['p95_ms'], stats['p95_ms'])
+            queries = stats['queries_mean'] - old['queries_mean']
+            line = f'{view:<30} {p50:>+8.1f}% {p95:>+8.1f}% {queries:>+9.1f}'
+            self.stdout.write(self.style.WARNING(line) if queries > 0 or p95 > 20 else line)
+
+
+def _summarise(timings):
+    latencies = [elapsed * 1000 for elapsed, _ in timings]
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    queries = [count for _, count in timings]
+    return {
+        'requests': len(timings),
+        'p50_ms': round(cuts[49], 3),
+        'p95_ms': round(cuts[94], 3),
+        'p99_ms': round(cuts[98], 3),
+        'requests_per_second': round(len(latencies) / (sum(latencies) / 1000), 1),
+        'queries_mean': round(statistics.fmean(queries), 2),
+        'queries_max': max(queries),
+    }
+
+
+def _change(old, new):
+    return (new - old) / old * 100 if old else 0.0
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,91 @@
+import random
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test import override_settings
+
+from payapp import ledger
+from register.models import CustomUser, OnlineAccount
+from webapps2024.utils import fragments, group_commit
+from webapps2024.utils.benchmark import scratch_database
+
+MODES = ('direct', 'group')
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent transfer throughput with and without group commit'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent workers')
+        parser.add_argument('--transfers', type=int, default=100, help='Transfers per worker')
+        parser.add_argument('--accounts', type=int, default=100)
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        # the file-based fragment cache costs more per transfer than the
+        # commit; keep it in memory so that the database is what is measured
+        caches = {**settings.CACHES, fragments.ALIAS: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        for mode in options['modes']:
+            with scratch_database(), override_settings(GROUP_COMMIT=mode == 'group', CACHES=caches):
+                users = self._seed(options['accounts'])
+                try:
+                    outcomes, elapsed = self._run(users, options)
+                    writer = group_commit._writer
+                    groups = (writer.groups, writer.operations) if writer is not None else None
+                finally:
+                    group_commit.shutdown()
+            self._report(mode, outcomes, elapsed, groups)
+
+    def _seed(self, count):
+        users = []
+        for i in range(count):
+            user = CustomUser.objects.create_user(email=f'bench{i}@example.com', username=f'bench{i}')
+            OnlineAccount.objects.create(user=user, currency='USD', balance=Decimal('100000.00'))
+            users.append(user)
+        return users
+
+    def _run(self, users, options):
+        outcomes = Counter()
+        lock = threading.Lock()
+        workers = [
+            threading.Thread(target=self._worker, args=(
+                users, options['transfers'], random.Random(options['seed'] + i), outcomes, lock,
+            ))
+            for i in range(options['threads'])
+        ]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return outcomes, time.perf_counter() - started
+
+    def _worker(self, users, transfers, rng, outcomes, lock):
+        try:
+            for _ in range(transfers):
+                sender, recipient = rng.sample(users, 2)
+                try:
+                    ledger.transfer(sender, recipient, Decimal(rng.randint(100, 5000)) / 100)
+                except OperationalError:
+                    outcome = 'error'
+                else:
+                    outcome = 'ok'
+                with lock:
+                    outcomes[outcome] += 1
+        finally:
+            connection.close()
+
+    def _report(self, mode, outcomes, elapsed, groups):
+        line = (
+            f"{mode:<6}  transfers/sec {outcomes['ok'] / elapsed:8.1f}  completed {outcomes['ok']:6}"
+            f"  database errors {outcomes['error']:5}  elapsed {elapsed:6.2f}s"
+        )
+        if groups:
+            line += f'  groups {groups[0]} (mean size {groups[1] / groups[0]:.1f})'
+        self.stdout.write(line)
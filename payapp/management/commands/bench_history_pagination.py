@@ -0,0 +1,67 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from payapp.models import TransactionHistory
+from register.models import CustomUser
+from webapps2024.utils.benchmark import scratch_database
+from webapps2024.utils.pagination import encode_cursor, keyset_paginate
+
+
+class Command(BaseCommand):
+    help = 'Compare OFFSET and keyset (cursor) paging over a long transaction history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='History rows for the benchmarked user')
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per depth (best is reported)')
+
+    def handle(self, *args, **options):
+        rows, page_size = options['rows'], options['page_size']
+        with scratch_database():
+            user = CustomUser.objects.create_user(email='history@example.com', username='history')
+            started = time.perf_counter()
+            self._seed(user, rows)
+            self.stdout.write(f'seeded {rows} rows in {time.perf_counter() - started:.1f}s')
+
+            queryset = TransactionHistory.objects.filter(sender=user)
+            ordered = queryset.order_by('-created_at', '-id')
+            self.stdout.write(f"{'page':>10} {'offset ms':>10} {'keyset ms':>10}")
+            last_page = (rows - 1) // page_size
+            for page in sorted({0, 10, 100, 1000, last_page // 2, last_page}):
+                if page > last_page:
+                    continue
+                offset = page * page_size
+                cursor = encode_cursor(ordered[offset - 1]) if offset else None
+
+                offset_ms = self._best(options['repeat'], lambda: list(ordered[offset:offset + page_size]))
+                keyset_ms = self._best(options['repeat'], lambda: keyset_paginate(queryset, cursor, page_size))
+                self.stdout.write(f'{page:>10} {offset_ms:>10.2f} {keyset_ms:>10.2f}')
+
+    def _best(self, repeat, run):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+        return min(timings)
+
+    def _seed(self, user, rows, chunk=20_000):
+        # Raw executemany: auto_now_add would stamp every row with the same
+        # time, and model instances would dominate the seeding time.
+        table = TransactionHistory._meta.db_table
+        sql = (
+            f'INSERT INTO {table} (sender_id, description, status, amount, created_at) '
+            f'VALUES (%s, %s, %s, %s, %s)'
+        )
+        start = timezone.now() - timedelta(seconds=rows)
+        with transaction.atomic(), connection.cursor() as cursor:
+            for offset in range(0, rows, chunk):
+                cursor.executemany(sql, [
+                    (user.pk, 'Direct payment (sent)', '✔️', '10.00',
+                     connection.ops.adapt_datetimefield_value(start + timedelta(seconds=i)))
+                    for i in range(offset, min(offset + chunk, rows))
+                ])
@@ -0,0 +1,121 @@
+import asyncio
+import importlib
+import threading
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import clear_url_caches, reverse
+
+from payapp import ledger, live
+from register.factories import CustomUserFactory
+from webapps2024.utils import pubsub
+from webapps2024.utils.benchmark import scratch_database
+
+
+class Command(BaseCommand):
+    help = 'Hold many idle event streams on one event loop, then time pushing a balance to all of them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=2000, help='Open event streams')
+        parser.add_argument('--users', type=int, default=200, help='Distinct users; the streams are spread over them')
+        parser.add_argument('--memory', action='store_true', help='Trace allocations while opening (much slower)')
+
+    def handle(self, *args, **options):
+        asgi_middleware = [name for name in settings.MIDDLEWARE if 'whitenoise' not in name]
+        with override_settings(ASYNC_READ_VIEWS=True, MIDDLEWARE=asgi_middleware), scratch_database():
+            _reload_urlconfs()
+            try:
+                users, cookies = self._seed(options['users'])
+                path = reverse('live_events')
+                opened, per_connection, fan_out = asyncio.run(
+                    self._run(path, users, cookies, options['connections'], options['memory'])
+                )
+            finally:
+                _reload_urlconfs()
+
+        self.stdout.write(f"open streams:           {options['connections']} ({options['users']} users)")
+        self.stdout.write(f"time to open all:       {opened:.2f}s")
+        if options['memory']:
+            self.stdout.write(f"memory per idle stream: {per_connection / 1024:.1f} KiB")
+        self.stdout.write(f"push to every stream:   {fan_out * 1000:.1f} ms")
+
+    def _seed(self, count):
+        users = CustomUserFactory.create_batch(count)
+        cookies = []
+        for user in users:
+            ledger.open_account(user, 'USD', '100.00')
+            client = Client()
+            client.force_login(user)
+            cookies.append(f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}')
+        return users, cookies
+
+    async def _run(self, path, users, cookies, connections, trace_memory):
+        handler = ASGIHandler()
+        balances = [0]
+        expected = [connections]
+        done = asyncio.Event()
+        # streams stay open until the benchmark cancels them
+        live.STREAM_SECONDS = live.HEARTBEAT_SECONDS = 3600
+
+        async def send(message):
+            if message['type'] == 'http.response.body' and b'event: balance' in message.get('body', b''):
+                balances[0] += 1
+                if balances[0] >= expected[0]:
+                    done.set()
+
+        def connect(i):
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+                'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+                'query_string': b'', 'root_path': '', 'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+                'headers': [(b'host', b'testserver'), (b'cookie', cookies[i % len(cookies)].encode())],
+            }
+            requested = []
+
+            async def receive():
+                if not requested:
+                    requested.append(True)
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # the client never hangs up
+                await asyncio.Future()
+
+            return asyncio.create_task(handler(scope, receive, send))
+
+        if trace_memory:
+            tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        tasks = [connect(i) for i in range(connections)]
+        # every stream starts with the current balance
+        await done.wait()
+        opened = time.perf_counter() - started
+        per_connection = (tracemalloc.get_traced_memory()[0] - baseline) / connections
+        if trace_memory:
+            tracemalloc.stop()
+
+        done.clear()
+        expected[0] = 2 * connections
+        started = time.perf_counter()
+        # published from another thread, as the posting path does
+        publisher = threading.Thread(target=lambda: [
+            pubsub.publish(user.pk, 'balance', {'balance': '1.00', 'currency': 'USD'}) for user in users
+        ])
+        publisher.start()
+        await done.wait()
+        fan_out = time.perf_counter() - started
+        publisher.join()
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return opened, per_connection, fan_out
+
+
+def _reload_urlconfs():
+    for name in ('payapp.urls', 'register.urls', settings.ROOT_URLCONF):
+        importlib.reload(importlib.import_module(name))
+    clear_url_caches()
@@ -0,0 +1,102 @@
+import statistics
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test import override_settings
+
+from payapp import ledger, outbox
+from payapp.models import OutboxMessage
+from register.models import CustomUser, OnlineAccount
+from webapps2024.utils.benchmark import scratch_database
+
+MODES = ('none', 'inline', 'outbox')
+
+
+class SlowChannel:
+    """Stands in for a mail server or webhook that takes ``seconds`` per message."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def deliver(self, messages):
+        time.sleep(self.seconds * len(messages))
+        return {}
+
+
+class Command(BaseCommand):
+    help = 'Compare transfer latency without notifications, with inline delivery and through the outbox worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transfers', type=int, default=200, help='Transfers per mode')
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--delivery-ms', type=float, default=20.0, help='Simulated cost of delivering one message')
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+
+    def handle(self, *args, **options):
+        channels = {name: SlowChannel(options['delivery_ms'] / 1000) for name in outbox.channel_names()}
+        with scratch_database():
+            users = self._seed(options['users'])
+            for mode in options['modes']:
+                latencies, drained = self._run(mode, users, options['transfers'], channels)
+                self._report(mode, latencies, drained)
+
+    def _seed(self, count):
+        users = []
+        for i in range(count):
+            user = CustomUser.objects.create_user(email=f'bench{i}@example.com', username=f'bench{i}')
+            OnlineAccount.objects.create(user=user, currency='USD', balance=Decimal('1000000.00'))
+            users.append(user)
+        return users
+
+    def _run(self, mode, users, transfers, channels):
+        """Time each transfer; return the latencies and how long delivery lagged behind the last one."""
+        OutboxMessage.objects.all().delete()
+        stop = threading.Event()
+        worker = None
+        if mode == 'outbox':
+            worker = threading.Thread(target=self._worker, args=(channels, stop))
+            worker.start()
+
+        latencies = []
+        # queue on the same channel names; the slow channels deliver them
+        with override_settings(OUTBOX_CHANNELS={} if mode == 'none' else {name: '' for name in channels}):
+            for i in range(transfers):
+                sender, recipient = users[i % len(users)], users[(i + 1) % len(users)]
+                started = time.perf_counter()
+                ledger.transfer(sender, recipient, '1.00')
+                if mode == 'inline':
+                    # what delivering in the request would cost
+                    outbox.deliver_due(channels=channels)
+                latencies.append(time.perf_counter() - started)
+
+        finished = time.perf_counter()
+        if worker is not None:
+            stop.set()
+            worker.join()
+        return latencies, time.perf_counter() - finished
+
+    def _worker(self, channels, stop):
+        try:
+            while True:
+                try:
+                    sent, failed = outbox.deliver_due(channels=channels)
+                except OperationalError:
+                    sent = failed = 0
+                if sent + failed == 0:
+                    if stop.is_set() and not OutboxMessage.objects.exists():
+                        return
+                    time.sleep(0.01)
+        finally:
+            connection.close()
+
+    def _report(self, mode, latencies, drained):
+        latencies = sorted(seconds * 1000 for seconds in latencies)
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        self.stdout.write(
+            f'{mode:<7} transfers: {len(latencies)}  mean {statistics.mean(latencies):7.2f} ms'
+            f'  p50 {statistics.median(latencies):7.2f} ms  p95 {p95:7.2f} ms'
+            + (f'  queue drained {drained:.2f}s after the last transfer' if mode == 'outbox' else '')
+        )
@@ -0,0 +1,91 @@
+import random
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+
+from payapp import ledger
+from register.models import CustomUser, OnlineAccount
+from webapps2024.utils.benchmark import scratch_database
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent transfers between a small set of hot accounts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Number of concurrent workers')
+        parser.add_argument('--transfers', type=int, default=250, help='Transfers per worker')
+        parser.add_argument('--accounts', type=int, default=4, help='Number of contended accounts')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            users = self._seed(options['accounts'])
+            initial = self._balances()
+
+            deltas = Counter()
+            outcomes = Counter()
+            lock = threading.Lock()
+            workers = [
+                threading.Thread(
+                    target=self._worker,
+                    args=(users, options['transfers'], random.Random(options['seed'] + i), deltas, outcomes, lock),
+                )
+                for i in range(options['threads'])
+            ]
+            started = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - started
+
+            final = self._balances()
+            lost = [user_id for user_id in initial if initial[user_id] + deltas[user_id] != final[user_id]]
+
+        self.stdout.write(f"workers:            {options['threads']}")
+        self.stdout.write(f"contended accounts: {options['accounts']}")
+        self.stdout.write(f"completed:          {outcomes['ok']}")
+        self.stdout.write(f"insufficient funds: {outcomes['insufficient']}")
+        self.stdout.write(f"database errors:    {outcomes['error']}")
+        self.stdout.write(f"elapsed:            {elapsed:.3f}s")
+        self.stdout.write(f"transfers/sec:      {outcomes['ok'] / elapsed:.1f}")
+        if lost:
+            self.stdout.write(self.style.ERROR(f'Lost updates detected on accounts {lost}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No lost updates: every balance matches its postings.'))
+
+    def _seed(self, count):
+        users = []
+        for i in range(count):
+            user = CustomUser.objects.create_user(email=f'bench{i}@example.com', username=f'bench{i}')
+            OnlineAccount.objects.create(user=user, currency='USD', balance=Decimal('100000.00'))
+            users.append(user)
+        return users
+
+    def _balances(self):
+        return dict(OnlineAccount.objects.values_list('user_id', 'balance'))
+
+    def _worker(self, users, transfers, rng, deltas, outcomes, lock):
+        try:
+            for _ in range(transfers):
+                sender, recipient = rng.sample(users, 2)
+                amount = Decimal(rng.randint(100, 5000)) / 100
+                try:
+                    ledger.transfer(sender, recipient, amount)
+                except ledger.InsufficientFunds:
+                    outcome = 'insufficient'
+                except OperationalError:
+                    outcome = 'error'
+                else:
+                    outcome = 'ok'
+                with lock:
+                    outcomes[outcome] += 1
+                    if outcome == 'ok':
+                        deltas[sender.pk] -= amount
+                        deltas[recipient.pk] += amount
+        finally:
+            connection.close()
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from payapp import ledger
+from register.models import OnlineAccount
+
+
+class Command(BaseCommand):
+    help = 'Verify online account balances against the journal and record new balance checkpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify-only', action='store_true', help='Report drift without writing checkpoints')
+
+    def handle(self, *args, **options):
+        checked = drifted = 0
+        for account in OnlineAccount.objects.only('pk', 'balance').iterator(chunk_size=500):
+            checked += 1
+            rebuilt = ledger.rebuild_balance(account)
+            if rebuilt != account.balance:
+                drifted += 1
+                self.stdout.write(self.style.WARNING(
+                    f'Account {account.pk}: stored balance {account.balance}, journal says {rebuilt}'
+                ))
+                # never checkpoint a balance the journal disagrees with
+                continue
+            if not options['verify_only']:
+                ledger.checkpoint(account)
+
+        if drifted:
+            self.stdout.write(self.style.ERROR(f'{drifted} of {checked} accounts disagree with the journal.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'All {checked} account balances match the journal.'))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError
+
+from payapp import outbox
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued notifications until stopped, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=outbox.BATCH_SIZE, help='Messages claimed at a time')
+        parser.add_argument('--poll-seconds', type=float, default=1.0, help='Wait between polls when nothing is due')
+        parser.add_argument('--once', action='store_true', help='Deliver what is due now, then exit')
+
+    def handle(self, *args, **options):
+        delivered = failed = 0
+        try:
+            while True:
+                try:
+                    sent, errors = outbox.deliver_due(options['batch_size'])
+                except OperationalError as exc:
+                    # SQLite reports a busy database instead of waiting when
+                    # the claim runs into a posting; try again shortly
+                    self.stderr.write(f'Database busy: {exc}')
+                    sent, errors = 0, 0
+                delivered += sent
+                failed += errors
+                if sent + errors < options['batch_size']:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_seconds'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Delivered {delivered} messages, {failed} failed.'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payapp import statements
+from register.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Stream transaction history as CSV or JSON lines, for one user or for every account'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Email of the account to export; every account when omitted')
+        parser.add_argument('--from', dest='from', help='First day to include (YYYY-MM-DD)')
+        parser.add_argument('--to', help='Last day to include (YYYY-MM-DD)')
+        parser.add_argument('--format', choices=sorted(statements.FORMATS), default='csv')
+        parser.add_argument('--output', help='File to write; standard output when omitted')
+        parser.add_argument('--chunk-size', type=int, default=statements.CHUNK_SIZE, help='Rows fetched per batch')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = CustomUser.objects.get(email=options['user'])
+            except CustomUser.DoesNotExist:
+                raise CommandError(f"No user with email {options['user']}.")
+        try:
+            start, end = statements.parse_date_range(options)
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        rows = statements.statement_rows(user, start, end)
+        chunks = statements.render(rows, options['format'], options['chunk_size'])
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            output.writelines(chunks)
+        self.stderr.write(self.style.SUCCESS(f"Statement written to {options['output']}."))
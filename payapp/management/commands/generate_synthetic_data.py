@@ -0,0 +1,430 @@
+import multiprocessing
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import lru_cache
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+from faker import Faker
+
+from payapp import payment_requests
+from payapp.models import (
+    BalanceCheckpoint, Card, JournalEntry, JournalLine, MonthlyRollup, PaymentRequest, TransactionHistory,
+)
+from register.factories import _hashed_password
+from register.models import BankAccount, CustomUser, OnlineAccount, UserProfile
+from webapps2024.utils import fragments
+from webapps2024.utils.choices import (
+    BankNames, CARD_TYPE, CURRENCY_CHOICES, FLOW_DIRECTION, SYSTEM_ACCOUNT, TRANSACTION_STATUS, TRASACTION_TYPE_CHOICES,
+)
+
+# Share of accounts per currency, and of payment requests per status.
+CURRENCY_MIX = {CURRENCY_CHOICES.US_DOLLAR: 0.6, CURRENCY_CHOICES.EUROS: 0.25, CURRENCY_CHOICES.POUND: 0.15}
+REQUEST_STATUS_MIX = {TRANSACTION_STATUS.SUCCESS: 0.6, TRANSACTION_STATUS.FAILED: 0.25, TRANSACTION_STATUS.PENDING: 0.15}
+
+# How many bank accounts and cards a user has, by share of users.
+BANK_ACCOUNTS_MIX = {0: 0.3, 1: 0.5, 2: 0.2}
+CARDS_MIX = {0: 0.4, 1: 0.45, 2: 0.15}
+
+# Kinds of history row, by share of postings. A transfer writes two rows,
+# one for each side.
+HISTORY_MIX = {'transfer': 0.7, 'deposit': 0.2, 'withdrawal': 0.1}
+
+# History rows of money leaving the account; the others brought it in.
+OUTGOING = {'Transfer (sent)', 'Withdrawal to bank account'}
+
+# The kind of journal entry each history row is posted as.
+JOURNALED = {
+    'Transfer (sent)': TRASACTION_TYPE_CHOICES.TRANSFER,
+    'Transfer (received)': TRASACTION_TYPE_CHOICES.TRANSFER,
+    'Deposit from bank account': TRASACTION_TYPE_CHOICES.DEPOSITE,
+    'Withdrawal to bank account': TRASACTION_TYPE_CHOICES.WITHDRAWAL,
+}
+
+# Users counted per query when the pending request counters are rebuilt.
+RECOUNT_CHUNK = 5000
+
+# Users whose history is replayed per transaction when the running balances
+# and monthly rollups are filled in.
+REPLAY_CHUNK = 1000
+
+# Faker values are drawn once into pools of this size; calling Faker per
+# row would take longer than writing the rows.
+POOL_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with synthetic users, accounts, cards, transaction history and payment requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--history', type=int, default=1_000_000, help='Transaction history rows')
+        parser.add_argument('--payment-requests', type=int, default=100_000)
+        parser.add_argument('--days', type=int, default=365, help='History and requests are spread over this many days')
+        parser.add_argument('--batch-size', type=int, default=50_000, help='Rows written per transaction')
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes generating and writing batches')
+        parser.add_argument('--prefix', default='synth', help='Username and email prefix of the generated users')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        using, users = options['database'], options['users']
+        if users < 2:
+            raise CommandError('Need at least 2 users.')
+        if CustomUser.objects.using(using).filter(username__startswith=options['prefix']).exists():
+            raise CommandError(f"Users named {options['prefix']}* exist already; pass another --prefix.")
+
+        # ids are assigned here rather than by the database, so that every
+        # batch knows them without reading any back
+        first_id = (CustomUser.objects.using(using).aggregate(last=Max('pk'))['last'] or 0) + 1
+        first_account_id = (OnlineAccount.objects.using(using).aggregate(last=Max('pk'))['last'] or 0) + 1
+        plan = {
+            'using': using, 'first_id': first_id, 'first_account_id': first_account_id,
+            'users': users, 'prefix': options['prefix'],
+            'seed': options['seed'], 'days': options['days'], 'now': timezone.now(),
+        }
+        batch = options['batch_size']
+        started = time.perf_counter()
+
+        # users first: the other rows point at them
+        self._run_phase('users', plan, [
+            ('users', start, min(batch // 5, users - start)) for start in range(0, users, batch // 5)
+        ], options['processes'])
+        with _deferred_indexes([TransactionHistory, PaymentRequest], using):
+            self._run_phase('history and payment requests', plan, [
+                *(('history', start, min(batch, options['history'] - start))
+                  for start in range(0, options['history'], batch)),
+                *(('payment_requests', start, min(batch, options['payment_requests'] - start))
+                  for start in range(0, options['payment_requests'], batch)),
+            ], options['processes'])
+            phase_started = time.perf_counter()
+        self.stdout.write(f'indexes: {time.perf_counter() - phase_started:.1f}s')
+
+        phase_started = time.perf_counter()
+        with _deferred_indexes([JournalEntry, JournalLine], using):
+            _replay_history(plan)
+        self.stdout.write(f'journal, balances and rollups: {time.perf_counter() - phase_started:.1f}s')
+
+        phase_started = time.perf_counter()
+        self._finish(plan)
+        self.stdout.write(f'counters and statistics: {time.perf_counter() - phase_started:.1f}s')
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {users} users, {options['history']} history rows and "
+            f"{options['payment_requests']} payment requests in {time.perf_counter() - started:.1f}s."
+        ))
+
+    def _run_phase(self, name, plan, tasks, processes):
+        started = time.perf_counter()
+        if processes > 1:
+            # children must not share the parent's database connections
+            connections.close_all()
+            with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(plan['using'],)) as pool:
+                for _ in pool.imap_unordered(_write_batch, [(plan, *task) for task in tasks]):
+                    pass
+        else:
+            _init_worker(plan['using'])
+            for task in tasks:
+                _write_batch((plan, *task))
+        self.stdout.write(f'{name}: {time.perf_counter() - started:.1f}s')
+
+    def _finish(self, plan):
+        using, first_id, users = plan['using'], plan['first_id'], plan['users']
+        connection = connections[using]
+        ids = range(first_id, first_id + users)
+        for start in range(0, users, RECOUNT_CHUNK):
+            payment_requests.recount(ids[start:start + RECOUNT_CHUNK])
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [CustomUser, OnlineAccount, JournalEntry]):
+                cursor.execute(sql)
+            # refresh the planner's statistics, and the admin's row estimates
+            if connection.vendor in ('sqlite', 'postgresql'):
+                for model in (CustomUser, TransactionHistory, PaymentRequest):
+                    cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+        # the post_save signals that start each user's widget version were skipped
+        fragments.invalidate(*ids)
+
+
+def _init_worker(using):
+    if not apps.ready:
+        django.setup()
+    connection = connections[using]
+    # pragmas cannot change inside a transaction, as when called from a test
+    if connection.vendor == 'sqlite' and not connection.in_atomic_block:
+        with connection.cursor() as cursor:
+            # durable against crashes of this process, not of the machine;
+            # applies to this connection only
+            cursor.execute('PRAGMA synchronous = OFF')
+            cursor.execute('PRAGMA cache_size = -262144')
+            # other workers hold the write lock while they write a batch
+            cursor.execute('PRAGMA busy_timeout = 600000')
+
+
+def _write_batch(task):
+    """Generate and write one batch of ``count`` ``kind`` rows, numbered from ``start``."""
+    plan, kind, start, count = task
+    rng = random.Random(f"{plan['seed']}:{kind}:{start}")
+    generate = {'users': _users, 'history': _history, 'payment_requests': _payment_requests}[kind]
+    # generated before the transaction starts, so that parallel workers
+    # hold SQLite's write lock only while inserting
+    tables = generate(plan, rng, _pools(plan['seed']), start, count)
+    with transaction.atomic(using=plan['using']):
+        for model, field_names, rows in tables:
+            _insert(plan['using'], model, field_names, rows)
+
+
+@lru_cache
+def _pools(seed):
+    fake = Faker()
+    fake.seed_instance(seed)
+    return {
+        'first_name': [fake.first_name() for _ in range(POOL_SIZE)],
+        'last_name': [fake.last_name() for _ in range(POOL_SIZE)],
+        'address': [fake.street_address() for _ in range(POOL_SIZE)],
+        'message': [fake.sentence(nb_words=6) for _ in range(POOL_SIZE)],
+    }
+
+
+def _pick(rng, mix, count=1):
+    return rng.choices(list(mix), weights=list(mix.values()), k=count)
+
+
+def _digits(rng, length):
+    return str(rng.randrange(10 ** (length - 1), 10 ** length))
+
+
+def _amount(rng, mu=3.0, sigma=1.2):
+    """A log-normally distributed amount: mostly tens, sometimes thousands."""
+    return Decimal(min(rng.lognormvariate(mu, sigma), 99_999)).quantize(Decimal('0.01')) + Decimal('0.01')
+
+
+def _user_id(rng, plan):
+    """A user id, skewed so that a few users account for most of the activity."""
+    return plan['first_id'] + min(int(plan['users'] * rng.random() ** 3), plan['users'] - 1)
+
+
+def _moment(rng, plan):
+    return plan['now'] - timedelta(seconds=rng.random() * plan['days'] * 86400)
+
+
+def _users(plan, rng, pools, start, count):
+    # written straight to the tables, so none of the post_save signals that
+    # create a profile per user fire; the profiles are written here instead
+    using, prefix = plan['using'], plan['prefix']
+    adapt, adapt_date = connections[using].ops.adapt_datetimefield_value, connections[using].ops.adapt_datefield_value
+    password, today = _hashed_password(), plan['now'].date()
+    users, accounts, checkpoints, profiles, bank_accounts, cards = [], [], [], [], [], []
+    currencies = _pick(rng, CURRENCY_MIX, count)
+    bank_account_counts = _pick(rng, BANK_ACCOUNTS_MIX, count)
+    card_counts = _pick(rng, CARDS_MIX, count)
+    for i in range(start, start + count):
+        user_id, account_id = plan['first_id'] + i, plan['first_account_id'] + i
+        joined = adapt(_moment(rng, plan))
+        balance = _amount(rng, mu=6)
+        users.append((user_id, password, False, f'{prefix}{i}', rng.choice(pools['first_name']),
+                      rng.choice(pools['last_name']), f'{prefix}{i}@example.com', False, True, joined))
+        accounts.append((account_id, user_id, currencies[i - start], balance, joined))
+        # the opening balances are checkpointed rather than journaled, so that
+        # ledger.rebuild_balance() agrees with them without a journal entry per user
+        checkpoints.append((account_id, balance, 0, joined))
+        profiles.append((user_id, str(uuid.UUID(int=rng.getrandbits(128), version=4)), rng.choice(pools['address']),
+                         f'+1{_digits(rng, 10)}', account_id, joined))
+        bank_accounts.extend(
+            (user_id, rng.choice(BankNames.values), _digits(rng, 10), _digits(rng, 4), joined)
+            for _ in range(bank_account_counts[i - start])
+        )
+        cards.extend(
+            (user_id, rng.choice(CARD_TYPE.values), Decimal('10000.00'), _digits(rng, 10),
+             adapt_date(today + timedelta(days=rng.randrange(30, 5 * 365))), _digits(rng, 3), joined)
+            for _ in range(card_counts[i - start])
+        )
+    return [
+        (CustomUser, ['id', 'password', 'is_superuser', 'username', 'first_name', 'last_name', 'email',
+                      'is_staff', 'is_active', 'date_joined'], users),
+        (OnlineAccount, ['id', 'user', 'currency', 'balance', 'created_at'], accounts),
+        (BalanceCheckpoint, ['account', 'balance', 'last_line_id', 'created_at'], checkpoints),
+        (UserProfile, ['user', 'payapp_account', 'address', 'phone_number', 'online_account', 'created_at'],
+         profiles),
+        (BankAccount, ['user', 'bank_name', 'account_number', 'pin', 'created_at'], bank_accounts),
+        (Card, ['user', 'card_type', 'amount', 'card_number', 'expiration_date', 'cvv', 'created_at'], cards),
+    ]
+
+
+def _insert(using, model, field_names, rows):
+    """
+    INSERT ``rows`` of ``field_names`` values with one ``executemany()``.
+
+    ``bulk_create()`` splits its batches to fit SQLite's 999 parameters,
+    builds and compiles a model instance per row and overwrites
+    ``created_at`` (``auto_now_add``); it is several times slower here.
+    """
+    connection = connections[using]
+    columns = ', '.join(connection.ops.quote_name(model._meta.get_field(name).column) for name in field_names)
+    placeholders = ', '.join(['%s'] * len(field_names))
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {connection.ops.quote_name(model._meta.db_table)} ({columns}) VALUES ({placeholders})', rows,
+        )
+
+
+def _update(using, model, field_names, key_names, rows):
+    """UPDATE ``field_names`` by ``key_names``, both in ``rows``, with one ``executemany()``."""
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    assignments = ', '.join(f'{quote(model._meta.get_field(name).column)} = %s' for name in field_names)
+    keys = ' AND '.join(f'{quote(model._meta.get_field(name).column)} = %s' for name in key_names)
+    with connection.cursor() as cursor:
+        cursor.executemany(f'UPDATE {quote(model._meta.db_table)} SET {assignments} WHERE {keys}', rows)
+
+
+def _history(plan, rng, pools, start, count):
+    adapt = connections[plan['using']].ops.adapt_datetimefield_value
+    rows = []
+    while len(rows) < count:
+        kind = _pick(rng, HISTORY_MIX)[0]
+        sender, created_at = _user_id(rng, plan), adapt(_moment(rng, plan))
+        amount = _amount(rng)
+        if kind == 'transfer':
+            recipient = _user_id(rng, plan)
+            if recipient == sender:
+                continue
+            rows.append((sender, recipient, 'Transfer (sent)', '✔️', amount, created_at))
+            rows.append((recipient, sender, 'Transfer (received)', '📥', amount, created_at))
+        elif kind == 'deposit':
+            rows.append((sender, None, 'Deposit from bank account', '✔️', amount, created_at))
+        else:
+            rows.append((sender, None, 'Withdrawal to bank account', '✔️', amount, created_at))
+    return [(TransactionHistory, ['sender', 'recipient', 'description', 'status', 'amount', 'created_at'],
+             rows[:count])]
+
+
+def _payment_requests(plan, rng, pools, start, count):
+    adapt = connections[plan['using']].ops.adapt_datetimefield_value
+    statuses = _pick(rng, REQUEST_STATUS_MIX, count)
+    currencies = _pick(rng, CURRENCY_MIX, count)
+    rows = []
+    for status, currency in zip(statuses, currencies):
+        sender = _user_id(rng, plan)
+        recipient = plan['first_id'] + rng.randrange(plan['users'])
+        if recipient == sender:
+            recipient = plan['first_id'] + (recipient - plan['first_id'] + 1) % plan['users']
+        rows.append((sender, recipient, _amount(rng), rng.choice(pools['message']), status, currency,
+                     adapt(_moment(rng, plan))))
+    return [(PaymentRequest, ['sender', 'recipient', 'amount', 'message', 'status', 'currency', 'created_at'], rows)]
+
+
+def _replay_history(plan):
+    """
+    Fill in what the ledger records with each posting, as if the generated
+    history had been posted: a journal entry per row, the balance after
+    every row, and the monthly rollups.
+
+    Each user's rows are replayed in time order from the opening balance
+    drawn for them, raised where needed so that the balance never goes
+    below zero. The opening checkpoint holds that balance and the account
+    ends on the one the history leaves, so ``ledger.rebuild_balance()`` and
+    ``ledger.rebuild_rollups()`` reproduce what is written here.
+    """
+    using, first_id = plan['using'], plan['first_id']
+    adapt, adapt_date = connections[using].ops.adapt_datetimefield_value, connections[using].ops.adapt_datefield_value
+    # ids are assigned here, as for the users, so that the lines know their entry
+    entry_id = JournalEntry.objects.using(using).aggregate(last=Max('pk'))['last'] or 0
+    for start in range(first_id, first_id + plan['users'], REPLAY_CHUNK):
+        stop = min(start + REPLAY_CHUNK, first_id + plan['users'])
+        accounts = {
+            user_id: (account_id, currency, balance)
+            for user_id, account_id, currency, balance in OnlineAccount.objects.using(using)
+            .filter(user__gte=start, user__lt=stop).values_list('user_id', 'pk', 'currency', 'balance')
+        }
+        rows = (
+            TransactionHistory.objects.using(using).filter(sender__gte=start, sender__lt=stop)
+            .order_by('sender_id', 'created_at', 'id')
+            .values_list('id', 'sender_id', 'description', 'amount', 'created_at')
+        )
+        balances, openings, closing, entries, lines, rollups = [], [], [], [], [], {}
+        for user_id, user_rows in groupby(rows.iterator(), key=itemgetter(1)):
+            account_id, currency, opening = accounts[user_id]
+            net = lowest = Decimal('0.00')
+            changes = []
+            for row_id, _, description, amount, created_at in user_rows:
+                outgoing = description in OUTGOING
+                change = -amount if outgoing else amount
+                net += change
+                lowest = min(lowest, net)
+                entry_id += 1
+                transaction_type = JOURNALED[description]
+                # the two sides of a generated transfer are in their accounts'
+                # own currencies, so each is booked against currency exchange,
+                # as a transfer across currencies is
+                system_account = (
+                    SYSTEM_ACCOUNT.FX if transaction_type == TRASACTION_TYPE_CHOICES.TRANSFER else SYSTEM_ACCOUNT.BANK
+                )
+                changes.append((row_id, entry_id, system_account, change, net))
+                entries.append((entry_id, transaction_type, description, adapt(created_at)))
+                direction = FLOW_DIRECTION.SENT if outgoing else FLOW_DIRECTION.RECEIVED
+                key = (user_id, currency, timezone.localdate(created_at).replace(day=1), direction)
+                count, total, minimum, maximum = rollups.get(key, (0, 0, amount, amount))
+                rollups[key] = (count + 1, total + amount, min(minimum, amount), max(maximum, amount))
+            opening -= lowest
+            for row_id, row_entry_id, system_account, change, running in changes:
+                balances.append((opening + running, row_id))
+                lines.append((row_entry_id, account_id, None, currency, change, opening + running))
+                lines.append((row_entry_id, None, system_account, currency, -change, None))
+            openings.append((opening, account_id, 0))
+            closing.append((opening + net, account_id))
+        with transaction.atomic(using=using):
+            _update(using, TransactionHistory, ['balance_after'], ['id'], balances)
+            _update(using, OnlineAccount, ['balance'], ['id'], closing)
+            _update(using, BalanceCheckpoint, ['balance'], ['account', 'last_line_id'], openings)
+            _insert(using, JournalEntry, ['id', 'transaction_type', 'description', 'created_at'], entries)
+            _insert(using, JournalLine, ['entry', 'account', 'system_account', 'currency', 'amount', 'balance_after'],
+                    lines)
+            _insert(using, MonthlyRollup, ['user', 'currency', 'month', 'direction', 'count', 'total', 'minimum', 'maximum'], [
+                (user_id, currency, adapt_date(month), direction, *figures)
+                for (user_id, currency, month, direction), figures in rollups.items()
+            ])
+
+
+@contextmanager
+def _deferred_indexes(models, using):
+    """
+    Drop the secondary indexes of ``models`` for the enclosed block and
+    rebuild them after it. Building an index over loaded rows is a single
+    sort, much cheaper than updating it row by row. Indexes backing unique
+    constraints stay. Other backends keep every index.
+    """
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        sql = "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL"
+    elif connection.vendor == 'postgresql':
+        sql = (
+            'SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s '
+            'AND indexname NOT IN (SELECT conname FROM pg_constraint)'
+        )
+    else:
+        yield
+        return
+    indexes = []
+    with connection.cursor() as cursor:
+        for model in models:
+            cursor.execute(sql, [model._meta.db_table])
+            indexes.extend(cursor.fetchall())
+        for name, _ in indexes:
+            cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+    try:
+        yield
+    finally:
+        connection = connections[using]
+        with connection.cursor() as cursor:
+            for _, definition in indexes:
+                cursor.execute(definition)
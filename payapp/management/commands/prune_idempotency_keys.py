@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from payapp import idempotency
+
+
+class Command(BaseCommand):
+    help = 'Delete idempotency keys whose replay window has passed'
+
+    def handle(self, *args, **options):
+        deleted = idempotency.prune()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired idempotency keys.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from payapp import ledger
+
+
+class Command(BaseCommand):
+    help = 'Recompute the monthly rollups from the journal'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Accounts rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        written = ledger.rebuild_rollups(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} monthly rollups.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from payapp import payment_requests
+from register.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Recompute every user\'s pending payment request counters from the requests themselves'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Users recounted per batch')
+
+    def handle(self, *args, **options):
+        user_ids = list(CustomUser.objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(user_ids), options['chunk_size']):
+            payment_requests.recount(user_ids[start:start + options['chunk_size']])
+        self.stdout.write(self.style.SUCCESS(f'Recounted the pending payment requests of {len(user_ids)} users.'))
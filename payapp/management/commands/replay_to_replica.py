@@ -0,0 +1,49 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from webapps2024.utils import replicas
+
+
+class Command(BaseCommand):
+    help = 'Copy the SQLite primary into the replica file, again every few seconds; stands in for replication'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between copies; the replica lag')
+        parser.add_argument('--once', action='store_true', help='Copy once, then exit')
+        parser.add_argument('--path', help="SQLite file to copy into; the replica database's by default")
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        path = options['path']
+        if path is None:
+            if replicas.replica_alias() is None:
+                raise CommandError('No replica configured; set REPLICA_DATABASE or pass --path.')
+            replica = settings.DATABASES[replicas.replica_alias()]
+            if replica['ENGINE'] != 'django.db.backends.sqlite3':
+                raise CommandError('Only SQLite replicas are replayed here; use the database\'s own replication.')
+            path = replica['NAME']
+        if primary.vendor != 'sqlite':
+            raise CommandError('Only an SQLite primary is replayed here; use the database\'s own replication.')
+
+        copies = 0
+        try:
+            while True:
+                primary.ensure_connection()
+                target = sqlite3.connect(path)
+                try:
+                    # a consistent snapshot; readers of the replica see the
+                    # old copy or the new one, never a mix
+                    primary.connection.backup(target)
+                finally:
+                    target.close()
+                copies += 1
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Copied the primary to {path} ({copies} copies).'))
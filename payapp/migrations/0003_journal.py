@@ -0,0 +1,68 @@
+# Generated by Django 4.2.3 on 2026-10-18 10:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def checkpoint_existing_balances(apps, schema_editor):
+    """
+    Accounts opened before the journal existed have no lines to replay, so
+    their current balance becomes the starting checkpoint.
+    """
+    OnlineAccount = apps.get_model('register', 'OnlineAccount')
+    BalanceCheckpoint = apps.get_model('payapp', 'BalanceCheckpoint')
+    BalanceCheckpoint.objects.bulk_create(
+        BalanceCheckpoint(account_id=pk, balance=balance, last_line_id=0)
+        for pk, balance in OnlineAccount.objects.values_list('pk', 'balance').iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0001_initial'),
+        ('payapp', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JournalEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_type', models.CharField(choices=[('DEPOSIT', 'Deposit'), ('WITHDRAWAL', 'Withdrawal'), ('TRANSFER', 'Transfer'), ('CONVERSION', 'Conversion'), ('REQUEST', 'Request')], max_length=11)),
+                ('description', models.CharField(blank=True, max_length=200, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Journal entries',
+            },
+        ),
+        migrations.CreateModel(
+            name='JournalLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('system_account', models.CharField(blank=True, choices=[('BANK', 'Bank transfers'), ('CARD', 'Card payments'), ('FX', 'Currency exchange'), ('OPENING', 'Opening balances')], max_length=10, null=True)),
+                ('currency', models.CharField(choices=[('USD', '🇺🇸 US Dollars'), ('EUR', '🇪🇺 Euros'), ('GBP', '🇬🇧 Pounds')], max_length=3)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='journal_lines', to='register.onlineaccount')),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='payapp.journalentry')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account', 'id'], name='journalline_account_id_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('last_line_id', models.PositiveBigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_checkpoints', to='register.onlineaccount')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account', '-last_line_id'], name='checkpoint_account_line_idx')],
+            },
+        ),
+        migrations.RunPython(checkpoint_existing_balances, migrations.RunPython.noop),
+    ]
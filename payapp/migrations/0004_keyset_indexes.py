@@ -0,0 +1,21 @@
+# Generated by Django 4.2.3 on 2026-10-18 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payapp', '0003_journal'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paymentrequest',
+            index=models.Index(fields=['recipient', '-created_at', '-id'], name='request_recipient_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionhistory',
+            index=models.Index(fields=['sender', '-created_at', '-id'], name='history_sender_created_idx'),
+        ),
+    ]
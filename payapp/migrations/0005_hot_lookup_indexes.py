@@ -0,0 +1,33 @@
+# Generated by Django 4.2.3 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+def normalise_request_statuses(apps, schema_editor):
+    # request_money used to store a lowercase "pending", which neither the
+    # status choices nor the pending-only index match
+    PaymentRequest = apps.get_model('payapp', 'PaymentRequest')
+    PaymentRequest.objects.filter(status='pending').update(status='PENDING')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payapp', '0004_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalise_request_statuses, migrations.RunPython.noop),
+        migrations.AlterModelOptions(
+            name='card',
+            options={'ordering': ['created_at', 'id']},
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='card_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentrequest',
+            index=models.Index(condition=models.Q(('status', 'PENDING')), fields=['recipient', '-created_at', '-id'], name='request_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.3 on 2026-10-18 11:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('payapp', '0008_running_balances'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(choices=[('USD', '🇺🇸 US Dollars'), ('EUR', '🇪🇺 Euros'), ('GBP', '🇬🇧 Pounds')], max_length=3)),
+                ('month', models.DateField()),
+                ('direction', models.CharField(choices=[('SENT', 'Sent'), ('RECEIVED', 'Received')], max_length=8)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('minimum', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('maximum', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-month', 'user', 'currency', 'direction'],
+                'indexes': [models.Index(fields=['month', 'currency'], name='rollup_month_currency_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'currency', 'month', 'direction'), name='unique_monthly_rollup'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.3 on 2026-10-18 11:31
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_pending_requests(apps, schema_editor):
+    """Start the counters from the requests that are pending now."""
+    PaymentRequest = apps.get_model('payapp', 'PaymentRequest')
+    PendingRequestCounter = apps.get_model('payapp', 'PendingRequestCounter')
+    counters = {}
+    pending = PaymentRequest.objects.filter(status='PENDING')
+    for field, side in (('recipient_id', 'incoming'), ('sender_id', 'outgoing')):
+        for user_id, count in pending.values_list(field).annotate(count=models.Count('pk')).order_by():
+            counters.setdefault(user_id, PendingRequestCounter(user_id=user_id))
+            setattr(counters[user_id], side, count)
+    PendingRequestCounter.objects.bulk_create(counters.values(), batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0002_hot_lookup_indexes'),
+        ('payapp', '0010_admin_changelist_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingRequestCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='pending_request_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('incoming', models.PositiveIntegerField(default=0)),
+                ('outgoing', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_pending_requests, migrations.RunPython.noop),
+    ]
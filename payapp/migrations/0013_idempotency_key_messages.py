@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 12:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payapp', '0012_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='response_messages',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
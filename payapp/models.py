@@ -1,7 +1,6 @@
 import auto_prefetch
-from django.db import models
-from webapps2024.utils.manual_exchange import MANUAL_EXCHANGE_RATES
-from webapps2024.utils.choices import CURRENCY_CHOICES, TRASACTION_TYPE_CHOICES, CARD_TYPE, TRANSACTION_STATUS
+from django.db import models, transaction
+from webapps2024.utils.choices import CURRENCY_CHOICES, TRASACTION_TYPE_CHOICES, CARD_TYPE, TRANSACTION_STATUS, SYSTEM_ACCOUNT, FLOW_DIRECTION
 # from register.models import User
 from django.conf import settings
 # Create your models here.
@@ -17,29 +16,25 @@ class Transaction(models.Model):
     
     class Meta:
         verbose_name_plural = "Transactions"
+        # the admin filters on these and lists newest first
+        indexes = [
+            models.Index(fields=['transaction_type', '-id'], name='transaction_type_idx'),
+            models.Index(fields=['status', '-id'], name='transaction_status_idx'),
+        ]
 
     def perform_transaction(self):
         """
         Perform the transaction and handle currency conversion if necessary.
         """
-        if self.sender.onlineaccount.currency != self.recipient.onlineaccount.currency:
-            # Currency conversion needed
-            exchange_rate = MANUAL_EXCHANGE_RATES.get((self.sender.onlineaccount.currency, self.recipient.onlineaccount.currency))
-            if exchange_rate is None:
-                raise ValueError("Exchange rate not found for currencies")
-            converted_amount = self.amount * exchange_rate
-            self.amount = converted_amount
+        from payapp import ledger
+
+        with transaction.atomic():
+            self.amount = ledger.transfer(self.sender, self.recipient, self.amount)
             self.currency = self.recipient.onlineaccount.currency
-        
-        # Update sender's and receiver's account balances
-        self.sender.onlineaccount.balance -= self.amount
-        self.recipient.onlineaccount.balance += self.amount
-        self.sender.onlineaccount.save()
-        self.recipient.onlineaccount.save()
-        
-        # Mark the transaction as completed
-        self.status = 'completed'
-        self.save()
+
+            # Mark the transaction as completed
+            self.status = 'completed'
+            self.save()
 
 
 
@@ -67,6 +62,17 @@ class CurrencyConversion(models.Model):
         return f"{self.currency_from}/{self.currency_to}: {self.exchange_rate}"
 
 
+class RateTableVersion(models.Model):
+    """
+    Single-row counter bumped whenever exchange rates change, so every worker
+    process knows when to rebuild its in-memory rate table.
+    """
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Rate table v{self.version}"
+
+
 
 
 class TransactionHistory(models.Model):
@@ -76,11 +82,19 @@ class TransactionHistory(models.Model):
     status = models.CharField(max_length=100, blank=True, null=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     bank_account = models.ForeignKey('register.BankAccount', on_delete=models.CASCADE, blank=True, null=True)
+    # the sender's online account balance right after this row was written
+    balance_after = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-created_at']
         verbose_name_plural = "Transaction histories"
+        indexes = [
+            models.Index(fields=['sender', '-created_at', '-id'], name='history_sender_created_idx'),
+            # the admin changelist, unfiltered and filtered by status
+            models.Index(fields=['-created_at', '-id'], name='history_created_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='history_status_created_idx'),
+        ]
     
 
     def __str__(self):
@@ -95,10 +109,12 @@ class TransactionHistory(models.Model):
         self.save()
 
     def generate_notification(self):
-        recipient = self.recipient
+        # queued in the caller's transaction; the deliver_outbox worker sends it
+        from payapp import outbox
         message = f"You have received a payment request from {self.sender.username}. Amount: {self.amount}."
-        # Assuming you have a method to handle sending notifications to users
-        self.send_notification(recipient, message)
+        outbox.enqueue([(self.recipient_id, "payment_request.received", "Payment request", message, {
+            "sender": self.sender.username, "amount": str(self.amount),
+        })])
 
 
 class Card(models.Model):
@@ -110,6 +126,10 @@ class Card(models.Model):
     cvv = models.CharField(max_length=4, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [models.Index(fields=['user', 'created_at', 'id'], name='card_user_created_idx')]
+
 
 class PaymentRequest(models.Model):
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sent_payment_requests')
@@ -120,5 +140,196 @@ class PaymentRequest(models.Model):
     currency = models.CharField(max_length=3, choices=CURRENCY_CHOICES.choices, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', '-created_at', '-id'], name='request_recipient_created_idx'),
+            models.Index(
+                fields=['recipient', '-created_at', '-id'], name='request_pending_idx',
+                condition=models.Q(status=TRANSACTION_STATUS.PENDING),
+            ),
+            # the admin changelist filtered by status, newest first
+            models.Index(fields=['status', '-id'], name='request_status_idx'),
+        ]
+
+
+class PendingRequestCounter(models.Model):
+    """
+    How many pending payment requests a user has received and sent.
+
+    ``payapp.payment_requests`` keeps it in the same transaction as each
+    request is created or answered, so badges read one row instead of
+    counting requests.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='pending_request_counter')
+    incoming = models.PositiveIntegerField(default=0)
+    outgoing = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.user_id}: {self.incoming} incoming, {self.outgoing} outgoing'
+
+
+class JournalEntry(models.Model):
+    """
+    One balanced posting in the double-entry journal.
+
+    Entries and their lines are append-only: they are written by
+    ``payapp.ledger`` in the same database transaction as the balance update
+    they describe and are never edited afterwards.
+    """
+    transaction_type = models.CharField(max_length=11, choices=TRASACTION_TYPE_CHOICES.choices)
+    description = models.CharField(max_length=200, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Journal entries"
+        indexes = [models.Index(fields=['transaction_type', '-id'], name='journalentry_type_idx')]
+
+    def __str__(self):
+        return f'{self.created_at} - {self.description}'
+
+
+class JournalLine(models.Model):
+    """
+    A signed movement on one account: positive amounts credit it, negative
+    amounts debit it. The lines of an entry sum to zero per currency.
+
+    Money entering or leaving the system is booked against a ``system_account``
+    (bank, card, currency exchange, opening balances) instead of a user account.
+    """
+    entry = models.ForeignKey(JournalEntry, on_delete=models.CASCADE, related_name='lines')
+    account = models.ForeignKey('register.OnlineAccount', on_delete=models.CASCADE, related_name='journal_lines', blank=True, null=True)
+    system_account = models.CharField(max_length=10, choices=SYSTEM_ACCOUNT.choices, blank=True, null=True)
+    currency = models.CharField(max_length=3, choices=CURRENCY_CHOICES.choices)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    # the account's balance right after this line; empty for system accounts
+    balance_after = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['account', 'id'], name='journalline_account_id_idx')]
+
+    def __str__(self):
+        return f'{self.account or self.system_account} {self.amount} {self.currency}'
+
+
+class BalanceCheckpoint(models.Model):
+    """
+    The balance of an online account as of journal line ``last_line_id``.
+
+    Rebuilding a balance only has to replay the journal lines written after
+    the latest checkpoint.
+    """
+    account = models.ForeignKey('register.OnlineAccount', on_delete=models.CASCADE, related_name='balance_checkpoints')
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    last_line_id = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['account', '-last_line_id'], name='checkpoint_account_line_idx')]
+
+    def __str__(self):
+        return f'{self.account} {self.balance} @ line {self.last_line_id}'
+
+
+class MonthlyRollup(models.Model):
+    """
+    A user's postings in one currency, month and direction: how many there
+    were, and their total, smallest and largest amount.
+
+    ``payapp.ledger`` updates the rollups in the same transaction as each
+    posting, so monthly figures never need to aggregate the history.
+    Opening balances are not counted.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='monthly_rollups')
+    currency = models.CharField(max_length=3, choices=CURRENCY_CHOICES.choices)
+    # first day of the month
+    month = models.DateField()
+    direction = models.CharField(max_length=8, choices=FLOW_DIRECTION.choices)
+    count = models.PositiveIntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    minimum = models.DecimalField(max_digits=12, decimal_places=2)
+    maximum = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        ordering = ['-month', 'user', 'currency', 'direction']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'currency', 'month', 'direction'], name='unique_monthly_rollup'),
+        ]
+        indexes = [models.Index(fields=['month', 'currency'], name='rollup_month_currency_idx')]
+
+    def __str__(self):
+        return f'{self.user} {self.month:%Y-%m} {self.direction} {self.total} {self.currency}'
+
 
 
+class OutboxMessage(models.Model):
+    """
+    A notification waiting to be delivered on one channel.
+
+    Messages are written in the same transaction as the transfer or payment
+    request they describe, and the ``deliver_outbox`` worker sends them
+    afterwards. See ``payapp.outbox``. Delivered messages are deleted; a
+    message that keeps failing is kept with a ``failed_at`` time.
+    """
+    channel = models.CharField(max_length=20)
+    event = models.CharField(max_length=50)
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='outbox_messages')
+    payload = models.JSONField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # when the worker may (next) try to deliver it
+    available_at = models.DateTimeField()
+    failed_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['available_at', 'id'], name='outbox_due_idx', condition=models.Q(failed_at__isnull=True)),
+        ]
+
+    def __str__(self):
+        return f'{self.event} to {self.recipient_id} by {self.channel}'
+
+
+class Notification(models.Model):
+    """A notification shown in the app, delivered from the outbox."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notifications')
+    # the outbox message it was delivered from; a retried delivery adds nothing
+    source = models.PositiveBigIntegerField(unique=True)
+    event = models.CharField(max_length=50)
+    message = models.TextField()
+    read_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', '-created_at', '-id'], name='notification_user_created_idx')]
+
+    def __str__(self):
+        return f'{self.user_id}: {self.message}'
+
+
+class IdempotencyKey(models.Model):
+    """
+    The outcome of the first POST a user made with a given idempotency key.
+
+    The row is written in the transaction of the posting it guards, and the
+    response is stored once the view has returned. A row without a
+    ``response_status`` has posted, so duplicates wait for its response and
+    then replay it, and never post again. See ``payapp.idempotency``.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    locked_at = models.DateTimeField()
+    expires_at = models.DateTimeField()
+    response_status = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_content_type = models.CharField(max_length=100, blank=True)
+    response_location = models.CharField(max_length=2000, blank=True)
+    response_body = models.BinaryField(blank=True)
+    response_messages = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_unique')]
+        indexes = [models.Index(fields=['expires_at'], name='idempotency_expires_idx')]
+
+    def __str__(self):
+        return f'{self.user_id}:{self.key}'
@@ -0,0 +1,206 @@
+import json
+import random
+import urllib.request
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from payapp.models import Notification, OutboxMessage
+
+# Channel name -> dotted path of its class, used unless the OUTBOX_CHANNELS
+# setting says otherwise. Every notification is queued once per channel.
+DEFAULT_CHANNELS = {
+    "email": "payapp.outbox.EmailChannel",
+    "in_app": "payapp.outbox.InAppChannel",
+}
+
+# Messages claimed by the worker at a time.
+BATCH_SIZE = getattr(settings, "OUTBOX_BATCH_SIZE", 100)
+
+# Attempts before a message is given up on and kept as failed.
+MAX_ATTEMPTS = getattr(settings, "OUTBOX_MAX_ATTEMPTS", 8)
+
+# The n-th retry waits about RETRY_BASE_SECONDS * 2 ** (n - 1), at most
+# RETRY_MAX_SECONDS.
+RETRY_BASE_SECONDS = getattr(settings, "OUTBOX_RETRY_BASE_SECONDS", 5)
+RETRY_MAX_SECONDS = getattr(settings, "OUTBOX_RETRY_MAX_SECONDS", 60 * 60)
+
+# A claimed message that is neither delivered nor rescheduled within this
+# time belongs to a worker that died, and is claimed again.
+LEASE_SECONDS = getattr(settings, "OUTBOX_LEASE_SECONDS", 5 * 60)
+
+
+def channel_names():
+    return list(getattr(settings, "OUTBOX_CHANNELS", DEFAULT_CHANNELS))
+
+
+def configured_channels():
+    """A fresh instance of every configured channel, by name."""
+    return {name: import_string(path)() for name, path in getattr(settings, "OUTBOX_CHANNELS", DEFAULT_CHANNELS).items()}
+
+
+def enqueue(notifications):
+    """
+    Queue ``(recipient_id, event, subject, body, data)`` notifications on
+    every channel with one INSERT. Call it inside the transaction that makes
+    the change they announce, so they are sent if and only if it commits.
+    """
+    now = timezone.now()
+    OutboxMessage.objects.bulk_create([
+        OutboxMessage(channel=channel, event=event, recipient_id=recipient_id, available_at=now,
+                      payload={"subject": subject, "body": body, "data": data})
+        for recipient_id, event, subject, body, data in notifications
+        for channel in channel_names()
+    ])
+
+
+def transfers_received(sender, credits):
+    """Queue a notification for each ``(recipient_id, amount, currency)`` that ``sender`` paid."""
+    enqueue([
+        (recipient_id, "transfer.received", "You received money", f"{sender.username} sent you {amount} {currency}.",
+         {"sender": sender.username, "amount": str(amount), "currency": currency})
+        for recipient_id, amount, currency in credits
+    ])
+
+
+def payment_request_received(payment_request):
+    enqueue([(
+        payment_request.recipient_id, "payment_request.received", "Payment request",
+        f"{payment_request.sender.username} asked you for {payment_request.amount} {payment_request.currency}.",
+        {"request": payment_request.pk, "sender": payment_request.sender.username,
+         "amount": str(payment_request.amount), "currency": payment_request.currency},
+    )])
+
+
+def retry_delay(attempts):
+    """Seconds to wait after a message's ``attempts``-th failure, with jitter."""
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1)
+
+
+def _claim(batch_size):
+    """
+    Lease up to ``batch_size`` due messages, oldest first, so that no other
+    worker picks them up while they are being delivered.
+
+    Where the backend supports it, concurrent workers skip each other's
+    locked rows. On SQLite run a single worker.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        due = OutboxMessage.objects.filter(failed_at__isnull=True, available_at__lte=now).order_by("available_at", "id")
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list("pk", flat=True)[:batch_size])
+        if ids:
+            OutboxMessage.objects.filter(pk__in=ids).update(available_at=now + timedelta(seconds=LEASE_SECONDS))
+    return list(OutboxMessage.objects.filter(pk__in=ids).select_related("recipient").order_by("id")) if ids else []
+
+
+def _settle(messages, errors):
+    """Delete the delivered ``messages`` and reschedule the ones in ``errors``."""
+    now = timezone.now()
+    delivered = [message.pk for message in messages if message.pk not in errors]
+    failed = [message for message in messages if message.pk in errors]
+    if delivered:
+        OutboxMessage.objects.filter(pk__in=delivered).delete()
+    for message in failed:
+        message.attempts += 1
+        message.last_error = errors[message.pk]
+        if message.attempts >= MAX_ATTEMPTS:
+            message.failed_at = now
+        else:
+            message.available_at = now + timedelta(seconds=retry_delay(message.attempts))
+    if failed:
+        OutboxMessage.objects.bulk_update(failed, ["attempts", "last_error", "failed_at", "available_at"])
+
+
+def deliver_due(batch_size=BATCH_SIZE, channels=None):
+    """
+    Deliver one batch of due messages, each channel's share in one call to
+    its ``deliver()``.
+
+    Channels are objects whose ``deliver(messages)`` returns a
+    ``{message pk: error}`` dict of the messages it could not send; raising
+    fails the whole share. ``channels`` maps names to channel objects and
+    defaults to the configured ones.
+
+    Returns:
+        tuple[int, int]: How many messages were delivered and how many failed.
+    """
+    messages = _claim(batch_size)
+    if not messages:
+        return 0, 0
+    channels = configured_channels() if channels is None else channels
+    by_channel = defaultdict(list)
+    for message in messages:
+        by_channel[message.channel].append(message)
+
+    errors = {}
+    for name, batch in by_channel.items():
+        if name not in channels:
+            errors.update((message.pk, f"Unknown channel {name!r}.") for message in batch)
+            continue
+        try:
+            errors.update(channels[name].deliver(batch))
+        except Exception as exc:
+            errors.update((message.pk, repr(exc)) for message in batch)
+    _settle(messages, errors)
+    return len(messages) - len(errors), len(errors)
+
+
+class EmailChannel:
+    """Emails each message through ``EMAIL_BACKEND``, over one connection per batch."""
+
+    def deliver(self, messages):
+        errors = {}
+        with get_connection() as mail:
+            for message in messages:
+                email = EmailMessage(message.payload["subject"], message.payload["body"], to=[message.recipient.email])
+                try:
+                    mail.send_messages([email])
+                except Exception as exc:
+                    errors[message.pk] = repr(exc)
+        return errors
+
+
+class InAppChannel:
+    """Stores the messages as ``Notification`` rows with one INSERT."""
+
+    def deliver(self, messages):
+        Notification.objects.bulk_create([
+            Notification(user_id=message.recipient_id, source=message.pk, event=message.event,
+                         message=message.payload["body"])
+            for message in messages
+        ], ignore_conflicts=True)
+        return {}
+
+
+class WebhookChannel:
+    """
+    POSTs each batch as JSON to ``OUTBOX_WEBHOOK_URL``. Receivers should
+    ignore message ids they have seen: a batch is sent again whole if any
+    part of the request fails.
+    """
+
+    def __init__(self):
+        self.url = settings.OUTBOX_WEBHOOK_URL
+        self.timeout = getattr(settings, "OUTBOX_WEBHOOK_TIMEOUT_SECONDS", 5)
+
+    def deliver(self, messages):
+        body = json.dumps({"messages": [
+            {"id": message.pk, "event": message.event, "user": message.recipient_id,
+             "created_at": message.created_at, **message.payload}
+            for message in messages
+        ]}, cls=DjangoJSONEncoder).encode()
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        # anything but a 2xx response raises
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+        return {}
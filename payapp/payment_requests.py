@@ -0,0 +1,78 @@
+from django.db.models import Case, Count, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+
+from payapp.models import PaymentRequest, PendingRequestCounter
+from webapps2024.utils import fragments
+from webapps2024.utils.choices import TRANSACTION_STATUS
+
+
+def _adjust(deltas):
+    """
+    Apply ``{user_id: (incoming, outgoing)}`` changes to the pending counters
+    in one UPDATE. Users without a counter row get one counted afresh, which
+    already reflects the change being made.
+    """
+    def change(side):
+        return Case(
+            *[When(user_id=user_id, then=Value(delta[side])) for user_id, delta in deltas.items()],
+            default=Value(0), output_field=IntegerField(),
+        )
+
+    # never below zero, even if a request was answered without resolve()
+    updated = PendingRequestCounter.objects.filter(user_id__in=deltas).update(
+        incoming=Greatest(F("incoming") + change(0), 0), outgoing=Greatest(F("outgoing") + change(1), 0),
+    )
+    if updated < len(deltas):
+        existing = set(PendingRequestCounter.objects.filter(user_id__in=deltas).values_list("user_id", flat=True))
+        recount(set(deltas) - existing)
+
+
+def recount(user_ids):
+    """Reset the pending counters of ``user_ids`` from their payment requests."""
+    user_ids = list(user_ids)
+    counts = {user_id: [0, 0] for user_id in user_ids}
+    pending = PaymentRequest.objects.filter(status=TRANSACTION_STATUS.PENDING)
+    for side, field in enumerate(("recipient_id", "sender_id")):
+        for user_id, count in (
+            pending.filter(**{f"{field}__in": user_ids}).values_list(field).annotate(Count("pk")).order_by()
+        ):
+            counts[user_id][side] = count
+    PendingRequestCounter.objects.bulk_create(
+        [PendingRequestCounter(user_id=user_id, incoming=incoming, outgoing=outgoing)
+         for user_id, (incoming, outgoing) in counts.items()],
+        update_conflicts=True, unique_fields=["user"], update_fields=["incoming", "outgoing"],
+    )
+
+
+def _deltas(payment_request, change):
+    deltas = {}
+    deltas.setdefault(payment_request.recipient_id, [0, 0])[0] += change
+    deltas.setdefault(payment_request.sender_id, [0, 0])[1] += change
+    return deltas
+
+
+def opened(payment_request):
+    """
+    Count a just-created pending request. ``payapp.signals`` calls it when a
+    request is saved, in the transaction that creates it.
+    """
+    _adjust(_deltas(payment_request, 1))
+
+
+def resolve(payment_request, status):
+    """
+    Move a pending request to ``status`` and uncount it.
+
+    The transition is a conditional UPDATE, so of two concurrent answers only
+    one succeeds. Returns False if the request was no longer pending.
+    """
+    answered = PaymentRequest.objects.filter(
+        pk=payment_request.pk, status=TRANSACTION_STATUS.PENDING,
+    ).update(status=status)
+    if not answered:
+        return False
+    payment_request.status = status
+    _adjust(_deltas(payment_request, -1))
+    # update() sends no signals
+    fragments.invalidate(payment_request.sender_id, payment_request.recipient_id)
+    return True
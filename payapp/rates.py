@@ -0,0 +1,177 @@
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from payapp.models import CurrencyConversion, RateTableVersion
+from webapps2024.utils.choices import CURRENCY_CHOICES
+from webapps2024.utils.manual_exchange import MANUAL_EXCHANGE_RATES
+
+CENT = Decimal("0.01")
+
+# Same precision as ``CurrencyConversion.exchange_rate``.
+RATE_PLACES = Decimal("0.000001")
+
+# Pairs with no direct or inverse rate are derived through this currency.
+PIVOT_CURRENCY = "USD"
+
+# How long a process trusts its table before re-reading the version counter.
+REFRESH_SECONDS = getattr(settings, "EXCHANGE_RATES_REFRESH_SECONDS", 5)
+
+
+class ExchangeRateNotFound(ValueError):
+    """No exchange rate is configured or derivable for the requested currency pair."""
+
+
+class RateTable:
+    """
+    Immutable snapshot of every exchange rate, held as a dense matrix.
+
+    Rates are resolved once when the table is built: a configured rate wins,
+    then the inverse of the opposite pair, then a cross rate through
+    ``PIVOT_CURRENCY``. Identity pairs are always 1. Lookups afterwards are
+    two list indexes.
+    """
+
+    def __init__(self, version, rates):
+        currencies = sorted({currency for pair in rates for currency in pair} | set(CURRENCY_CHOICES.values))
+        self.version = version
+        self.currencies = tuple(currencies)
+        self.index = {currency: i for i, currency in enumerate(currencies)}
+
+        def known(currency_from, currency_to):
+            if currency_from == currency_to:
+                return Decimal(1)
+            if (currency_from, currency_to) in rates:
+                return rates[currency_from, currency_to]
+            inverse = rates.get((currency_to, currency_from))
+            if inverse:
+                return (1 / inverse).quantize(RATE_PLACES, rounding=ROUND_HALF_UP)
+            return None
+
+        def resolve(currency_from, currency_to):
+            rate = known(currency_from, currency_to)
+            if rate is None:
+                to_pivot = known(currency_from, PIVOT_CURRENCY)
+                from_pivot = known(PIVOT_CURRENCY, currency_to)
+                if to_pivot is not None and from_pivot is not None:
+                    rate = (to_pivot * from_pivot).quantize(RATE_PLACES, rounding=ROUND_HALF_UP)
+            return rate
+
+        self.matrix = [[resolve(row, column) for column in currencies] for row in currencies]
+
+    def rate(self, currency_from, currency_to):
+        try:
+            rate = self.matrix[self.index[currency_from]][self.index[currency_to]]
+        except KeyError:
+            rate = None
+        if rate is None:
+            raise ExchangeRateNotFound(f"Exchange rate not found for {currency_from}/{currency_to}")
+        return rate
+
+    def convert(self, amount, currency_from, currency_to):
+        """Convert ``amount`` between two currencies, rounded to the cent."""
+        if currency_from == currency_to:
+            return amount
+        return (amount * self.rate(currency_from, currency_to)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+    def convert_many(self, items):
+        """
+        Convert ``(amount, currency_from, currency_to)`` items in one pass,
+        each rounded to the cent against this snapshot.
+
+        Amounts may be strings, integers or floats (floats go through
+        ``str``). They must be finite and not negative.
+
+        Raises:
+            ValueError: For the first item that cannot be converted, naming its index.
+        """
+        matrix, index = self.matrix, self.index
+        quantize = Decimal.quantize
+        converted = []
+        append = converted.append
+        for position, (amount, currency_from, currency_to) in enumerate(items):
+            try:
+                rate = matrix[index[currency_from]][index[currency_to]]
+            except (KeyError, TypeError):
+                rate = None
+            if rate is None:
+                raise ValueError(f"Item {position}: no exchange rate for {currency_from}/{currency_to}.")
+            try:
+                value = Decimal(str(amount) if isinstance(amount, float) else amount)
+            except (TypeError, ValueError, ArithmeticError):
+                value = None
+            if value is None or not value.is_finite() or value < 0:
+                raise ValueError(f"Item {position}: amount must be a non-negative number.")
+            append(quantize(value * rate, CENT, rounding=ROUND_HALF_UP))
+        return converted
+
+
+_table = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _stored_version():
+    return RateTableVersion.objects.filter(pk=1).values_list("version", flat=True).first() or 0
+
+
+def load_table(version):
+    """
+    Build a table from the manual fallback rates overlaid with every
+    ``CurrencyConversion`` row.
+    """
+    rates = {pair: Decimal(str(rate)) for pair, rate in MANUAL_EXCHANGE_RATES.items()}
+    for currency_from, currency_to, rate in CurrencyConversion.objects.values_list(
+        "currency_from", "currency_to", "exchange_rate"
+    ):
+        rates[currency_from, currency_to] = rate
+    return RateTable(version, rates)
+
+
+def current_table():
+    """
+    The process-wide rate table.
+
+    The shared version counter is read at most once every
+    ``REFRESH_SECONDS``; in between, conversions never touch the database.
+    The table is rebuilt only when another process has bumped the version.
+    """
+    global _table, _checked_at
+    table = _table
+    if table is not None and time.monotonic() - _checked_at < REFRESH_SECONDS:
+        return table
+    with _lock:
+        version = _stored_version()
+        if _table is None or _table.version != version:
+            _table = load_table(version)
+        _checked_at = time.monotonic()
+        return _table
+
+
+def invalidate():
+    """Drop this process's table so the next lookup rebuilds it."""
+    global _table
+    _table = None
+
+
+def bump_version():
+    """
+    Mark every process's table as stale. Other workers pick the change up
+    within ``REFRESH_SECONDS``; this process drops its table once the
+    surrounding transaction commits.
+    """
+    RateTableVersion.objects.get_or_create(pk=1)
+    RateTableVersion.objects.filter(pk=1).update(version=F("version") + 1)
+    transaction.on_commit(invalidate)
+
+
+def rate(currency_from, currency_to):
+    return current_table().rate(currency_from, currency_to)
+
+
+def convert(amount, currency_from, currency_to):
+    return current_table().convert(amount, currency_from, currency_to)
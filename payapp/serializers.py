@@ -0,0 +1,43 @@
+from rest_framework import serializers
+from payapp.models import PaymentRequest, TransactionHistory
+from webapps2024.utils.choices import CURRENCY_CHOICES
+
+# Upper bound on items per batch request; keeps the recipient lookup a
+# single query within SQLite's bound-parameter limit.
+MAX_BATCH_ITEMS = 5000
+
+
+class BatchTransferItemSerializer(serializers.Serializer):
+    recipient_email = serializers.EmailField()
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0.01)
+    currency = serializers.ChoiceField(choices=CURRENCY_CHOICES.choices, required=False, allow_null=True)
+
+
+class BatchTransferSerializer(serializers.Serializer):
+    items = BatchTransferItemSerializer(many=True, allow_empty=False, max_length=MAX_BATCH_ITEMS)
+
+
+class BatchTransferResultSerializer(serializers.Serializer):
+    index = serializers.IntegerField()
+    recipient = serializers.EmailField()
+    status = serializers.CharField()
+    debited = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    credited = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    error = serializers.CharField(required=False)
+
+
+class TransactionHistorySerializer(serializers.ModelSerializer):
+    recipient = serializers.CharField(source='recipient.username', default=None)
+
+    class Meta:
+        model = TransactionHistory
+        fields = ['id', 'created_at', 'description', 'status', 'amount', 'balance_after', 'recipient', 'bank_account']
+
+
+class PaymentRequestSerializer(serializers.ModelSerializer):
+    sender = serializers.CharField(source='sender.username')
+
+    class Meta:
+        model = PaymentRequest
+        fields = ['id', 'created_at', 'sender', 'amount', 'currency', 'message', 'status']
+
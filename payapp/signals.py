@@ -0,0 +1,46 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from payapp import live, outbox, payment_requests, rates
+from webapps2024.utils import fragments
+from webapps2024.utils.choices import TRANSACTION_STATUS
+from .models import Card, CurrencyConversion, PaymentRequest, TransactionHistory
+
+
+@receiver(post_save, sender=CurrencyConversion)
+@receiver(post_delete, sender=CurrencyConversion)
+def bump_rate_table_version(sender, **kwargs):
+    # queryset.update() and bulk_create() skip these signals; call
+    # rates.bump_version() after changing rates that way
+    rates.bump_version()
+
+
+@receiver(post_save, sender=TransactionHistory)
+@receiver(post_delete, sender=TransactionHistory)
+@receiver(post_save, sender=PaymentRequest)
+@receiver(post_delete, sender=PaymentRequest)
+def invalidate_sender_and_recipient_widgets(sender, instance, **kwargs):
+    # the ledger's bulk writes skip these signals and invalidate by themselves
+    fragments.invalidate(instance.sender_id, instance.recipient_id)
+
+
+@receiver(post_save, sender=PaymentRequest)
+def count_new_pending_request(sender, instance, created, **kwargs):
+    # answering a request goes through payment_requests.resolve(), which
+    # uncounts it; this covers requests created anywhere
+    if created and instance.status == TRANSACTION_STATUS.PENDING:
+        payment_requests.opened(instance)
+
+
+@receiver(post_save, sender=PaymentRequest)
+def notify_payment_request_recipient(sender, instance, created, **kwargs):
+    # queued in the transaction that saves the request
+    if created and instance.status == TRANSACTION_STATUS.PENDING:
+        outbox.payment_request_received(instance)
+        live.payment_request_received(instance)
+
+
+@receiver(post_save, sender=Card)
+@receiver(post_delete, sender=Card)
+def invalidate_card_owner_widgets(sender, instance, **kwargs):
+    fragments.invalidate(instance.user_id)
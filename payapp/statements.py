@@ -0,0 +1,110 @@
+import csv
+import json
+from datetime import date, datetime, time, timedelta
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from payapp.models import TransactionHistory
+
+# Export formats and their content types.
+FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+# Rows fetched from the database cursor at a time.
+CHUNK_SIZE = 2000
+
+# Rows encoded into each chunk of output.
+_ROWS_PER_WRITE = 500
+
+COLUMNS = (
+    "id", "created_at", "account", "description", "status", "amount", "balance_after", "counterparty", "bank_account",
+)
+# Related names come from joins in the same query, never one query per row.
+_FIELDS = (
+    "id", "created_at", "sender__username", "description", "status", "amount", "balance_after",
+    "recipient__username", "bank_account__account_number",
+)
+
+
+def parse_date_range(params):
+    """
+    Read the optional ``from`` and ``to`` dates (``YYYY-MM-DD``, both
+    inclusive) into ``(start, end)`` datetimes, ``end`` being exclusive.
+
+    Raises:
+        ValueError: If a date is malformed or ``from`` is after ``to``.
+    """
+    start = end = None
+    if params.get("from"):
+        start = timezone.make_aware(datetime.combine(date.fromisoformat(params["from"]), time.min))
+    if params.get("to"):
+        end = timezone.make_aware(datetime.combine(date.fromisoformat(params["to"]) + timedelta(days=1), time.min))
+    if start and end and start >= end:
+        raise ValueError("The start date is after the end date.")
+    return start, end
+
+
+def statement_rows(user=None, start=None, end=None):
+    """
+    The history rows of ``user``, or of every account, oldest first, as
+    tuples of ``COLUMNS``. The order follows the ``(sender, created_at, id)``
+    index, so the database streams the rows without sorting them.
+    """
+    rows = TransactionHistory.objects.all()
+    if user is not None:
+        rows = rows.filter(sender=user)
+    if start is not None:
+        rows = rows.filter(created_at__gte=start)
+    if end is not None:
+        rows = rows.filter(created_at__lt=end)
+    return rows.order_by("sender", "created_at", "id").values_list(*_FIELDS)
+
+
+class _Echo:
+    """File-like object for ``csv.writer`` that hands back what it is given."""
+
+    def write(self, value):
+        return value
+
+
+def _encoder(fmt):
+    if fmt == "csv":
+        writer = csv.writer(_Echo())
+        return lambda row: writer.writerow(
+            "" if value is None else value.isoformat() if isinstance(value, datetime) else value for value in row
+        )
+    return lambda row: json.dumps(dict(zip(COLUMNS, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+
+
+def _header(fmt):
+    return csv.writer(_Echo()).writerow(COLUMNS) if fmt == "csv" else ""
+
+
+def render(rows, fmt, chunk_size=CHUNK_SIZE):
+    """
+    Encode ``rows`` (a ``statement_rows()`` queryset) as ``fmt``, yielding
+    text a few hundred rows at a time. Rows are read through a server-side
+    cursor, so memory stays flat however long the statement is.
+    """
+    encode = _encoder(fmt)
+    buffer = [_header(fmt)]
+    for row in rows.iterator(chunk_size=chunk_size):
+        buffer.append(encode(row))
+        if len(buffer) >= _ROWS_PER_WRITE:
+            yield "".join(buffer)
+            buffer.clear()
+    if buffer:
+        yield "".join(buffer)
+
+
+async def arender(rows, fmt, chunk_size=CHUNK_SIZE):
+    """
+    ``render()`` for async views. Each chunk is produced on the ORM's
+    thread; Django 4.2's ``aiterator()`` cannot stream ``values_list()``
+    querysets.
+    """
+    chunks = render(rows, fmt, chunk_size)
+    next_chunk = sync_to_async(next)
+    while (chunk := await next_chunk(chunks, None)) is not None:
+        yield chunk
@@ -1,5 +1,9 @@
+import uuid
+
 from django import template
+from django.utils.html import format_html
 from decimal import Decimal
+from payapp.idempotency import FIELD as IDEMPOTENCY_FIELD
 from django.utils.timesince import timesince
 from django.utils.timezone import now
 
@@ -7,6 +11,9 @@ register = template.Library()
 
 @register.filter
 def subtract(value, arg):
+    # bound form fields hand their values back as strings
+    if isinstance(arg, str):
+        arg = Decimal(arg)
     if isinstance(value, Decimal) and isinstance(arg, float):
         value = float(value)
     elif isinstance(value, float) and isinstance(arg, Decimal):
@@ -38,3 +45,12 @@ def custom_timesince(value):
         return f"{hours} {'hr' if hours == 1 else 'hr'} ago"
     else:
         return timesince(value) + " ago"
+
+
+@register.simple_tag
+def idempotency_key_field():
+    """
+    Hidden input carrying a fresh idempotency key, so that submitting the
+    same rendered form twice moves the money only once.
+    """
+    return format_html('<input type="hidden" name="{}" value="{}">', IDEMPOTENCY_FIELD, uuid.uuid4().hex)
@@ -1,3 +1,1630 @@
-from django.test import TestCase
+import asyncio
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+from unittest import mock, skipUnless
+
+from django import shortcuts
+from django.core import mail
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone, translation
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages import get_messages
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from payapp import flows, idempotency, ledger, live, outbox, payment_requests, rates, statements, views
+from payapp.models import (
+    Card, CurrencyConversion, IdempotencyKey, JournalEntry, JournalLine, MonthlyRollup, Notification,
+    OutboxMessage, PaymentRequest, PendingRequestCounter, Transaction, TransactionHistory,
+)
+from register.models import BankAccount, CustomUser, OnlineAccount, UserProfile
+from webapps2024.utils import changelists, group_commit, pubsub, replicas
+from webapps2024.utils.choices import TRANSACTION_STATUS
+from webapps2024.utils.pagination import keyset_paginate
+
+
+def make_user(username, currency="USD", balance="100.00"):
+    user = CustomUser.objects.create_user(email=f"{username}@example.com", username=username, password="pass1234")
+    ledger.open_account(user, currency, balance)
+    return user
+
+
+def balance_of(user):
+    return OnlineAccount.objects.get(user=user).balance
+
+
+def start_deposit(client, amount):
+    """Choose ``amount`` on the deposit page, as the selection pages expect."""
+    session = client.session
+    flows.store(session, flows.Deposit(Decimal(amount)))
+    session.save()
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.alice = make_user("alice")
+        self.bob = make_user("bob")
+
+    def test_transfer_moves_money_and_records_both_sides(self):
+        credited = ledger.transfer(self.alice, self.bob, "30.00")
+
+        self.assertEqual(credited, Decimal("30.00"))
+        self.assertEqual(balance_of(self.alice), Decimal("70.00"))
+        self.assertEqual(balance_of(self.bob), Decimal("130.00"))
+        self.assertEqual(TransactionHistory.objects.filter(sender=self.alice, status="✔️").count(), 1)
+        self.assertEqual(TransactionHistory.objects.filter(sender=self.bob, status="📥").count(), 1)
+
+    def test_transfer_refuses_to_overdraw(self):
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.transfer(self.alice, self.bob, "100.01")
+
+        self.assertEqual(balance_of(self.alice), Decimal("100.00"))
+        self.assertEqual(balance_of(self.bob), Decimal("100.00"))
+        self.assertFalse(TransactionHistory.objects.exists())
+
+    def test_transfer_converts_to_recipient_currency(self):
+        carol = make_user("carol", currency="EUR")
+
+        credited = ledger.transfer(self.alice, carol, "10.00")
+
+        self.assertEqual(credited, Decimal("9.33"))
+        self.assertEqual(balance_of(self.alice), Decimal("90.00"))
+        self.assertEqual(balance_of(carol), Decimal("109.33"))
+
+    def test_deposit_and_withdraw(self):
+        bank = BankAccount.objects.create(user=self.alice, account_number="0123456789")
+
+        ledger.deposit(self.alice, "25.50", "Deposit from bank account", bank_account=bank)
+        ledger.withdraw(self.alice, "5.50", bank)
+
+        self.assertEqual(balance_of(self.alice), Decimal("120.00"))
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.withdraw(self.alice, "500", bank)
+
+    def test_rejects_non_positive_amounts(self):
+        with self.assertRaises(ValueError):
+            ledger.transfer(self.alice, self.bob, "-5")
+
+
+class BatchTransferTests(TestCase):
+    def setUp(self):
+        self.payer = make_user("payer", balance="100.00")
+        self.bob = make_user("bob")
+        self.carol = make_user("carol", currency="EUR")
+
+    def test_reports_each_item_and_pays_what_it_can(self):
+        results = ledger.transfer_many(self.payer, [
+            ("bob@example.com", "30.00", None),
+            ("nobody@example.com", "5.00", None),
+            ("carol@example.com", "10.00", "USD"),
+            ("bob@example.com", "80.00", None),
+        ])
+
+        self.assertEqual([result["status"] for result in results], ["ok", "failed", "ok", "failed"])
+        self.assertEqual(results[3]["error"], "Insufficient funds.")
+        self.assertEqual(balance_of(self.payer), Decimal("60.00"))
+        self.assertEqual(balance_of(self.bob), Decimal("130.00"))
+        self.assertEqual(balance_of(self.carol), Decimal("109.33"))
+        self.assertEqual(TransactionHistory.objects.filter(description__startswith="Batch payout").count(), 4)
+
+    def test_an_item_that_does_not_fit_does_not_stop_smaller_ones(self):
+        results = ledger.transfer_many(self.payer, [
+            ("bob@example.com", "60.00", None),
+            ("bob@example.com", "50.00", None),
+            ("bob@example.com", "40.00", None),
+            ("bob@example.com", "10.00", None),
+        ])
+
+        self.assertEqual([result["status"] for result in results], ["ok", "failed", "ok", "failed"])
+        self.assertEqual(balance_of(self.payer), Decimal("0.00"))
+        self.assertEqual(balance_of(self.bob), Decimal("200.00"))
+
+    def test_batch_runs_in_constant_queries(self):
+        items = [("bob@example.com", "1.00", None), ("carol@example.com", "1.00", None)] * 20
+        rates.current_table()
+
+        # the month's first postings also insert their rollups; one INSERT queues
+        # the notifications
+        with self.assertNumQueries(12):
+            ledger.transfer_many(self.payer, items)
+
+        self.assertEqual(balance_of(self.payer), Decimal("60.00"))
+        self.assertEqual(ledger.rebuild_balance(OnlineAccount.objects.get(user=self.carol)), balance_of(self.carol))
+
+    def test_api(self):
+        self.client.force_login(self.payer)
+
+        response = self.client.post(reverse("batch_transfer"), {"items": [
+            {"recipient_email": "bob@example.com", "amount": "12.50"},
+            {"recipient_email": "bob@example.com", "amount": "-1"},
+        ]}, content_type="application/json")
+
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse("batch_transfer"), {"items": [
+            {"recipient_email": "bob@example.com", "amount": "12.50"},
+        ]}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["succeeded"], 1)
+        self.assertEqual(response.json()["results"][0]["credited"], "12.50")
+
+
+class RateTableTests(TestCase):
+    def setUp(self):
+        rates.invalidate()
+
+    def tearDown(self):
+        rates.invalidate()
+
+    def test_derives_identity_inverse_and_cross_rates(self):
+        table = rates.RateTable(1, {("USD", "EUR"): Decimal("0.9"), ("GBP", "USD"): Decimal("1.25")})
+
+        self.assertEqual(table.rate("EUR", "EUR"), 1)
+        self.assertEqual(table.rate("EUR", "USD"), Decimal("1.111111"))
+        self.assertEqual(table.rate("GBP", "EUR"), Decimal("1.125000"))
+        self.assertEqual(table.convert(Decimal("10.00"), "EUR", "GBP"), Decimal("8.89"))
+        with self.assertRaises(rates.ExchangeRateNotFound):
+            table.rate("USD", "JPY")
+
+    def test_conversions_do_not_touch_the_database(self):
+        rates.current_table()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(ledger.convert(Decimal("10.00"), "GBP", "GBP"), Decimal("10.00"))
+            self.assertEqual(ledger.convert(Decimal("10.00"), "USD", "EUR"), Decimal("9.33"))
+
+    def test_rate_edits_bump_the_version(self):
+        version = rates.current_table().version
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CurrencyConversion.objects.create(currency_from="USD", currency_to="EUR", exchange_rate=Decimal("0.5"))
+
+        self.assertEqual(rates.current_table().version, version + 1)
+        self.assertEqual(ledger.convert(Decimal("10.00"), "USD", "EUR"), Decimal("5.00"))
+
+    def test_other_processes_pick_up_new_versions(self):
+        rates.current_table()
+        # as if another worker changed the rates: the row and counter move,
+        # but this process's table is not dropped
+        CurrencyConversion.objects.bulk_create([
+            CurrencyConversion(currency_from="USD", currency_to="EUR", exchange_rate=Decimal("0.5")),
+        ])
+        rates.bump_version()
+
+        self.assertEqual(ledger.convert(Decimal("10.00"), "USD", "EUR"), Decimal("9.33"))
+        with mock.patch.object(rates, "REFRESH_SECONDS", 0):
+            self.assertEqual(ledger.convert(Decimal("10.00"), "USD", "EUR"), Decimal("5.00"))
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.alice = make_user("alice")
+        TransactionHistory.objects.bulk_create(
+            TransactionHistory(sender=self.alice, description=f"row {i}", amount=i) for i in range(45)
+        )
+        # force timestamp ties so the id tie-breaker is exercised
+        first = TransactionHistory.objects.order_by("id").first()
+        TransactionHistory.objects.filter(id__lt=first.id + 30).update(created_at=first.created_at)
+
+    def test_walks_every_row_once_in_order(self):
+        queryset = TransactionHistory.objects.filter(sender=self.alice)
+        seen, cursor = [], None
+        while True:
+            page = keyset_paginate(queryset, cursor, page_size=10)
+            seen.extend(row.pk for row in page)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+
+        expected = list(queryset.order_by("-created_at", "-id").values_list("pk", flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_html_and_json_pages(self):
+        self.client.force_login(self.alice)
+
+        response = self.client.get(reverse("all_reansaction_history"), {"limit": 20})
+        self.assertEqual(len(response.context["transaction_history"]), 20)
+        self.assertTrue(response.context["page"].has_next)
+
+        response = self.client.get(reverse("transaction_history_api"), {"limit": 40})
+        cursor = response.json()["next_cursor"]
+        response = self.client.get(reverse("transaction_history_api"), {"limit": 40, "cursor": cursor})
+        self.assertEqual(len(response.json()["results"]), 5)
+        self.assertIsNone(response.json()["next_cursor"])
+
+        response = self.client.get(reverse("payment_request_list_api"), {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class AsyncReadViewTests(TestCase):
+    def setUp(self):
+        self.alice = make_user("alice")
+        self.bob = make_user("bob")
+        for amount in ("1.00", "2.00", "3.00"):
+            ledger.transfer(self.alice, self.bob, amount, sent_description=f"Sent {amount}")
+            PaymentRequest.objects.create(
+                sender=self.bob, recipient=self.alice, amount=Decimal(amount), message=f"Owe {amount}", status="PENDING"
+            )
+
+    def request(self, name, user=None, **params):
+        request = AsyncRequestFactory().get(reverse(name), params)
+        request.user = user or self.alice
+        return request
+
+    async def test_history_pages(self):
+        response = await views.all_transaction_history_async(self.request("all_reansaction_history", limit=2))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Sent 3.00")
+        self.assertContains(response, "Sent 2.00")
+        self.assertNotContains(response, "Sent 1.00")
+        self.assertContains(response, "cursor=")
+
+    async def test_payment_request_list(self):
+        response = await views.payment_request_list_async(self.request("payment_request_list"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Owe 1.00")
+
+    async def test_anonymous_users_are_sent_to_login(self):
+        response = await views.all_transaction_history_async(self.request("all_reansaction_history", AnonymousUser()))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith(reverse("user_login")))
+
+
+class JournalTests(TestCase):
+    def setUp(self):
+        self.alice = make_user("alice")
+        self.carol = make_user("carol", currency="EUR")
+        self.bank = BankAccount.objects.create(user=self.alice, account_number="0123456789")
+
+    def test_every_entry_balances_per_currency(self):
+        ledger.deposit(self.alice, "40.00", "Deposit from bank account", bank_account=self.bank)
+        ledger.transfer(self.alice, self.carol, "10.00")
+        ledger.withdraw(self.alice, "5.00", self.bank)
+
+        for entry in JournalEntry.objects.all():
+            totals = entry.lines.values("currency").annotate(total=Sum("amount"))
+            self.assertTrue(all(row["total"] == 0 for row in totals), entry)
+
+    def test_rebuild_matches_stored_balance(self):
+        ledger.deposit(self.alice, "40.00", "Deposit from bank account", bank_account=self.bank)
+        ledger.transfer(self.alice, self.carol, "10.00")
+
+        for user in (self.alice, self.carol):
+            account = OnlineAccount.objects.get(user=user)
+            self.assertEqual(ledger.rebuild_balance(account), account.balance)
+
+    def test_rebuild_replays_only_lines_after_checkpoint(self):
+        account = OnlineAccount.objects.get(user=self.alice)
+        ledger.deposit(self.alice, "40.00", "Deposit from bank account", bank_account=self.bank)
+        checkpoint = ledger.checkpoint(account)
+        # lines before the checkpoint no longer contribute to the rebuild
+        JournalLine.objects.filter(account=account, id__lte=checkpoint.last_line_id).delete()
+        ledger.withdraw(self.alice, "15.00", self.bank)
+
+        self.assertEqual(ledger.rebuild_balance(account), Decimal("125.00"))
+        self.assertEqual(balance_of(self.alice), Decimal("125.00"))
+
+
+class RunningBalanceTests(TestCase):
+    def setUp(self):
+        self.alice = make_user("alice")
+        self.bob = make_user("bob")
+        self.carol = make_user("carol", currency="EUR")
+        self.bank = BankAccount.objects.create(user=self.alice, account_number="0123456789")
+
+    def post_some_money(self):
+        ledger.deposit(self.alice, "40.00", "Deposit from bank account", bank_account=self.bank)
+        ledger.transfer(self.alice, self.bob, "15.00")
+        ledger.transfer_many(self.alice, [("bob@example.com", "5.00", None), ("carol@example.com", "10.00", "USD"),
+                                          ("bob@example.com", "20.00", None)])
+        ledger.withdraw(self.alice, "30.00", self.bank)
+
+    def running_balances(self, user):
+        return list(TransactionHistory.objects.filter(sender=user).order_by("id").values_list("balance_after", flat=True))
+
+    def test_postings_record_the_balance_they_leave(self):
+        self.post_some_money()
+
+        self.assertEqual(self.running_balances(self.alice), [
+            Decimal("140.00"), Decimal("125.00"), Decimal("120.00"), Decimal("110.00"), Decimal("90.00"), Decimal("60.00"),
+        ])
+        self.assertEqual(self.running_balances(self.bob), [Decimal("115.00"), Decimal("120.00"), Decimal("140.00")])
+        self.assertEqual(self.running_balances(self.carol), [Decimal("109.33")])
+        account = OnlineAccount.objects.get(user=self.alice)
+        last_line = JournalLine.objects.filter(account=account).latest("id")
+        self.assertEqual(last_line.balance_after, account.balance)
+
+    def test_backfill_reproduces_the_recorded_balances(self):
+        self.post_some_money()
+        TransactionHistory.objects.create(sender=self.bob, recipient=self.alice, status="✔️",
+                                          amount=Decimal("3.00"), description="Request Payment (sent)")
+        # batch rows included: each keeps the balance after its own item
+        expected = dict(TransactionHistory.objects.exclude(description="Request Payment (sent)")
+                        .values_list("id", "balance_after"))
+        expected_lines = list(JournalLine.objects.order_by("id").values_list("balance_after", flat=True))
+        # a value already there is kept
+        kept = TransactionHistory.objects.filter(sender=self.bob, description__startswith="Batch").first()
+        expected[kept.pk] = Decimal("-1")
+        JournalLine.objects.update(balance_after=None)
+        TransactionHistory.objects.update(balance_after=None)
+        TransactionHistory.objects.filter(pk=kept.pk).update(balance_after=Decimal("-1"))
+
+        lines, history = ledger.backfill_running_balances(chunk_size=3)
+
+        self.assertEqual(list(JournalLine.objects.order_by("id").values_list("balance_after", flat=True)), expected_lines)
+        self.assertEqual(lines, sum(balance is not None for balance in expected_lines))
+        backfilled = TransactionHistory.objects.filter(id__in=expected)
+        self.assertEqual(dict(backfilled.values_list("id", "balance_after")), expected)
+        # every row but the kept one, and the payment request
+        self.assertEqual(history, len(expected))
+        # the payment request moved nothing and shows bob's balance as it stood
+        self.assertEqual(TransactionHistory.objects.get(description="Request Payment (sent)").balance_after,
+                         Decimal("140.00"))
+        self.assertEqual(ledger.backfill_running_balances(), (0, 0))
+
+    @override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+    def test_history_page_shows_balances_without_aggregating(self):
+        self.post_some_money()
+        self.client.force_login(self.alice)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("all_reansaction_history"))
+
+        self.assertContains(response, "<span class=\"payment-amaount\">60.00</span>", html=True)
+        self.assertLessEqual(len(queries), views.all_reansaction_history.query_budget)
+        self.assertFalse(any("SUM(" in query["sql"].upper() for query in queries.captured_queries))
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class StatementExportTests(TestCase):
+    def setUp(self):
+        self.alice = make_user("alice")
+        self.bob = make_user("bob")
+        self.bank = BankAccount.objects.create(user=self.alice, account_number="0123456789")
+        ledger.deposit(self.alice, "40.00", "Deposit from bank account", bank_account=self.bank)
+        for amount in ("1.00", "2.00", "3.00"):
+            ledger.transfer(self.alice, self.bob, amount, sent_description=f"Sent {amount}")
+        TransactionHistory.objects.filter(description="Sent 1.00").update(
+            created_at=timezone.make_aware(timezone.datetime(2024, 1, 15, 12))
+        )
+        self.client.force_login(self.alice)
+
+    def export(self, fmt, **params):
+        response = self.client.get(reverse("export_transaction_history", args=[fmt]), params)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv(self):
+        lines = self.export("csv").splitlines()
+
+        self.assertEqual(lines[0], ",".join(statements.COLUMNS))
+        self.assertEqual(len(lines), 5)
+        self.assertIn(",alice,Deposit from bank account,✔️,40.00,140.00,,0123456789", lines[2])
+        self.assertIn(",alice,Sent 3.00,✔️,3.00,134.00,bob,", lines[4])
+
+    def test_json_lines_within_a_date_range(self):
+        rows = [json.loads(line) for line in self.export("jsonl", **{"from": "2024-01-01", "to": "2024-01-31"}).splitlines()]
+
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["description"], "Sent 1.00")
+        self.assertEqual(rows[0]["counterparty"], "bob")
+        self.assertEqual(rows[0]["amount"], "1.00")
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get(reverse("export_transaction_history", args=["pdf"])).status_code, 404)
+        response = self.client.get(reverse("export_transaction_history", args=["csv"]), {"from": "2024-02-01", "to": "2024-01-01"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_rows_stream_from_a_single_query(self):
+        TransactionHistory.objects.bulk_create(
+            TransactionHistory(sender=self.alice, recipient=self.bob, bank_account=self.bank, amount=Decimal("1.00"))
+            for _ in range(1200)
+        )
+        rows = statements.statement_rows(self.alice)
+
+        with self.assertNumQueries(1):
+            chunks = list(statements.render(rows, "csv", chunk_size=100))
+
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(sum(chunk.count("\n") for chunk in chunks), 1 + 1204)
+
+    async def test_async_export(self):
+        request = AsyncRequestFactory().get(reverse("export_transaction_history", args=["jsonl"]))
+        request.user = self.alice
+
+        response = await views.export_transaction_history_async(request, "jsonl")
+
+        body = b"".join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(len(body.splitlines()), 4)
+
+    def test_command_exports_every_account(self):
+        output = StringIO()
+        call_command("export_statements", "--format", "jsonl", stdout=output)
+
+        accounts = [json.loads(line)["account"] for line in output.getvalue().splitlines()]
+        self.assertEqual(accounts.count("alice"), 4)
+        self.assertEqual(accounts.count("bob"), 3)
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class MonthlyRollupTests(TestCase):
+    def setUp(self):
+        self.alice = make_user("alice")
+        self.bob = make_user("bob")
+        self.carol = make_user("carol", currency="EUR")
+        self.bank = BankAccount.objects.create(user=self.alice, account_number="0123456789")
+        self.month = timezone.localdate().replace(day=1)
+
+    def post_some_money(self):
+        ledger.deposit(self.alice, "40.00", "Deposit from bank account", bank_account=self.bank)
+        ledger.transfer(self.alice, self.bob, "15.00")
+        ledger.transfer_many(self.alice, [("bob@example.com", "5.00", None), ("carol@example.com", "10.00", "USD")])
+        ledger.withdraw(self.alice, "30.00", self.bank)
+
+    def rollups(self):
+        return {
+            (rollup.user.username, rollup.currency, rollup.direction): (rollup.count, rollup.total, rollup.minimum, rollup.maximum)
+            for rollup in MonthlyRollup.objects.select_related("user")
+        }
+
+    def test_postings_update_the_rollups(self):
+        self.post_some_money()
+
+        # opening balances are not counted; every item of a batch is
+        self.assertEqual(self.rollups(), {
+            ("alice", "USD", "RECEIVED"): (1, Decimal("40.00"), Decimal("40.00"), Decimal("40.00")),
+            ("alice", "USD", "SENT"): (4, Decimal("60.00"), Decimal("5.00"), Decimal("30.00")),
+            ("bob", "USD", "RECEIVED"): (2, Decimal("20.00"), Decimal("5.00"), Decimal("15.00")),
+            ("carol", "EUR", "RECEIVED"): (1, Decimal("9.33"), Decimal("9.33"), Decimal("9.33")),
+        })
+        self.assertEqual({rollup.month for rollup in MonthlyRollup.objects.all()}, {self.month})
+
+    def test_later_postings_cost_one_update(self):
+        ledger.transfer(self.alice, self.bob, "1.00")
+
+        with CaptureQueriesContext(connection) as queries:
+            ledger.transfer(self.alice, self.bob, "2.00")
+
+        rollup_queries = [query["sql"] for query in queries.captured_queries if "payapp_monthlyrollup" in query["sql"]]
+        self.assertEqual(len(rollup_queries), 1)
+        self.assertTrue(rollup_queries[0].startswith("UPDATE"))
+
+    def test_rebuild_reproduces_the_rollups(self):
+        self.post_some_money()
+        expected = self.rollups()
+        MonthlyRollup.objects.filter(user=self.alice).update(count=0, total=0)
+        MonthlyRollup.objects.filter(user=self.bob).delete()
+
+        output = StringIO()
+        call_command("rebuild_rollups", "--chunk-size", "2", stdout=output)
+
+        self.assertEqual(self.rollups(), expected)
+        self.assertIn("Wrote 4 monthly rollups.", output.getvalue())
+
+    def test_batch_items_roll_up_one_by_one_as_the_rebuild_does(self):
+        ledger.transfer(self.alice, self.bob, "1.00")
+        ledger.transfer_many(self.alice, [
+            ("bob@example.com", "5.00", None), ("carol@example.com", "10.00", "USD"), ("bob@example.com", "20.00", None),
+        ])
+        posted = self.rollups()
+
+        ledger.rebuild_rollups()
+
+        self.assertEqual(self.rollups(), posted)
+        self.assertEqual(posted[("alice", "USD", "SENT")], (4, Decimal("36.00"), Decimal("1.00"), Decimal("20.00")))
+        self.assertEqual(posted[("bob", "USD", "RECEIVED")], (3, Decimal("26.00"), Decimal("1.00"), Decimal("20.00")))
+
+    def test_dashboard_summary(self):
+        self.post_some_money()
+        self.client.force_login(self.alice)
+
+        response = self.client.get(reverse("user_dashboard"))
+
+        self.assertContains(response, '<h4 class="month-sent">60.00 <small>USD</small></h4>', html=True)
+        self.assertContains(response, '<h4 class="month-received">40.00 <small>USD</small></h4>', html=True)
+
+    def test_admin_reports_read_only_the_rollups(self):
+        self.post_some_money()
+        self.client.force_login(CustomUser.objects.create_superuser(
+            email="admin@example.com", username="admin", password="pass1234",
+        ))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("admin:payapp_monthlyrollup_changelist"), {"direction__exact": "SENT"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(row["currency"], row["count"], row["total"]) for row in response.context["volume"]],
+                         [("USD", 4, Decimal("60.00"))])
+        self.assertFalse(any("payapp_transactionhistory" in query["sql"] for query in queries.captured_queries))
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class PendingRequestCounterTests(TestCase):
+    def setUp(self):
+        self.alice = make_user("alice")
+        self.bob = make_user("bob", balance="10.00")
+
+    def counts(self, user):
+        counter = PendingRequestCounter.objects.filter(user=user).first()
+        return (counter.incoming, counter.outgoing) if counter else (0, 0)
+
+    def ask_bob(self, amount="5.00"):
+        self.client.force_login(self.alice)
+        self.client.post(reverse("request_money"), {"recipient_email": "bob@example.com", "amount": amount, "currency": "USD"})
+        return PaymentRequest.objects.latest("pk")
+
+    def answer(self, payment_request, action):
+        self.client.force_login(self.bob)
+        return self.client.post(reverse("respond_to_payment_request", args=[payment_request.pk]), {"action": action})
+
+    def test_requests_are_counted_until_answered(self):
+        first = self.ask_bob()
+        second = self.ask_bob()
+        self.assertEqual((self.counts(self.alice), self.counts(self.bob)), ((0, 2), (2, 0)))
+
+        self.answer(first, "accepted")
+        self.assertEqual((self.counts(self.alice), self.counts(self.bob)), ((0, 1), (1, 0)))
+
+        self.answer(second, "rejected")
+        self.assertEqual((self.counts(self.alice), self.counts(self.bob)), ((0, 0), (0, 0)))
+
+    def test_a_request_is_answered_once(self):
+        payment_request = self.ask_bob()
+        self.answer(payment_request, "rejected")
+
+        # a stale copy, as held by a concurrent answer
+        self.assertFalse(payment_requests.resolve(payment_request, TRANSACTION_STATUS.SUCCESS))
+        payment_request.refresh_from_db()
+        self.assertEqual(payment_request.status, TRANSACTION_STATUS.FAILED)
+        self.assertEqual(balance_of(self.bob), Decimal("10.00"))
+        self.assertEqual(self.counts(self.bob), (0, 0))
+
+    def test_failed_transfer_keeps_the_request_pending(self):
+        payment_request = self.ask_bob(amount="50.00")
+
+        response = self.answer(payment_request, "accepted")
+
+        self.assertRedirects(response, reverse("payment_failed"), fetch_redirect_response=False)
+        payment_request.refresh_from_db()
+        self.assertEqual(payment_request.status, TRANSACTION_STATUS.PENDING)
+        self.assertEqual((self.counts(self.alice), self.counts(self.bob)), ((0, 1), (1, 0)))
+
+    def test_counts_load_with_the_session_user(self):
+        self.ask_bob()
+        self.ask_bob()
+        self.client.force_login(self.bob)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("payment_request_list"))
+
+        self.assertContains(response, "2 pending received, 0 pending sent")
+        self.assertFalse(any("payapp_pendingrequestcounter" in query["sql"] and "JOIN" not in query["sql"]
+                             for query in queries.captured_queries))
+
+    def test_recount_repairs_the_counters(self):
+        self.ask_bob()
+        PaymentRequest.objects.create(
+            sender=self.bob, recipient=self.alice, amount="1.00", currency="USD", status=TRANSACTION_STATUS.PENDING,
+        )
+        PendingRequestCounter.objects.all().delete()
+        PendingRequestCounter.objects.create(user=self.alice, incoming=7, outgoing=7)
+
+        output = StringIO()
+        call_command("recount_payment_requests", "--chunk-size", "1", stdout=output)
+
+        self.assertEqual((self.counts(self.alice), self.counts(self.bob)), ((1, 1), (1, 1)))
+        self.assertIn("Recounted the pending payment requests of 2 users.", output.getvalue())
+
+
+class FailingChannel:
+    def deliver(self, messages):
+        raise ConnectionError("mail server down")
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.alice = make_user("alice")
+        self.bob = make_user("bob", balance="10.00")
+
+    def test_transfers_queue_a_message_per_channel(self):
+        ledger.transfer(self.alice, self.bob, "5.00")
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.transfer(self.bob, self.alice, "500.00")
+
+        # the failed transfer rolled its messages back with it
+        self.assertEqual(sorted(OutboxMessage.objects.values_list("channel", "event", "recipient_id")), [
+            ("email", "transfer.received", self.bob.pk), ("in_app", "transfer.received", self.bob.pk),
+        ])
+        self.assertEqual(OutboxMessage.objects.first().payload["body"], "alice sent you 5.00 USD.")
+
+    def test_payment_requests_queue_a_message(self):
+        self.client.force_login(self.alice)
+        self.client.post(reverse("request_money"), {"recipient_email": "bob@example.com", "amount": "3", "currency": "USD"})
+
+        self.assertEqual(OutboxMessage.objects.filter(event="payment_request.received", recipient=self.bob).count(), 2)
+
+    def test_delivery_sends_and_deletes_the_messages(self):
+        ledger.transfer(self.alice, self.bob, "5.00")
+        ledger.transfer(self.bob, self.alice, "1.00")
+
+        self.assertEqual(outbox.deliver_due(), (4, 0))
+
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox), ["alice@example.com", "bob@example.com"])
+        self.assertEqual(set(Notification.objects.values_list("user_id", "message")), {
+            (self.bob.pk, "alice sent you 5.00 USD."), (self.alice.pk, "bob sent you 1.00 USD."),
+        })
+        self.assertFalse(OutboxMessage.objects.exists())
+        self.assertEqual(outbox.deliver_due(), (0, 0))
+
+    def test_in_app_delivery_is_idempotent(self):
+        ledger.transfer(self.alice, self.bob, "5.00")
+        messages = list(OutboxMessage.objects.filter(channel="in_app"))
+
+        outbox.InAppChannel().deliver(messages)
+        outbox.InAppChannel().deliver(messages)
+
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_failures_are_retried_with_backoff_then_kept(self):
+        ledger.transfer(self.alice, self.bob, "5.00")
+        channels = {"email": FailingChannel(), "in_app": outbox.InAppChannel()}
+
+        self.assertEqual(outbox.deliver_due(channels=channels), (1, 1))
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.channel, message.attempts), ("email", 1))
+        self.assertIn("mail server down", message.last_error)
+        self.assertGreater(message.available_at, timezone.now())
+        # not due again until the backoff has passed
+        self.assertEqual(outbox.deliver_due(channels=channels), (0, 0))
+
+        for attempt in range(2, outbox.MAX_ATTEMPTS + 1):
+            OutboxMessage.objects.update(available_at=timezone.now())
+            self.assertEqual(outbox.deliver_due(channels=channels), (0, 1))
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, outbox.MAX_ATTEMPTS)
+        self.assertIsNotNone(message.failed_at)
+        OutboxMessage.objects.update(available_at=timezone.now())
+        self.assertEqual(outbox.deliver_due(channels=channels), (0, 0))
+
+    def test_retry_delay_grows_and_is_capped(self):
+        with mock.patch("payapp.outbox.random.uniform", return_value=1):
+            self.assertEqual([outbox.retry_delay(attempts) for attempts in (1, 2, 3)],
+                             [outbox.RETRY_BASE_SECONDS, 2 * outbox.RETRY_BASE_SECONDS, 4 * outbox.RETRY_BASE_SECONDS])
+            self.assertEqual(outbox.retry_delay(50), outbox.RETRY_MAX_SECONDS)
+
+    @override_settings(OUTBOX_CHANNELS={"webhook": "payapp.outbox.WebhookChannel"},
+                       OUTBOX_WEBHOOK_URL="http://hooks.example.com/payapp")
+    def test_webhook_posts_each_batch_once(self):
+        ledger.transfer(self.alice, self.bob, "5.00")
+        ledger.transfer(self.bob, self.alice, "1.00")
+
+        with mock.patch("payapp.outbox.urllib.request.urlopen") as urlopen:
+            self.assertEqual(outbox.deliver_due(), (2, 0))
+
+        urlopen.assert_called_once()
+        request = urlopen.call_args.args[0]
+        self.assertEqual(request.full_url, "http://hooks.example.com/payapp")
+        body = json.loads(request.data)
+        self.assertEqual([(message["event"], message["user"], message["data"]["amount"]) for message in body["messages"]],
+                         [("transfer.received", self.bob.pk, "5.00"), ("transfer.received", self.alice.pk, "1.00")])
+
+    def test_worker_command(self):
+        ledger.transfer(self.alice, self.bob, "5.00")
+        output = StringIO()
+
+        call_command("deliver_outbox", "--once", "--batch-size", "1", stdout=output)
+
+        self.assertIn("Delivered 2 messages, 0 failed.", output.getvalue())
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_history_rows_queue_their_notification(self):
+        history = TransactionHistory.objects.create(sender=self.alice, recipient=self.bob, amount="2.00")
+
+        history.generate_notification()
+
+        self.assertEqual(OutboxMessage.objects.filter(recipient=self.bob, event="payment_request.received").count(), 2)
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class LiveEventsTests(TestCase):
+    def setUp(self):
+        self.alice = make_user("alice")
+        self.bob = make_user("bob")
+
+    async def test_publish_reaches_subscribers_from_other_threads(self):
+        async with pubsub.subscribe(self.bob.pk) as queue:
+            self.assertTrue(pubsub.listening([self.alice.pk, self.bob.pk]))
+            await asyncio.to_thread(pubsub.publish, self.bob.pk, "balance", {"balance": "1.00"})
+            self.assertEqual(await asyncio.wait_for(queue.get(), 1), ("balance", {"balance": "1.00"}))
+
+        self.assertFalse(pubsub.listening([self.bob.pk]))
+
+    def test_postings_publish_balances_on_commit(self):
+        with mock.patch.dict(pubsub._subscribers, {self.bob.pk: set()}), \
+                mock.patch("webapps2024.utils.pubsub.publish") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                ledger.transfer(self.alice, self.bob, "5.00")
+                publish.assert_not_called()
+
+        # only bob is listening
+        publish.assert_called_once_with(self.bob.pk, "balance", {"balance": Decimal("105.00"), "currency": "USD"})
+
+    def test_new_payment_requests_are_published(self):
+        self.client.force_login(self.alice)
+        with mock.patch.dict(pubsub._subscribers, {self.bob.pk: set()}), \
+                mock.patch("webapps2024.utils.pubsub.publish") as publish, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("request_money"), {"recipient_email": "bob@example.com", "amount": "3", "currency": "USD"})
+
+        payment_request = PaymentRequest.objects.get()
+        publish.assert_called_once_with(self.bob.pk, "payment_request", {
+            "id": payment_request.pk, "sender": "alice", "amount": Decimal("3"), "currency": "USD",
+        })
+
+    def test_nothing_is_published_without_listeners(self):
+        with mock.patch("webapps2024.utils.pubsub.publish") as publish, self.captureOnCommitCallbacks(execute=True):
+            ledger.transfer(self.alice, self.bob, "5.00")
+
+        publish.assert_not_called()
+
+    async def test_stream(self):
+        request = AsyncRequestFactory().get(reverse("live_events"))
+        request.user = self.alice
+
+        with mock.patch.object(live, "STREAM_SECONDS", 0.3), mock.patch.object(live, "HEARTBEAT_SECONDS", 0.1):
+            response = await views.live_events(request)
+            chunks = []
+            async for chunk in response.streaming_content:
+                chunks.append(chunk)
+                if len(chunks) == 2:
+                    # the current balance comes first, then published events
+                    pubsub.publish(self.alice.pk, "payment_request", {"id": 7})
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(chunks[:3], [
+            b"retry: 1000\n\n",
+            b'id: 0\nevent: balance\ndata: {"balance": "100.00", "currency": "USD"}\n\n',
+            b'id: 7\nevent: payment_request\ndata: {"id": 7}\n\n',
+        ])
+        self.assertIn(b": keep-alive\n\n", chunks[3:])
+        self.assertFalse(pubsub.listening([self.alice.pk]))
+
+    async def test_reconnecting_stream_replays_missed_payment_requests(self):
+        async def first_events(last_event_id=None):
+            headers = {} if last_event_id is None else {"Last-Event-ID": last_event_id}
+            request = AsyncRequestFactory().get(reverse("live_events"), headers=headers)
+            request.user = self.alice
+            response = await views.live_events(request)
+            chunks = [chunk async for chunk in response.streaming_content]
+            return [chunk for chunk in chunks if chunk.startswith(b"id:")]
+
+        seen = await PaymentRequest.objects.acreate(sender=self.bob, recipient=self.alice, amount=Decimal("1.00"), currency="USD")
+        with mock.patch.object(live, "STREAM_SECONDS", 0):
+            events = await first_events()
+            last_event_id = events[-1].split(b"\n")[0].removeprefix(b"id: ").decode()
+            self.assertEqual(last_event_id, str(seen.pk))
+
+            # published while the browser waits to reconnect, with nobody listening
+            missed = await PaymentRequest.objects.acreate(sender=self.bob, recipient=self.alice, amount=Decimal("2.00"), currency="USD")
+            events = await first_events(last_event_id)
+
+        self.assertEqual(events[1:], [
+            f'id: {missed.pk}\nevent: payment_request\n'
+            f'data: {{"id": {missed.pk}, "sender": "bob", "amount": "2.00", "currency": "USD"}}\n\n'.encode(),
+        ])
+
+    async def test_replayed_payment_requests_are_not_sent_twice(self):
+        missed = await PaymentRequest.objects.acreate(sender=self.bob, recipient=self.alice, amount=Decimal("2.00"), currency="USD")
+        chunks = []
+
+        with mock.patch.object(live, "STREAM_SECONDS", 0.2), mock.patch.object(live, "HEARTBEAT_SECONDS", 0.1):
+            async for chunk in live.stream(self.alice.pk, "0"):
+                chunks.append(chunk)
+                if len(chunks) == 1:
+                    # also published as the stream reads the database
+                    pubsub.publish(self.alice.pk, "payment_request", {"id": missed.pk})
+
+        self.assertEqual(len([chunk for chunk in chunks if "event: payment_request" in chunk]), 1)
+
+    def test_wsgi_profile_tells_the_browser_not_to_reconnect(self):
+        self.client.force_login(self.alice)
+
+        response = self.client.get(reverse("live_events"))
+
+        self.assertEqual(response.status_code, 204)
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class PaymentViewTests(TestCase):
+    def setUp(self):
+        self.alice = make_user("alice")
+        self.bob = make_user("bob")
+        self.client.login(email="alice@example.com", password="pass1234")
+
+    def test_direct_payment_uses_ledger(self):
+        session = self.client.session
+        flows.store(session, flows.DirectPayment("bob@example.com", Decimal("12.34"), "USD"))
+        session.save()
+
+        response = self.client.post(reverse("directpayment_confirmation"), {})
+
+        self.assertRedirects(response, reverse("payment_success"), fetch_redirect_response=False)
+        self.assertEqual(balance_of(self.alice), Decimal("87.66"))
+        self.assertEqual(balance_of(self.bob), Decimal("112.34"))
+
+    def test_withdraw_insufficient_balance_leaves_account_untouched(self):
+        bank = BankAccount.objects.create(user=self.alice, account_number="0123456789")
+
+        self.client.post(reverse("withdraw_money_confirm"), {"bank_account": bank.pk, "amount": "150.00"})
+
+        self.assertEqual(balance_of(self.alice), Decimal("100.00"))
+
+
+class FlowStateTests(TestCase):
+    def test_state_is_stored_compactly_and_loaded_typed(self):
+        session = {}
+        flows.store(session, flows.Withdrawal(bank_account_id=3, amount=Decimal("12.50")))
+
+        self.assertEqual(session, {"withdrawal": [3, "12.50"]})
+        self.assertEqual(flows.load(session, flows.Withdrawal), flows.Withdrawal(3, Decimal("12.50")))
+
+    def test_missing_or_unreadable_state(self):
+        self.assertIsNone(flows.load({}, flows.Deposit))
+        self.assertIsNone(flows.load({"deposit": ["lots"]}, flows.Deposit))
+        self.assertIsNone(flows.load({"deposit": ["1.00", "extra"]}, flows.Deposit))
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class MultiStepFlowTests(TestCase):
+    def setUp(self):
+        self.alice = make_user("alice")
+        self.bank = BankAccount.objects.create(user=self.alice, account_number="0123456789")
+        self.client.login(email="alice@example.com", password="pass1234")
+
+    def test_deposit_amount_travels_in_the_session(self):
+        response = self.client.post(reverse("deposite_money"), {"payment_method": "Bank Account", "amount": "25"})
+        self.assertRedirects(response, reverse("bank_selection"), fetch_redirect_response=False)
+        self.assertEqual(self.client.get(reverse("bank_selection")).context["amount"], Decimal("25.00"))
+
+        response = self.client.post(reverse("bank_selection"), {"bank_account": self.bank.pk})
+
+        receipt = reverse("bank_deposit_receipt", kwargs={"pk": self.bank.pk})
+        self.assertRedirects(response, receipt, fetch_redirect_response=False)
+        self.assertEqual(self.client.get(receipt).context["amount"], Decimal("25.00"))
+        self.assertEqual(balance_of(self.alice), Decimal("125.00"))
+
+    def test_invalid_deposit_amount(self):
+        response = self.client.post(reverse("deposite_money"), {"payment_method": "Bank Account", "amount": "lots"})
+
+        self.assertRedirects(response, reverse("deposite_money"), fetch_redirect_response=False)
+
+    def test_selection_pages_need_an_amount_from_the_deposit_page(self):
+        card = Card.objects.create(user=self.alice, card_type="CREDIT", card_number="0123456789")
+        for url, data in (
+            (reverse("bank_selection"), {"bank_account": self.bank.pk}),
+            (reverse("card_selection"), {"card": card.pk}),
+        ):
+            with self.subTest(url=url):
+                response = self.client.post(url, data)
+
+                self.assertRedirects(response, reverse("deposite_money"), fetch_redirect_response=False)
+        self.assertEqual(balance_of(self.alice), Decimal("100.00"))
+
+    def test_selection_pages_reject_a_posted_amount(self):
+        start_deposit(self.client, "25.00")
+
+        response = self.client.post(reverse("bank_selection"), {"bank_account": self.bank.pk, "amount": "1000000.00"})
+
+        self.assertRedirects(response, reverse("deposite_money"), fetch_redirect_response=False)
+        self.assertEqual([str(message) for message in get_messages(response.wsgi_request)],
+                         ["Please choose the amount on the deposit page."])
+        self.assertEqual(balance_of(self.alice), Decimal("100.00"))
+
+    def test_a_deposit_is_credited_once(self):
+        start_deposit(self.client, "25.00")
+        receipt = reverse("bank_deposit_receipt", kwargs={"pk": self.bank.pk})
+
+        self.client.post(reverse("bank_selection"), {"bank_account": self.bank.pk})
+        response = self.client.post(reverse("bank_selection"), {"bank_account": self.bank.pk})
+
+        self.assertRedirects(response, reverse("deposite_money"), fetch_redirect_response=False)
+        self.assertEqual(balance_of(self.alice), Decimal("125.00"))
+        self.assertEqual(self.client.get(receipt).context["amount"], Decimal("25.00"))
+
+    def test_withdrawal_needs_a_signed_in_user(self):
+        self.client.logout()
+
+        response = self.client.post(reverse("withdraw_money_confirm"), {"bank_account": self.bank.pk, "amount": "1.00"})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response["Location"].startswith(reverse("user_login")))
+        self.assertEqual(balance_of(self.alice), Decimal("100.00"))
+
+    def test_withdrawal_flow(self):
+        self.client.post(reverse("withdrawal_view"), {"bank_account": self.bank.pk, "amount": "12.50"})
+        self.assertEqual(
+            flows.load(self.client.session, flows.Withdrawal), flows.Withdrawal(self.bank.pk, Decimal("12.50"))
+        )
+        self.assertEqual(self.client.get(reverse("withdraw_money_confirm")).context["bank_account"], self.bank)
+
+        self.client.post(reverse("withdraw_money_confirm"), {"bank_account": self.bank.pk, "amount": "12.50"})
+
+        self.assertEqual(balance_of(self.alice), Decimal("87.50"))
+        self.assertIsNone(flows.load(self.client.session, flows.Withdrawal))
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.alice = make_user("alice")
+        self.bob = make_user("bob")
+        self.bank = BankAccount.objects.create(user=self.alice, account_number="0123456789")
+        self.client.login(email="alice@example.com", password="pass1234")
+
+    def deposit(self, key, bank_account=None, amount="10.00"):
+        if amount is not None:
+            start_deposit(self.client, amount)
+        return self.client.post(reverse("bank_selection"), {
+            "bank_account": (bank_account or self.bank).pk, "idempotency_key": key,
+        })
+
+    def claim_in_progress(self, key, locked_at):
+        request = RequestFactory().post(reverse("bank_selection"), {"bank_account": self.bank.pk})
+        return IdempotencyKey.objects.create(
+            user=self.alice, key=key, fingerprint=idempotency.fingerprint(request),
+            locked_at=locked_at, expires_at=locked_at + idempotency.TTL,
+        )
+
+    def test_retry_replays_the_first_response(self):
+        first = self.deposit("key-1")
+        second = self.deposit("key-1")
+
+        self.assertEqual(second.status_code, first.status_code)
+        self.assertEqual(second["Location"], first["Location"])
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(balance_of(self.alice), Decimal("110.00"))
+        self.assertEqual(TransactionHistory.objects.filter(sender=self.alice).count(), 1)
+
+    def test_retry_replays_the_flash_messages(self):
+        data = {"bank_account": self.bank.pk, "amount": "1.00"}
+        first = self.client.post(reverse("withdraw_money_confirm"), data, HTTP_IDEMPOTENCY_KEY="withdraw-1")
+        second = self.client.post(reverse("withdraw_money_confirm"), data, HTTP_IDEMPOTENCY_KEY="withdraw-1")
+
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        flashed = [str(message) for message in get_messages(first.wsgi_request)]
+        self.assertEqual(flashed, ["Withdrawal successful"])
+        # the first copy was never shown, so it is still queued
+        self.assertEqual([str(message) for message in get_messages(second.wsgi_request)], flashed * 2)
+
+    def test_the_key_is_claimed_with_the_posting(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.deposit("key-1")
+
+        statements = [query["sql"] for query in queries]
+        claim = next(i for i, sql in enumerate(statements) if sql.startswith('INSERT INTO "payapp_idempotencykey"'))
+        posting = next(i for i, sql in enumerate(statements) if sql.startswith('INSERT INTO "payapp_transactionhistory"'))
+        store = next(i for i, sql in enumerate(statements) if sql.startswith('UPDATE "payapp_idempotencykey"'))
+        # one savepoint holds the claim and the posting; the response is stored after it
+        opened = [sql.split()[-1] for sql in statements[:claim] if sql.startswith("SAVEPOINT")]
+        self.assertTrue(any(
+            posting < statements.index(f"RELEASE SAVEPOINT {savepoint}") < store for savepoint in opened
+        ))
+
+    def test_requests_that_post_nothing_claim_no_key(self):
+        response = self.deposit("key-1", amount=None)
+
+        self.assertRedirects(response, reverse("deposite_money"), fetch_redirect_response=False)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_header_key(self):
+        data = {"bank_account": self.bank.pk, "amount": "1.00"}
+        for _ in range(2):
+            self.client.post(reverse("withdraw_money_confirm"), data, HTTP_IDEMPOTENCY_KEY="withdraw-1")
+
+        self.assertEqual(balance_of(self.alice), Decimal("99.00"))
+
+    def test_requests_without_a_key_are_not_deduplicated(self):
+        for _ in range(2):
+            start_deposit(self.client, "10.00")
+            self.client.post(reverse("bank_selection"), {"bank_account": self.bank.pk})
+
+        self.assertEqual(balance_of(self.alice), Decimal("120.00"))
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_keys_are_per_user(self):
+        self.deposit("shared")
+        self.client.login(email="bob@example.com", password="pass1234")
+        bank = BankAccount.objects.create(user=self.bob, account_number="9876543210")
+        self.deposit("shared", bank_account=bank)
+
+        self.assertEqual(balance_of(self.bob), Decimal("110.00"))
+
+    def test_key_reused_for_a_different_request(self):
+        self.deposit("key-1")
+        other = BankAccount.objects.create(user=self.alice, account_number="9876543210")
+
+        response = self.deposit("key-1", bank_account=other)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(balance_of(self.alice), Decimal("110.00"))
+
+    def test_duplicate_of_a_request_in_progress(self):
+        self.claim_in_progress("key-1", timezone.now())
+
+        with mock.patch.object(idempotency, "WAIT_SECONDS", 0):
+            response = self.deposit("key-1")
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(balance_of(self.alice), Decimal("100.00"))
+
+    def test_a_claimed_key_is_never_posted_again(self):
+        # the posting committed with the claim, whatever happened after it
+        self.claim_in_progress("key-1", timezone.now() - timedelta(hours=1))
+
+        with mock.patch.object(idempotency, "WAIT_SECONDS", 0):
+            response = self.deposit("key-1")
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(balance_of(self.alice), Decimal("100.00"))
+
+    def test_a_lost_response_is_not_posted_again(self):
+        with mock.patch.object(idempotency, "_store", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.deposit("key-1")
+        with mock.patch.object(idempotency, "WAIT_SECONDS", 0):
+            response = self.deposit("key-1")
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(balance_of(self.alice), Decimal("110.00"))
+        self.assertIsNone(IdempotencyKey.objects.get().response_status)
+
+    def test_expired_key_runs_again_and_is_pruned(self):
+        self.deposit("key-1")
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+
+        self.assertEqual(idempotency.prune(), 1)
+        self.deposit("key-1")
+        self.assertEqual(balance_of(self.alice), Decimal("120.00"))
+
+    def test_failed_request_releases_its_key(self):
+        with mock.patch.object(ledger, "deposit", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.deposit("key-1")
+
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_forms_carry_a_key(self):
+        response = self.client.get(reverse("bank_selection"))
+
+        self.assertContains(response, 'name="idempotency_key"')
+
+    def test_payment_request_is_answered_once(self):
+        payment_request = PaymentRequest.objects.create(
+            sender=self.bob, recipient=self.alice, amount=Decimal("5.00"), message="lunch", status="PENDING"
+        )
+        url = reverse("respond_to_payment_request", args=[payment_request.pk])
+
+        self.client.post(url, {"action": "accepted"})
+        self.client.post(url, {"action": "accepted"})
+
+        self.assertEqual(balance_of(self.alice), Decimal("95.00"))
+        self.assertEqual(balance_of(self.bob), Decimal("105.00"))
+
+    def test_recipient_sees_the_payment_request(self):
+        payment_request = PaymentRequest.objects.create(
+            sender=self.bob, recipient=self.alice, amount=Decimal("5.00"), message="lunch", status="PENDING"
+        )
+
+        response = self.client.get(reverse("respond_to_payment_request", args=[payment_request.pk]))
+
+        self.assertTemplateUsed(response, "payapp/respond_to_payment_request.html")
+        self.assertEqual(response.context["payment_request"], payment_request)
+
+    def test_only_the_recipient_answers_a_payment_request(self):
+        payment_request = PaymentRequest.objects.create(
+            sender=self.alice, recipient=self.bob, amount=Decimal("5.00"), message="lunch", status="PENDING"
+        )
+
+        response = self.client.post(reverse("respond_to_payment_request", args=[payment_request.pk]), {"action": "accepted"})
+
+        self.assertRedirects(response, reverse("payment_failed"), fetch_redirect_response=False)
+        self.assertEqual(balance_of(self.bob), Decimal("100.00"))
+        payment_request.refresh_from_db()
+        self.assertEqual(payment_request.status, "PENDING")
+
+
+@skipUnless(connection.vendor == "sqlite", "query plans are checked with SQLite's EXPLAIN QUERY PLAN")
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.alice = make_user("alice")
+        self.bob = make_user("bob")
+        self.bank = BankAccount.objects.create(user=self.alice, account_number="0123456789")
+        self.client.force_login(CustomUser.objects.create_superuser(
+            email="admin@example.com", username="admin", password="pass1234",
+        ))
+
+    def add_rows(self, count):
+        TransactionHistory.objects.bulk_create(
+            TransactionHistory(sender=self.alice, recipient=self.bob, bank_account=self.bank,
+                               status="✔️", amount=Decimal("1.00"))
+            for _ in range(count)
+        )
+        PaymentRequest.objects.bulk_create(
+            PaymentRequest(sender=self.bob, recipient=self.alice, amount=Decimal("1.00"), status="PENDING")
+            for _ in range(count)
+        )
+        Transaction.objects.bulk_create(
+            Transaction(sender=self.alice, recipient=self.bob, amount=Decimal("1.00"), transaction_type="TRANSFER", currency="USD")
+            for _ in range(count)
+        )
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_pages_run_a_constant_number_of_queries(self):
+        urls = [reverse(f"admin:payapp_{model}_changelist")
+                for model in ("transactionhistory", "paymentrequest", "transaction", "card", "journalentry")]
+        self.add_rows(2)
+        few = [self.count_queries(url) for url in urls]
+        self.add_rows(40)
+
+        self.assertEqual([self.count_queries(url) for url in urls], few)
+
+    def test_large_tables_are_counted_from_estimates(self):
+        self.add_rows(30)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        self.assertEqual(changelists.estimated_count(TransactionHistory), 30)
+
+        with mock.patch.object(changelists, "ESTIMATE_THRESHOLD", 20), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("admin:payapp_transactionhistory_changelist"))
+
+        self.assertEqual(response.context["cl"].result_count, 30)
+        self.assertFalse(any("COUNT(" in query["sql"] for query in queries.captured_queries))
+
+    def test_filtered_counts_are_capped(self):
+        self.add_rows(30)
+
+        with mock.patch.object(changelists, "COUNT_CAP", 25):
+            response = self.client.get(reverse("admin:payapp_transactionhistory_changelist"), {"status": "✔️"})
+
+        self.assertEqual(response.context["cl"].result_count, 25)
+
+    def test_search_by_username(self):
+        ledger.transfer(self.alice, self.bob, "1.00")
+
+        response = self.client.get(reverse("admin:payapp_transactionhistory_changelist"), {"q": "bob"})
+
+        self.assertEqual([row.sender for row in response.context["cl"].result_list], [self.bob])
+
+    def test_user_autocomplete(self):
+        response = self.client.get(reverse("admin:autocomplete"), {
+            "term": "ali", "app_label": "payapp", "model_name": "transactionhistory", "field_name": "sender",
+        })
+
+        self.assertEqual([result["text"] for result in response.json()["results"]], [str(self.alice)])
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class QueryPlanTests(TestCase):
+    """
+    Run every page and money flow, EXPLAIN each query it issued, and fail if
+    a query on a hot table scans the table or sorts in a temporary B-tree.
+    """
+    HOT_TABLES = {
+        model._meta.db_table for model in (
+            TransactionHistory, PaymentRequest, BankAccount, Card, CustomUser,
+            OnlineAccount, UserProfile, JournalLine,
+        )
+    }
+
+    def setUp(self):
+        self.alice = make_user("alice", balance="1000.00")
+        self.bob = make_user("bob")
+        self.bank = BankAccount.objects.create(user=self.alice, account_number="0123456789")
+        self.card = Card.objects.create(user=self.alice, card_type="CREDIT", card_number="0123456789")
+        ledger.transfer(self.alice, self.bob, "5.00")
+        ledger.deposit(self.alice, "5.00", "Deposit from bank account", bank_account=self.bank)
+        self.request = PaymentRequest.objects.create(
+            sender=self.bob, recipient=self.alice, amount=Decimal("1.00"), message="lunch", status="PENDING"
+        )
+        self.client.force_login(self.alice)
+
+    def assertIndexedQueries(self, *requests):
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            if not many:
+                statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            for method, url, data in requests:
+                getattr(self.client, method)(url, data)
+
+        problems = []
+        for sql, params in statements:
+            tables = set(re.findall(r'"(\w+)"', sql)) & self.HOT_TABLES
+            if not tables or not sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+                plan = [row[-1] for row in cursor.fetchall()]
+            # walking an index in order up to a LIMIT reads only the rows returned
+            walks_index = " LIMIT " in sql.upper() and " ORDER BY " in sql.upper()
+            for detail in plan:
+                scanned = re.match(r"SCAN (?:TABLE )?(\w+)", detail)
+                if scanned and walks_index and " USING " in detail:
+                    scanned = None
+                if (scanned and scanned.group(1) in tables) or "TEMP B-TREE" in detail:
+                    problems.append(f"{detail}\n    {sql}")
+        self.assertFalse(problems, "\n".join(problems))
+
+    def test_pages(self):
+        self.assertIndexedQueries(
+            ("get", reverse("user_dashboard"), {}),
+            ("get", reverse("all_reansaction_history"), {"limit": 1}),
+            ("get", reverse("payment_request_list"), {}),
+            ("get", reverse("backaccount"), {}),
+            ("get", reverse("card_list"), {}),
+            ("get", reverse("bank_selection"), {"amount": "10"}),
+            ("get", reverse("card_selection"), {"amount": "10"}),
+            ("get", reverse("withdrawal_view"), {}),
+            ("get", reverse("transaction_history_api"), {"limit": 1}),
+            ("get", reverse("payment_request_list_api"), {}),
+        )
+
+    def test_deeper_history_pages(self):
+        cursor = self.client.get(reverse("transaction_history_api"), {"limit": 1}).json()["next_cursor"]
+        self.assertIndexedQueries(
+            ("get", reverse("all_reansaction_history"), {"cursor": cursor}),
+            ("get", reverse("transaction_history_api"), {"cursor": cursor}),
+        )
+
+    def test_money_flows(self):
+        session = self.client.session
+        flows.store(session, flows.DirectPayment("bob@example.com", Decimal("1.00"), "USD"))
+        flows.store(session, flows.Deposit(Decimal("10.00")))
+        session.save()
+        self.assertIndexedQueries(
+            ("post", reverse("bank_selection"), {"bank_account": self.bank.pk}),
+            ("post", reverse("card_selection"), {"card": self.card.pk}),
+            ("post", reverse("directpayment_confirmation"), {}),
+            ("post", reverse("request_money"), {"recipient_email": "bob@example.com", "amount": "2", "currency": "USD"}),
+            ("post", reverse("respond_to_payment_request", args=[self.request.pk]), {"action": "accepted"}),
+            ("post", reverse("withdraw_money_confirm"), {"bank_account": self.bank.pk, "amount": "1"}),
+        )
+
+    def test_admin_changelists(self):
+        self.client.force_login(CustomUser.objects.create_superuser(
+            email="admin@example.com", username="admin", password="pass1234",
+        ))
+        history = reverse("admin:payapp_transactionhistory_changelist")
+
+        # as if the tables were huge: no exact count of an unfiltered table
+        with mock.patch.object(changelists, "estimated_count", return_value=10_000_000):
+            self.assertIndexedQueries(
+                ("get", history, {}),
+                ("get", history, {"status": "✔️"}),
+                ("get", history, {"q": "alice"}),
+                ("get", reverse("admin:payapp_paymentrequest_changelist"), {"status__exact": "PENDING"}),
+                ("get", reverse("admin:payapp_journalentry_changelist"), {"transaction_type__exact": "TRANSFER"}),
+                ("get", reverse("admin:register_customuser_changelist"), {"q": "ali"}),
+                ("get", reverse("admin:register_customuser_changelist"), {"q": "alice@example.com"}),
+                ("get", reverse("admin:register_bankaccount_changelist"), {"q": "0123456789"}),
+                ("get", reverse("admin:autocomplete"), {
+                    "term": "ali", "app_label": "payapp", "model_name": "transactionhistory", "field_name": "sender",
+                }),
+            )
+
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class QueryBudgetTests(TestCase):
+    """
+    Every view with a ``@query_budget`` stays within it, without repeating a
+    query.
+    """
+
+    def setUp(self):
+        self.alice = make_user("alice", balance="1000.00")
+        self.bob = make_user("bob")
+        self.bank = BankAccount.objects.create(user=self.alice, account_number="0123456789")
+        self.card = Card.objects.create(user=self.alice, card_type="CREDIT", card_number="0123456789")
+        self.request = PaymentRequest.objects.create(
+            sender=self.bob, recipient=self.alice, amount=Decimal("1.00"), message="lunch", status="PENDING"
+        )
+        self.client.force_login(self.alice)
+
+    def assertWithinBudget(self, method, url, data=None):
+        response = getattr(self.client, method)(url, data or {})
+        stats = response.query_stats
+        self.assertIsNotNone(stats.budget, f"{stats.view} declares no query budget")
+        self.assertFalse(stats.over_budget, f"{stats.view} ran {stats.sql_count} queries, budget {stats.budget}")
+        self.assertFalse(stats.duplicates, f"{stats.view} repeated queries: {stats.duplicates}")
+
+    def test_pages(self):
+        self.assertWithinBudget("get", reverse("user_dashboard"))
+        self.assertWithinBudget("get", reverse("all_reansaction_history"))
+        self.assertWithinBudget("get", reverse("payment_request_list"))
+        self.assertWithinBudget("get", reverse("backaccount"))
+        self.assertWithinBudget("get", reverse("card_list"))
+        self.assertWithinBudget("get", reverse("transaction_history_api"))
+        self.assertWithinBudget("get", reverse("payment_request_list_api"))
+
+    def test_money_flows(self):
+        session = self.client.session
+        flows.store(session, flows.DirectPayment("bob@example.com", Decimal("1.00"), "USD"))
+        flows.store(session, flows.Deposit(Decimal("10.00")))
+        session.save()
+
+        self.assertWithinBudget("post", reverse("bank_selection"), {"bank_account": self.bank.pk})
+        start_deposit(self.client, "10.00")
+        self.assertWithinBudget("post", reverse("card_selection"), {"card": self.card.pk})
+        self.assertWithinBudget("post", reverse("directpayment_confirmation"))
+        self.assertWithinBudget("post", reverse("request_money"), {
+            "recipient_email": "bob@example.com", "amount": "2", "currency": "USD",
+        })
+        self.assertWithinBudget("post", reverse("respond_to_payment_request", args=[self.request.pk]), {"action": "accepted"})
+        self.assertWithinBudget("post", reverse("withdraw_money_confirm"), {"bank_account": self.bank.pk, "amount": "1"})
+
+    def test_money_flows_with_idempotency_keys(self):
+        session = self.client.session
+        flows.store(session, flows.DirectPayment("bob@example.com", Decimal("1.00"), "USD"))
+        flows.store(session, flows.Deposit(Decimal("10.00")))
+        session.save()
+
+        for name, data in (
+            ("bank_selection", {"bank_account": self.bank.pk}),
+            ("card_selection", {"card": self.card.pk}),
+            ("directpayment_confirmation", {}),
+            ("withdraw_money_confirm", {"bank_account": self.bank.pk, "amount": "1"}),
+        ):
+            start_deposit(self.client, "10.00")
+            self.assertWithinBudget("post", reverse(name), {**data, "idempotency_key": name})
+        self.assertWithinBudget(
+            "post", reverse("respond_to_payment_request", args=[self.request.pk]),
+            {"action": "accepted", "idempotency_key": "respond"},
+        )
+
+    def test_money_flows_when_the_month_starts(self):
+        # the first posting of a month creates its rollup rows, and a new
+        # user's first payment request finds the counter opened with them
+        session = self.client.session
+        flows.store(session, flows.DirectPayment("bob@example.com", Decimal("1.00"), "USD"))
+        flows.store(session, flows.Deposit(Decimal("10.00")))
+        session.save()
+        carol = make_user("carol")
+
+        for name, data, args in (
+            ("bank_selection", {"bank_account": self.bank.pk}, ()),
+            ("card_selection", {"card": self.card.pk}, ()),
+            ("directpayment_confirmation", {}, ()),
+            ("withdraw_money_confirm", {"bank_account": self.bank.pk, "amount": "1"}, ()),
+            ("respond_to_payment_request", {"action": "accepted"}, (self.request.pk,)),
+        ):
+            MonthlyRollup.objects.all().delete()
+            start_deposit(self.client, "10.00")
+            self.assertWithinBudget("post", reverse(name, args=args), {**data, "idempotency_key": name})
+        self.assertTrue(PendingRequestCounter.objects.filter(user=carol).exists())
+        self.assertWithinBudget("post", reverse("request_money"), {
+            "recipient_email": "carol@example.com", "amount": "2", "currency": "USD",
+        })
+
+
+class SyntheticDataTests(TestCase):
+    def test_generates_consistent_data_without_signals(self):
+        CustomUser.objects.create_user(email="alice@example.com", username="alice")
+        output = StringIO()
+        call_command(
+            "generate_synthetic_data", "--users", "30", "--history", "500", "--payment-requests", "200",
+            "--batch-size", "100", stdout=output,
+        )
+
+        users = CustomUser.objects.filter(username__startswith="synth")
+        self.assertEqual(users.count(), 30)
+        self.assertEqual(UserProfile.objects.filter(user__in=users).count(), 30)
+        self.assertEqual(OnlineAccount.objects.filter(user__in=users).count(), 30)
+        self.assertEqual(TransactionHistory.objects.count(), 500)
+        self.assertEqual(
+            set(PaymentRequest.objects.values_list("status", flat=True)),
+            {TRANSACTION_STATUS.SUCCESS, TRANSACTION_STATUS.FAILED, TRANSACTION_STATUS.PENDING},
+        )
+        pending = PaymentRequest.objects.filter(status=TRANSACTION_STATUS.PENDING).count()
+        self.assertEqual(PendingRequestCounter.objects.aggregate(total=Sum("incoming"))["total"], pending)
+        account = OnlineAccount.objects.filter(user__in=users).first()
+        self.assertEqual(ledger.rebuild_balance(account), account.balance)
+        # every row has its running balance, which never goes below zero and
+        # ends on the account's balance
+        self.assertFalse(TransactionHistory.objects.filter(balance_after__isnull=True).exists())
+        self.assertFalse(TransactionHistory.objects.filter(balance_after__lt=0).exists())
+        for account in OnlineAccount.objects.filter(user__in=users, user__sent_transaction_histories__isnull=False).distinct():
+            last = TransactionHistory.objects.filter(sender=account.user).latest("created_at", "id")
+            self.assertEqual(last.balance_after, account.balance)
+        # and every row is counted in the monthly rollups
+        rollups = MonthlyRollup.objects.aggregate(count=Sum("count"), total=Sum("total"))
+        self.assertEqual(rollups["count"], 500)
+        self.assertEqual(rollups["total"], TransactionHistory.objects.aggregate(total=Sum("amount"))["total"])
+        # the history is journaled, so the ledger rebuilds the same balances and rollups
+        for account in OnlineAccount.objects.filter(user__in=users):
+            self.assertEqual(ledger.rebuild_balance(account), account.balance)
+        figures = ["user", "currency", "month", "direction", "count", "total", "minimum", "maximum"]
+        generated = sorted(MonthlyRollup.objects.values_list(*figures))
+        ledger.rebuild_rollups()
+        self.assertEqual(sorted(MonthlyRollup.objects.values_list(*figures)), generated)
+        # the dropped indexes are back
+        with connection.cursor() as cursor:
+            indexes = connection.introspection.get_constraints(cursor, TransactionHistory._meta.db_table)
+        self.assertIn("history_sender_created_idx", indexes)
+        self.assertIn("Generated 30 users", output.getvalue())
+
+    def test_refuses_a_prefix_in_use(self):
+        CustomUser.objects.create_user(email="synth0@example.com", username="synth0")
+        with self.assertRaisesMessage(CommandError, "Users named synth* exist already"):
+            call_command("generate_synthetic_data", "--users", "2", stdout=StringIO())
+
+
+class ReplayToReplicaTests(TransactionTestCase):
+    def test_copies_the_primary_into_the_replica_file(self):
+        CustomUser.objects.create_user(email="alice@example.com", username="alice")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "replica.sqlite3")
+            output = StringIO()
+            call_command("replay_to_replica", "--once", "--path", path, stdout=output)
+
+            replica = sqlite3.connect(path)
+            try:
+                usernames = replica.execute(f"SELECT username FROM {CustomUser._meta.db_table}").fetchall()
+            finally:
+                replica.close()
+        self.assertEqual(usernames, [("alice",)])
+        self.assertIn("(1 copies)", output.getvalue())
+
+    @override_settings(REPLICA_DATABASE=None)
+    def test_needs_a_replica(self):
+        with self.assertRaisesMessage(CommandError, "No replica configured"):
+            call_command("replay_to_replica", "--once", stdout=StringIO())
+
+
+class GroupCommitTests(TransactionTestCase):
+    def setUp(self):
+        self.alice = CustomUser.objects.create_user(email="alice@example.com", username="alice")
+        self.bob = CustomUser.objects.create_user(email="bob@example.com", username="bob")
+        ledger.open_account(self.alice, "USD", "100.00")
+        ledger.open_account(self.bob, "USD", "100.00")
+        self.writer = group_commit.Writer()
+        self.addCleanup(self.writer.stop)
+
+    def balance(self, user):
+        return OnlineAccount.objects.get(user=user).balance
+
+    def test_operations_queued_during_a_commit_form_the_next_group(self):
+        started, release = threading.Event(), threading.Event()
+
+        def first():
+            started.set()
+            release.wait(5)
+            return ledger.transfer(self.alice, self.bob, "1.00")
+
+        futures = [self.writer.submit(first)]
+        started.wait(5)
+        futures += [self.writer.submit(ledger.transfer, self.alice, self.bob, "2.00") for _ in range(3)]
+        release.set()
+
+        self.assertEqual([future.result(5) for future in futures], [Decimal("1.00")] + [Decimal("2.00")] * 3)
+        self.assertEqual((self.writer.groups, self.writer.operations), (2, 4))
+        self.assertEqual(self.balance(self.alice), Decimal("93.00"))
+        self.assertEqual(JournalEntry.objects.filter(transaction_type="TRANSFER").count(), 4)
+
+    def test_a_failing_operation_is_rolled_back_alone(self):
+        failing = self.writer.submit(ledger.transfer, self.alice, self.bob, "500.00")
+        passing = self.writer.submit(ledger.transfer, self.bob, self.alice, "5.00")
+
+        with self.assertRaises(ledger.InsufficientFunds):
+            failing.result(5)
+        self.assertEqual(passing.result(5), Decimal("5.00"))
+        self.assertEqual((self.balance(self.alice), self.balance(self.bob)), (Decimal("105.00"), Decimal("95.00")))
+
+    def test_funneled_calls_from_many_threads(self):
+        with override_settings(GROUP_COMMIT=True):
+            self.addCleanup(group_commit.shutdown)
+            threads = [threading.Thread(target=ledger.transfer, args=(self.alice, self.bob, "1.00")) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(group_commit.writer().operations, 8)
+        self.assertEqual((self.balance(self.alice), self.balance(self.bob)), (Decimal("92.00"), Decimal("108.00")))
+
+    def test_keyed_form_posts_run_on_the_writer(self):
+        carol = make_user("carol")
+        bank = BankAccount.objects.create(user=carol, account_number="0123456789")
+        self.client.login(email="carol@example.com", password="pass1234")
+        start_deposit(self.client, "10.00")
+
+        with override_settings(GROUP_COMMIT=True):
+            self.addCleanup(group_commit.shutdown)
+            response = self.client.post(reverse("bank_selection"), {
+                "bank_account": bank.pk, "idempotency_key": "key-1",
+            })
+
+            # the claim and the deposit went to the writer as one operation
+            self.assertEqual(group_commit.writer().operations, 1)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.balance(carol), Decimal("110.00"))
+        self.assertEqual(IdempotencyKey.objects.get(key="key-1").response_status, 302)
+
+    @override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+    def test_keyed_form_posts_render_on_the_request_thread(self):
+        carol = make_user("carol")
+        bank = BankAccount.objects.create(user=carol, account_number="0123456789")
+        self.client.login(email="carol@example.com", password="pass1234")
+        languages = []
+
+        def render(request, *args, **kwargs):
+            languages.append(translation.get_language())
+            return shortcuts.render(request, *args, **kwargs)
+
+        with override_settings(GROUP_COMMIT=True), translation.override("fr"), \
+                mock.patch("payapp.views.render", side_effect=render):
+            self.addCleanup(group_commit.shutdown)
+            # more than carol has, so the page is rendered again with a warning
+            response = self.client.post(reverse("withdraw_money_confirm"), {
+                "bank_account": bank.pk, "amount": "500.00", "idempotency_key": "key-1",
+            })
+
+            # only the claim and the failed withdrawal went to the writer
+            self.assertEqual(group_commit.writer().operations, 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(languages, ["fr"])
+        stats = response.query_stats
+        self.assertEqual(stats.view, "withdraw_money_confirm")
+        self.assertGreater(stats.render_time, 0)
+        self.assertTrue([sql for sql in stats.fingerprints if 'FROM "register_bankaccount"' in sql])
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.balance(carol), Decimal("100.00"))
+
+    def test_writes_on_the_writer_pin_the_user_to_the_primary(self):
+        carol = make_user("carol")
+        bank = BankAccount.objects.create(user=carol, account_number="0123456789")
+        self.client.login(email="carol@example.com", password="pass1234")
+        start_deposit(self.client, "10.00")
+
+        with override_settings(GROUP_COMMIT=True, REPLICA_DATABASE="replica"):
+            self.addCleanup(group_commit.shutdown)
+            # the deposit is the request's only write, and the writer makes it
+            response = self.client.post(reverse("bank_selection"), {"bank_account": bank.pk})
+
+            self.assertEqual(group_commit.writer().operations, 1)
+        self.assertEqual(self.balance(carol), Decimal("110.00"))
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+
+    def test_calls_inside_a_transaction_run_in_it(self):
+        with override_settings(GROUP_COMMIT=True), transaction.atomic():
+            ledger.transfer(self.alice, self.bob, "1.00")
+            transaction.set_rollback(True)
+
+        self.assertIsNone(group_commit._writer)
+        self.assertEqual(self.balance(self.alice), Decimal("100.00"))
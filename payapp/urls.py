@@ -1,6 +1,20 @@
+from django.conf import settings
 from django.urls import path
 
 from payapp import views
+
+# The ASGI profile serves the read-heavy pages from their async variants
+if settings.ASYNC_READ_VIEWS:
+    transaction_history_view = views.all_transaction_history_async
+    transaction_export_view = views.export_transaction_history_async
+    payment_request_list_view = views.payment_request_list_async
+    live_events_view = views.live_events
+else:
+    transaction_history_view = views.all_reansaction_history
+    transaction_export_view = views.export_transaction_history
+    payment_request_list_view = views.payment_request_list_view
+    live_events_view = views.live_events_unavailable
+
 urlpatterns = [
     path("", views.homepage, name="homepage"),
     path("bank-account", views.backaccount, name="backaccount" ),
@@ -16,12 +30,19 @@ urlpatterns = [
     path("directpayment_confirmation", views.directpayment_confirmation, name="directpayment_confirmation"),
     path("payment_success", views.payment_success, name="payment_success"),
     path("payment_failed", views.payment_failed, name="payment_failed"),
-    path("transaction-history", views.all_reansaction_history, name="all_reansaction_history"),
+    path("transaction-history", transaction_history_view, name="all_reansaction_history"),
+    path("transaction-history/export.<str:fmt>", transaction_export_view, name="export_transaction_history"),
     path("request_money", views.request_money, name="request_money"),
     path("payment_request_success", views.payment_request_success, name="payment_request_success"),
     path("respond_to_payment/<int:pk>/", views.respond_to_payment_request, name="respond_to_payment_request"),
-    path("payment_request_list", views.payment_request_list_view, name="payment_request_list"),
+    path("payment_request_list", payment_request_list_view, name="payment_request_list"),
     path("withdraw_money", views.withdrawal_view, name="withdrawal_view"),
     path("withdraw_money_confirm", views.withdraw_money_confirm, name="withdraw_money_confirm"),
-    path("withdraw_success", views.withdraw_success, name="withdraw_success")
+    path("withdraw_success", views.withdraw_success, name="withdraw_success"),
+    path("events", live_events_view, name="live_events"),
+
+    # API path
+    path("api/transfers/batch/", views.BatchTransferAPIView.as_view(), name="batch_transfer"),
+    path("api/transactions/", views.TransactionHistoryAPIView.as_view(), name="transaction_history_api"),
+    path("api/payment-requests/", views.PaymentRequestListAPIView.as_view(), name="payment_request_list_api"),
 ]
@@ -1,15 +1,31 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 from register.models import BankAccount, OnlineAccount
 from payapp.models import TransactionHistory, PaymentRequest, Card, Transaction
 from django.contrib.auth.decorators import login_required
 
 from payapp.forms import AddBankForm, CardForm, DirectPaymentForm, PaymentRequestForm, WithdrawalForm
 from django.urls import reverse, reverse_lazy
-from decimal import Decimal
 from register.models import CustomUser
 from django.db import transaction
 from django.contrib import messages
-from webapps2024.utils.manual_exchange import MANUAL_EXCHANGE_RATES
+from payapp import flows, ledger, live, payment_requests, statements
+from payapp.idempotency import idempotent
+from payapp.serializers import (
+    BatchTransferSerializer, BatchTransferResultSerializer, PaymentRequestSerializer, TransactionHistorySerializer,
+)
+from webapps2024.utils.pagination import akeyset_paginate, keyset_paginate, page_size_from
+from webapps2024.utils.asynchronous import alist, arender, async_login_required
+from register.context_processor import latest_payment_requests
+import asyncio
+from rest_framework.views import APIView
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework import status
+from webapps2024.utils.choices import SYSTEM_ACCOUNT, TRASACTION_TYPE_CHOICES, TRANSACTION_STATUS
+from webapps2024.utils import fragments, group_commit
+from webapps2024.utils.instrumentation import query_budget
+from webapps2024.utils.replicas import STALE_OK, read_consistency
 # Create your views here.
 
 
@@ -21,6 +37,7 @@ def homepage(request):
     return render(request, "payapp/homepage.html")
 
 
+@query_budget(6)
 @login_required(login_url=reverse_lazy("user_login"))
 def backaccount(request):
     """
@@ -90,6 +107,7 @@ def addcard(request):
         form = CardForm()
     return render(request, "payapp/addcard.html", {"form": form})
 
+@query_budget(5)
 @login_required(login_url=reverse_lazy("user_login"))
 def card_list(request):
     """
@@ -125,12 +143,18 @@ def deposite_money(request):
     """
     if request.method == "POST":
         payment_method = request.POST.get("payment_method")
-        amount = request.POST.get("amount")
-       
+        try:
+            amount = ledger.to_amount(request.POST.get("amount"))
+        except (TypeError, ValueError, ArithmeticError):
+            messages.error(request, "Please enter a valid amount.")
+            return redirect(reverse('deposite_money'))
+
+        # the amount travels to the next step in the session, not the URL
+        flows.store(request.session, flows.Deposit(amount))
         if payment_method == "Bank Account":
-            return redirect(reverse("bank_selection") + f"?amount={amount}")
+            return redirect(reverse("bank_selection"))
         elif payment_method == "Credit or Debit Cards":
-            return redirect(reverse("card_selection") + f"?amount={amount}")
+            return redirect(reverse("card_selection"))
         else:
             return redirect(reverse('deposite_money'))
     return render(request, "payapp/deposite.html")
@@ -138,39 +162,40 @@ def deposite_money(request):
 
 
 
+@query_budget(14)
+@idempotent
 @login_required(login_url=reverse_lazy("user_login"))
 def bank_selection(request):
     """
     A decorator that ensures the user is logged in before accessing the bank_selection function.
     If the request method is GET, it retrieves the amount and bank accounts for the user and renders the bank_selection.html template.
-    If the request method is POST, it processes the bank deposit, updates the user's online account balance, records the transaction history, and redirects to the bank deposit receipt page.
+    If the request method is POST, it deposits the amount kept in the session from the deposit page, updates the user's online account balance, records the transaction history, and redirects to the bank deposit receipt page.
     """
     if request.method == 'GET':
-        amount = request.GET.get('amount', '')
+        deposit = flows.load(request.session, flows.Deposit)
+        amount = deposit.amount if deposit else ''
         bank_accounts = BankAccount.objects.filter(user=request.user)
         return render(request, "payapp/bank_selection.html", {'amount': amount, 'bank_accounts': bank_accounts})
 
     if request.method == 'POST':
         bank_account_id = request.POST.get("bank_account")
-        amount = Decimal(request.POST.get("amount"))  # Convert amount to Decimal
+        # the amount chosen on the deposit page, never one posted here
+        if 'amount' in request.POST:
+            messages.error(request, "Please choose the amount on the deposit page.")
+            return redirect(reverse('deposite_money'))
+        deposit = flows.load(request.session, flows.Deposit)
+        if deposit is None:
+            messages.error(request, "Please enter the amount to deposit.")
+            return redirect(reverse('deposite_money'))
         bank_account = get_object_or_404(BankAccount, id=bank_account_id, user=request.user)
 
-        # Update user's online account balance
-        online_account = OnlineAccount.objects.get(user=request.user)
-        online_account.balance += amount  # Add amount directly (now it's a Decimal)
-        online_account.save()
-
-        # Record transaction history
-        TransactionHistory.objects.create(
-            sender=request.user,
-            description='Deposit from bank account',
-            status='✔️',
-            amount=amount,
-            bank_account=bank_account
-        )
+        # Credit the online account and record the transaction history
+        amount = ledger.deposit(request.user, deposit.amount, 'Deposit from bank account', bank_account=bank_account)
+        flows.discard(request.session, flows.Deposit)
+        flows.store(request.session, flows.DepositReceipt(amount))
 
         # Redirect to bank deposit receipt page
-        return redirect(reverse('bank_deposit_receipt', kwargs={'pk': bank_account_id}) + f'?amount={amount}')
+        return redirect(reverse('bank_deposit_receipt', kwargs={'pk': bank_account_id}))
 
  
  
@@ -182,7 +207,8 @@ def bank_deposit_receipt(request, pk):
 	Renders the 'payapp/bank_deposit_receipt.html' template with bank account and amount data.
 	"""
     bank_account = get_object_or_404(BankAccount, id=pk, user=request.user)
-    amount = request.GET.get('amount', '')
+    receipt = flows.load(request.session, flows.DepositReceipt)
+    amount = receipt.amount if receipt else ''
 
     return render(request, 'payapp/bank_deposit_receipt.html', {'bank_account': bank_account, 'amount': amount})
 
@@ -190,6 +216,8 @@ def bank_deposit_receipt(request, pk):
 
 
 
+@query_budget(14)
+@idempotent
 @login_required(login_url=reverse_lazy("user_login"))
 def card_selection(request):
     """
@@ -201,37 +229,36 @@ def card_selection(request):
     Returns:
     - If the request method is GET, it renders the "card_selection.html" template with the amount and cards as context variables.
     - If the request method is POST, it performs the following actions:
-        - Retrieves the selected card ID and amount from the request.
+        - Retrieves the selected card ID from the request and the amount from the session.
         - Retrieves the selected card object for the current user.
         - Updates the online account balance of the current user by adding the specified amount.
         - Creates a new transaction history record for the deposit from card.
-        - Redirects to the "card_deposit_receipt" page with the card ID and amount as parameters.
+        - Redirects to the "card_deposit_receipt" page, keeping the credited amount in the session for the receipt.
     """
     if request.method == 'GET':
-        amount = request.GET.get('amount', '')
+        deposit = flows.load(request.session, flows.Deposit)
+        amount = deposit.amount if deposit else ''
         cards = Card.objects.filter(user=request.user)
         return render(request, "payapp/card_selection.html", {'amount': amount, 'cards': cards})
 
     if request.method == 'POST':
         card_id = request.POST.get("card")
-        amount = Decimal(request.POST.get("amount"))  # Convert amount to Decimal
+        # the amount chosen on the deposit page, never one posted here
+        if 'amount' in request.POST:
+            messages.error(request, "Please choose the amount on the deposit page.")
+            return redirect(reverse('deposite_money'))
+        deposit = flows.load(request.session, flows.Deposit)
+        if deposit is None:
+            messages.error(request, "Please enter the amount to deposit.")
+            return redirect(reverse('deposite_money'))
         card = get_object_or_404(Card, id=card_id, user=request.user)
 
-        # Update user's online account balance
-        online_account = OnlineAccount.objects.get(user=request.user)
-        online_account.balance += amount  # Add amount directly (now it's a Decimal)
-        online_account.save()
-
-        # Record transaction history
-        TransactionHistory.objects.create(
-            sender=request.user,
-            description='Deposit from card',
-            status='✔️',
-            amount=amount,
-            # card=card
-        )
-        
-        return redirect(reverse('card_deposit_receipt', kwargs={'pk': card_id}) + f'?amount={amount}')
+        # Credit the online account and record the transaction history
+        amount = ledger.deposit(request.user, deposit.amount, 'Deposit from card', source=SYSTEM_ACCOUNT.CARD)
+        flows.discard(request.session, flows.Deposit)
+        flows.store(request.session, flows.DepositReceipt(amount))
+
+        return redirect(reverse('card_deposit_receipt', kwargs={'pk': card_id}))
 
 
 
@@ -248,7 +275,8 @@ def card_deposit_receipt_view(request, pk):
     - Renders the 'payapp/card_deposit_receipt.html' template with card and amount as context variables.
     """
     card = get_object_or_404(Card, id=pk, user=request.user)
-    amount = request.GET.get('amount', '')
+    receipt = flows.load(request.session, flows.DepositReceipt)
+    amount = receipt.amount if receipt else ''
 
     return render(request, 'payapp/card_deposit_receipt.html', {'card': card, 'amount': amount})
 
@@ -269,15 +297,13 @@ def directpayment_or_send_money(request):
     """
     if request.method == "POST":
         form = DirectPaymentForm(request.POST)
-        if form.is_valid():
-            # Retrieve form data
-            payment_data = form.cleaned_data
-            # Ensure currency is added to payment_data
-            payment_data['currency'] = 'USD'  # Replace 'USD' with the default currency or fetch it from the form
-            # Convert decimal objects to string
-            payment_data['amount'] = str(payment_data['amount'])
-            # Store data in session
-            request.session['payment_data'] = payment_data
+        if form.is_valid() and form.cleaned_data['amount'] and form.cleaned_data['recipient_email']:
+            # Store the payment for the confirmation page
+            flows.store(request.session, flows.DirectPayment(
+                recipient_email=form.cleaned_data['recipient_email'],
+                amount=form.cleaned_data['amount'],
+                currency='USD',  # Replace 'USD' with the default currency or fetch it from the form
+            ))
             # Redirect to confirmation page
             return redirect("directpayment_confirmation")
         else:
@@ -289,14 +315,30 @@ def directpayment_or_send_money(request):
         form = DirectPaymentForm()
         return render(request, "payapp/directpayment_or_send_money.html", {'form': form})
 
+
+@group_commit.funneled
+@transaction.atomic
+def _pay_directly(sender, recipient, amount, currency):
+    """Transfer ``amount`` and record the payment, in one transaction."""
+    credited = ledger.transfer(
+        sender, recipient, amount,
+        sent_description="Direct payment (sent)",
+        received_description="Direct payment (received)",
+    )
+    Transaction.objects.create(sender=sender, recipient=recipient, amount=credited, currency=currency, transaction_type="direct_payment")
+    return credited
+
+
+@query_budget(18)
+@idempotent
 @login_required(login_url=reverse_lazy("user_login"))
 def directpayment_confirmation(request):
-    payment_data = request.session.get('payment_data', {})
-    recipient_email = payment_data.get('recipient_email')
+    payment_data = flows.load(request.session, flows.DirectPayment)
+    recipient_email = payment_data.recipient_email if payment_data else None
 
     try:
         # Get the recipient user by email
-        recipient = CustomUser.objects.get(email=recipient_email)
+        recipient = CustomUser.objects.select_related('onlineaccount').get(email=recipient_email) if payment_data else None
     except CustomUser.DoesNotExist:
         recipient = None
 
@@ -311,48 +353,27 @@ def directpayment_confirmation(request):
         form = DirectPaymentForm(request.POST)
         if form.is_valid():
             sender = request.user
-            amount = payment_data.get('amount')
-            currency = payment_data.get('currency')
+            amount = payment_data.amount
+            currency = payment_data.currency
 
             # Check if the recipient email is the same as the sender's email
             if sender.email == recipient_email:
                 messages.error(request, "You cannot send a payment request to yourself.")
                 return redirect('payment_failed')
 
-            # Check if the sender has enough funds in their account
-            sender_account = sender.onlineaccount
-            if sender_account.balance < float(amount):
-                # Sender doesn't have enough funds
+            # Debit the sender, credit the recipient (converting currency if
+            # needed) and record the history within a single transaction
+            try:
+                amount = _pay_directly(sender, recipient, amount, currency)
+            except ledger.InsufficientFunds:
                 messages.error(request, "Insufficient funds.")
                 return redirect('payment_failed')
-
-            # Check if currency conversion is needed
-            if sender_account.currency != recipient.onlineaccount.currency:
-                # Currency conversion needed
-                exchange_rate = MANUAL_EXCHANGE_RATES.get((sender_account.currency, recipient.onlineaccount.currency))
-                if exchange_rate is None:
-                    messages.error(request, "Exchange rate not found for currencies.")
-                    return redirect('payment_failed')
-                amount = float(amount)
-                amount *= exchange_rate
-
-            # Deduct the amount from the sender's account and add it to the recipient's account within a single transaction
-            with transaction.atomic():
-                sender_account.balance -= int(amount)
-                sender_account.save()
-                recipient_account = recipient.onlineaccount
-                recipient_account.balance += int(amount)
-                recipient_account.save()
-
-                # Create a transaction record for the payment
-                Transaction.objects.create(sender=sender, recipient=recipient, amount=amount, currency=currency, transaction_type="direct_payment")
-
-                # Create transaction history records for both sender and recipient
-                TransactionHistory.objects.create(sender=sender, recipient=recipient, status="✔️", amount=amount, description="Direct payment (sent)")
-                TransactionHistory.objects.create(sender=recipient, recipient=sender, status="📥", amount=amount, description="Direct payment (received)")
+            except ledger.ExchangeRateNotFound:
+                messages.error(request, "Exchange rate not found for currencies.")
+                return redirect('payment_failed')
 
             # Clear session data
-            request.session.pop('payment_data', None)
+            flows.discard(request.session, flows.DirectPayment)
 
             return redirect('payment_success')
         else:
@@ -367,7 +388,7 @@ def directpayment_confirmation(request):
 
 @login_required(login_url=reverse_lazy('register:login_view'))
 def payment_success(request):
-    payment_data = request.session.get('payment_data', {})
+    payment_data = flows.load(request.session, flows.DirectPayment)
     return render(request, "payapp/payment_success.html", {'payment_data': payment_data})
     
 @login_required(login_url=reverse_lazy('register:login_view'))
@@ -375,11 +396,112 @@ def payment_failed(request):
     return render(request, "payapp/payment_failed.html")
 
 
+@read_consistency(STALE_OK)
+@query_budget(5)
 @login_required(login_url=reverse_lazy('register:login_view'))
 def all_reansaction_history(request):
-    return render(request, "payapp/all_transactionhistory.html")
+    """
+    Renders the user's transaction history one page at a time, newest first.
+
+    Pages are addressed by the opaque ``cursor`` query parameter instead of a
+    page number, so deep pages cost the same as the first one.
+    """
+    try:
+        page = keyset_paginate(
+            TransactionHistory.objects.filter(sender=request.user),
+            request.GET.get('cursor'), page_size_from(request.GET),
+        )
+    except ValueError:
+        return redirect('all_reansaction_history')
+    return render(request, "payapp/all_transactionhistory.html", {"transaction_history": page, "page": page})
+
+
+@read_consistency(STALE_OK)
+@query_budget(5)
+@async_login_required(login_url=reverse_lazy("user_login"))
+async def all_transaction_history_async(request):
+    """
+    Async ``all_reansaction_history`` for the ASGI profile; the history page
+    and the navbar's payment requests are fetched together.
+    """
+    try:
+        page, payment_requests = await asyncio.gather(
+            akeyset_paginate(
+                TransactionHistory.objects.filter(sender=request.user),
+                request.GET.get('cursor'), page_size_from(request.GET),
+            ),
+            alist(latest_payment_requests(request.user)),
+        )
+    except ValueError:
+        return redirect('all_reansaction_history')
+    return await arender(request, "payapp/all_transactionhistory.html", {
+        "transaction_history": page, "page": page, "payment_requests": payment_requests,
+    })
+
+
+def _statement_response(request, fmt, render_rows):
+    if fmt not in statements.FORMATS:
+        raise Http404("Unknown export format.")
+    try:
+        start, end = statements.parse_date_range(request.GET)
+    except ValueError:
+        return HttpResponseBadRequest("Dates must be given as YYYY-MM-DD, with 'from' not after 'to'.")
+    rows = statements.statement_rows(request.user, start, end)
+    response = StreamingHttpResponse(render_rows(rows, fmt), content_type=statements.FORMATS[fmt])
+    response["Content-Disposition"] = f'attachment; filename="statement.{fmt}"'
+    return response
+
+
+@query_budget(3)
+@login_required(login_url=reverse_lazy('register:login_view'))
+def export_transaction_history(request, fmt):
+    """
+    Streams the user's whole transaction history, optionally limited to the
+    ``from``/``to`` dates, as CSV or JSON lines.
+
+    The rows are read and encoded while the response is sent, so neither the
+    queryset nor the file is ever held in memory.
+    """
+    return _statement_response(request, fmt, statements.render)
+
+
+@query_budget(3)
+@async_login_required(login_url=reverse_lazy("user_login"))
+async def export_transaction_history_async(request, fmt):
+    """
+    Async ``export_transaction_history`` for the ASGI profile. The body is an
+    async iterator; Django reads a synchronous one into memory whole before
+    sending it over ASGI.
+    """
+    return _statement_response(request, fmt, statements.arender)
+
+
+@async_login_required(login_url=reverse_lazy("user_login"))
+async def live_events(request):
+    """
+    Server-sent events for the ASGI profile: the user's balance whenever a
+    posting changes it, and each payment request they receive, pushed by
+    this process as the changes commit. An idle stream holds no thread and
+    no database connection, only a queue on the event loop.
+    """
+    response = StreamingHttpResponse(
+        live.stream(request.user.pk, request.headers.get("Last-Event-ID")), content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    # stops nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def live_events_unavailable(request):
+    """
+    ``live_events`` under WSGI, where each open stream would hold a worker
+    thread. HTTP 204 tells the browser not to reconnect.
+    """
+    return HttpResponse(status=204)
 
 
+@query_budget(8)
 @login_required(login_url=reverse_lazy('register:login_view'))
 def request_money(request):
     if request.method == 'POST':
@@ -398,15 +520,22 @@ def request_money(request):
 
             form.instance.sender = request.user
             form.instance.recipient = recipient
-            form.instance.status = "pending"
+            form.instance.status = TRANSACTION_STATUS.PENDING
             amount = form.cleaned_data["amount"]
 
-            # Save the form to the database
-            payment_request = form.save()
-
-            # Create transaction history records for both sender and recipient
-            TransactionHistory.objects.create(sender=request.user, recipient=recipient, status="✔️", amount=amount, description="Request Payment (sent)")
-            TransactionHistory.objects.create(sender=recipient, recipient=request.user, status="📥", amount=amount, description="Request Payment (received)")
+            with transaction.atomic():
+                # Save the form to the database; saving it counts the new
+                # pending request in the same transaction
+                payment_request = form.save()
+
+                # Create transaction history records for both sender and recipient;
+                # no money moves, so each carries its user's current balance
+                balances = dict(OnlineAccount.objects.filter(user__in=[request.user, recipient]).values_list('user_id', 'balance'))
+                TransactionHistory.objects.bulk_create([
+                    TransactionHistory(sender=request.user, recipient=recipient, status="✔️", amount=amount, description="Request Payment (sent)", balance_after=balances.get(request.user.pk)),
+                    TransactionHistory(sender=recipient, recipient=request.user, status="📥", amount=amount, description="Request Payment (received)", balance_after=balances.get(recipient.pk)),
+                ])
+                fragments.invalidate(request.user.pk, recipient.pk)
 
             messages.success(request, "Payment request sent successfully!")
             return redirect("payment_request_success")
@@ -421,65 +550,99 @@ def payment_request_success(request):
 
 
 
+@query_budget(4)
 @login_required(login_url=reverse_lazy('register:login_view'))
 def payment_request_list_view(request):
+    """
+    Renders the payment requests sent to the user, newest first, one
+    cursor-addressed page at a time.
+    """
+    try:
+        page = keyset_paginate(
+            PaymentRequest.objects.filter(recipient=request.user).select_related('sender'),
+            request.GET.get('cursor'), page_size_from(request.GET),
+        )
+    except ValueError:
+        return redirect('payment_request_list')
 
-    payment_requests = PaymentRequest.objects.filter(recipient=request.user).order_by('-created_at')
+    return render(request, "payapp/payment_request_list.html", {"payment_requests": page, "page": page})
 
-    return render(request, "payapp/payment_request_list.html", {"payment_requests": payment_requests})
 
+@query_budget(4)
+@async_login_required(login_url=reverse_lazy("user_login"))
+async def payment_request_list_async(request):
+    """
+    Async ``payment_request_list_view`` for the ASGI profile.
+
+    The page's own list is what the navbar iterates as ``payment_requests``
+    here, so there is only the one query to run.
+    """
+    try:
+        page = await akeyset_paginate(
+            PaymentRequest.objects.filter(recipient=request.user).select_related('sender'),
+            request.GET.get('cursor'), page_size_from(request.GET),
+        )
+    except ValueError:
+        return redirect('payment_request_list')
+    return await arender(request, "payapp/payment_request_list.html", {"payment_requests": page, "page": page})
 
 
 
 
+
+@query_budget(17)
+@idempotent
 @transaction.atomic
 @login_required(login_url=reverse_lazy('register:login_view'))
 def respond_to_payment_request(request, pk):
     try:
-        payment_request = PaymentRequest.objects.get(pk=pk)
+        # only the user a request was sent to may answer it
+        payment_request = PaymentRequest.objects.select_related(
+            'sender__onlineaccount', 'recipient__onlineaccount',
+        ).get(pk=pk, recipient=request.user)
     except PaymentRequest.DoesNotExist:
         messages.error(request, 'Payment request not found!')
         return redirect('payment_failed')
 
     if request.method == 'POST':
+        if payment_request.status != TRANSACTION_STATUS.PENDING:
+            messages.info(request, 'This payment request has already been answered.')
+            return redirect('payment_request_list')
         action = request.POST.get('action')
-        print("action", action, )
         if action == 'accepted':
             try:
-                sender_account = OnlineAccount.objects.get(user=payment_request.sender)
-                recipient_account = OnlineAccount.objects.get(user=payment_request.recipient)
-
-                if recipient_account.balance >= payment_request.amount:
-                    sender_account.balance += payment_request.amount
-                    recipient_account.balance -= payment_request.amount
-                    sender_account.save()
-                    recipient_account.save()
-                    #---------------------------
-                    payment_request.status = 'SUCCESS'  # Update status to SUCCESS
-                    payment_request.save()  # Save the updated status
-                    #---------------------------
-                    messages.success(request, 'Payment request accepted!')
-                    TransactionHistory.objects.create(sender=payment_request.sender, recipient=payment_request.recipient, 
-                    status="✔️", amount=payment_request.amount, description="Payment Request Accepted")
-                    TransactionHistory.objects.create(sender=payment_request.recipient, recipient=payment_request.sender, 
-                    status="📥", amount=payment_request.amount, description="Payment Request Accepted" )
-                else:
-                    messages.error(request, 'Insufficient balance to fulfill the payment request.')
-                    return redirect('payment_failed')
+                # a failed transfer rolls the request back to pending
+                with transaction.atomic():
+                    if not payment_requests.resolve(payment_request, TRANSACTION_STATUS.SUCCESS):
+                        messages.info(request, 'This payment request has already been answered.')
+                        return redirect('payment_request_list')
+                    # The recipient of the request pays its sender
+                    ledger.transfer(
+                        payment_request.recipient, payment_request.sender, payment_request.amount,
+                        sent_description="Payment Request Accepted",
+                        received_description="Payment Request Accepted",
+                        transaction_type=TRASACTION_TYPE_CHOICES.REQUEST,
+                    )
+                messages.success(request, 'Payment request accepted!')
+            except ledger.InsufficientFunds:
+                messages.error(request, 'Insufficient balance to fulfill the payment request.')
+                return redirect('payment_failed')
+            except ledger.ExchangeRateNotFound:
+                messages.error(request, 'Exchange rate not found for currencies.')
+                return redirect('payment_failed')
             except OnlineAccount.DoesNotExist:
                 messages.error(request, 'One of the accounts does not exist.')
         elif action == 'rejected':
-            #---------------------------
-            payment_request.status = 'FAILED'  # Update status to FAILED
-            payment_request.save()  # Save the updated status
-            #---------------------------
-            messages.info(request, 'Payment request rejected!')
+            if payment_requests.resolve(payment_request, TRANSACTION_STATUS.FAILED):
+                messages.info(request, 'Payment request rejected!')
+            else:
+                messages.info(request, 'This payment request has already been answered.')
         else:
             messages.error(request, 'Invalid action.')
 
         return redirect('payment_request_list')
 
-    return render(request, 'respond_to_payment_request.html', {'payment_request': payment_request})
+    return render(request, 'payapp/respond_to_payment_request.html', {'payment_request': payment_request})
 
 
 
@@ -491,47 +654,42 @@ def withdrawal_view(request):
         form = WithdrawalForm(request.POST, user=request.user)
         if form.is_valid():
             # Store withdrawal details in session variables
-            bank_account_id = form.cleaned_data['bank_account'].id
-            amount = float(form.cleaned_data['amount'])  # Convert Decimal to float
-            request.session['withdrawal_details'] = {
-                'bank_account_id': bank_account_id,
-                'amount': amount,
-            }
+            flows.store(request.session, flows.Withdrawal(
+                bank_account_id=form.cleaned_data['bank_account'].id,
+                amount=form.cleaned_data['amount'],
+            ))
             return redirect('withdraw_money_confirm')
     else:
         form = WithdrawalForm(user=request.user)
     return render(request, 'payapp/withdraw_money.html', {'form': form})
 
 
+@query_budget(13)
+@idempotent
+@login_required(login_url=reverse_lazy("user_login"))
 def withdraw_money_confirm(request):
+    bank_account = None
     if request.method == 'POST':
         form = WithdrawalForm(request.POST, user=request.user)
         if form.is_valid():
             bank_account = form.cleaned_data['bank_account']
             amount = form.cleaned_data['amount']
-            online_account = OnlineAccount.objects.get(user=request.user)
-            if online_account.balance >= amount:
-                online_account.balance -= amount
-                online_account.save()
-
-                # Record the transaction history
-                TransactionHistory.objects.create(
-                    sender=request.user, description='Withdrawal to bank account',
-                    status='✔️', amount=amount, bank_account=bank_account)
-
-                del request.session['withdrawal_details']
+            try:
+                # Debit the balance and record the transaction history
+                ledger.withdraw(request.user, amount, bank_account)
+            except ledger.InsufficientFunds:
+                messages.warning(request, 'Insufficient balance')
+            else:
+                flows.discard(request.session, flows.Withdrawal)
                 messages.success(request, 'Withdrawal successful')
                 return redirect('withdraw_success')
-            else:
-                messages.warning(request, 'Insufficient balance')
     else:
-        withdrawal_details = request.session.get('withdrawal_details')
-        if withdrawal_details:
-            bank_account_id = withdrawal_details['bank_account_id']
-            bank_account = BankAccount.objects.get(pk=bank_account_id)
+        withdrawal = flows.load(request.session, flows.Withdrawal)
+        if withdrawal:
+            bank_account = BankAccount.objects.get(pk=withdrawal.bank_account_id, user=request.user)
             form_data = {
                 'bank_account': bank_account,
-                'amount': withdrawal_details['amount'],
+                'amount': withdrawal.amount,
             }
             form = WithdrawalForm(user=request.user, initial=form_data)
             for field in form.fields.values():
@@ -543,4 +701,82 @@ def withdraw_money_confirm(request):
     return render(request, 'payapp/withdraw_confirm.html', {'form': form, 'bank_account': bank_account})
 
 def withdraw_success(request):
-    return render(request, "payapp/withdraw_success.html")
\ No newline at end of file
+    return render(request, "payapp/withdraw_success.html")
+
+
+
+class BatchTransferAPIView(APIView):
+    """
+    Pay many recipients in one request and one database transaction.
+
+    POST a JSON body of the form
+    ``{"items": [{"recipient_email": ..., "amount": ..., "currency": ...}, ...]}``.
+    Every item gets a result in the response; items that cannot be paid are
+    reported as failed without rolling back the others.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = BatchTransferSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        items = [
+            (item['recipient_email'], item['amount'], item.get('currency'))
+            for item in serializer.validated_data['items']
+        ]
+        try:
+            results = ledger.transfer_many(request.user, items)
+        except OnlineAccount.DoesNotExist:
+            return Response({'error': 'You need an online account to send money.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        succeeded = sum(1 for result in results if result['status'] == 'ok')
+        return Response({
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'results': BatchTransferResultSerializer(results, many=True).data,
+        }, status=status.HTTP_200_OK)
+
+
+
+class KeysetListAPIView(APIView):
+    """
+    Base for JSON lists paged with ``?cursor=...&limit=...``.
+
+    Responses carry ``next_cursor`` (null on the last page) alongside the
+    serialized ``results``.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = None
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    def get(self, request):
+        try:
+            page = keyset_paginate(self.get_queryset(), request.query_params.get('cursor'),
+                                   page_size_from(request.query_params))
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'next_cursor': page.next_cursor,
+            'results': self.serializer_class(page.items, many=True).data,
+        })
+
+
+@read_consistency(STALE_OK)
+@query_budget(4)
+class TransactionHistoryAPIView(KeysetListAPIView):
+    serializer_class = TransactionHistorySerializer
+
+    def get_queryset(self):
+        return TransactionHistory.objects.filter(sender=self.request.user).select_related('recipient')
+
+
+@query_budget(4)
+class PaymentRequestListAPIView(KeysetListAPIView):
+    serializer_class = PaymentRequestSerializer
+
+    def get_queryset(self):
+        return PaymentRequest.objects.filter(recipient=self.request.user).select_related('sender')
+
@@ -1,20 +1,27 @@
 from django.contrib import admin
 from .models import CustomUser, OnlineAccount, Administrator, UserProfile, BankAccount
+from webapps2024.utils.changelists import ScalableModelAdmin
 
 @admin.register(CustomUser)
-class CustomUserAdmin(admin.ModelAdmin):
+class CustomUserAdmin(ScalableModelAdmin):
     list_display = ['username', 'email', 'first_name', 'last_name', 'get_currency']
-    search_fields = ['username', 'email']
+    search_fields = ['^username', '=email']
+    user_search_fields = ['pk']
+    list_select_related = ['onlineaccount']
 
     def get_currency(self, obj):
-        return obj.onlineaccount.currency
+        account = getattr(obj, 'onlineaccount', None)
+        return account.currency if account else None
     get_currency.short_description = 'Currency'
 
 
 @admin.register(OnlineAccount)
-class OnlineAccountAdmin(admin.ModelAdmin):
+class OnlineAccountAdmin(ScalableModelAdmin):
     list_display = ['user', 'currency', 'balance']
-    search_fields = ['user__username']
+    list_select_related = ['user']
+    search_fields = ['^user__username', '=user__email']
+    user_search_fields = ['user']
+    autocomplete_fields = ['user']
 
 
 @admin.register(Administrator)
@@ -24,10 +31,20 @@ class AdministratorAdmin(admin.ModelAdmin):
 
 
 @admin.register(UserProfile)
-class UserProfileAdmin(admin.ModelAdmin):
+class UserProfileAdmin(ScalableModelAdmin):
     list_display = ['user', 'payapp_account', 'address', 'phone_number', 'profile_picture']
+    list_select_related = ['user']
+    search_fields = ['^user__username', '=user__email']
+    user_search_fields = ['user']
+    autocomplete_fields = ['user']
 
 
 @admin.register(BankAccount)
-class BankAccountAdmin(admin.ModelAdmin):
+class BankAccountAdmin(ScalableModelAdmin):
     list_display = ['user', 'bank_name', 'account_number', 'pin']
+    list_select_related = ['user']
+    # also serves the bank account autocomplete of the history admin
+    search_fields = ['^user__username', '=user__email', '=account_number']
+    user_search_fields = ['user']
+    exact_search_fields = ['account_number']
+    autocomplete_fields = ['user']
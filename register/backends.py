@@ -0,0 +1,31 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db.models import Exists, OuterRef
+
+UserModel = get_user_model()
+
+
+class AccountBackend(ModelBackend):
+    """
+    ModelBackend that loads the user's profile, online account and pending
+    payment request counts, and whether they have any cards or bank
+    accounts, in the same query as the session user, so the account widgets
+    rendered on every page need no extra queries to show them.
+    """
+
+    def get_user(self, user_id):
+        from payapp.models import Card
+        from register.models import BankAccount
+
+        try:
+            user = (
+                UserModel._default_manager.select_related("userprofile", "onlineaccount", "pending_request_counter")
+                .annotate(
+                    has_cards=Exists(Card.objects.filter(user=OuterRef("pk"))),
+                    has_bank_accounts=Exists(BankAccount.objects.filter(user=OuterRef("pk"))),
+                )
+                .get(pk=user_id)
+            )
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -1,66 +1,128 @@
-from register.models import UserProfile, OnlineAccount, BankAccount
-from django.core.exceptions import ObjectDoesNotExist
-from payapp.models import TransactionHistory, PaymentRequest, Card
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from register.backends import AccountBackend
+from register.models import BankAccount
+from payapp.models import TransactionHistory, PaymentRequest, Card, MonthlyRollup, PendingRequestCounter
+from webapps2024.utils import fragments
+from webapps2024.utils.choices import TRANSACTION_STATUS
 
 
+def _related(user, name):
+    """
+    Return a one-to-one relation of ``user``, or None if it does not exist.
+
+    The session user is loaded by ``register.backends.AccountBackend`` with
+    its profile and online account already joined in, so this costs no query.
+    """
+    return getattr(user, name, None)
+
+
+def pending_request_counts(user):
+    """
+    The user's pending payment request counter, read off the session user,
+    or zeros if they have never had a request.
+    """
+    return _related(user, 'pending_request_counter') or PendingRequestCounter(user=user)
+
+
+def _flag(user, name, queryset):
+    """
+    Return an existence flag annotated on the session user, falling back to
+    a query when the user was loaded some other way.
+    """
+    flag = getattr(user, name, None)
+    return queryset.exists() if flag is None else flag
+
+
+def latest_transaction_history(user):
+    """The user's 5 latest transactions, newest first."""
+    return TransactionHistory.objects.filter(sender=user).select_related(
+        'bank_account',
+    ).order_by('-created_at', '-id')[:5]
+
+
+def latest_payment_requests(user):
+    """The 3 latest payment requests sent to the user, answered or not."""
+    return PaymentRequest.objects.filter(recipient=user).select_related('sender').order_by('-created_at', '-id')[:3]
+
+
+def pending_payment_requests(user):
+    """The 3 latest pending payment requests sent to the user."""
+    return PaymentRequest.objects.filter(
+        recipient=user, status=TRANSACTION_STATUS.PENDING,
+    ).select_related('sender').order_by('-created_at', '-id')[:3]
+
+
+def month_summary(user):
+    """
+    This month's sent and received rollups in the user's currency, keyed
+    ``sent`` and ``received``; one query, never over the history.
+    """
+    account = _related(user, 'onlineaccount')
+    if account is None:
+        return {}
+    rollups = MonthlyRollup.objects.filter(
+        user=user, currency=account.currency, month=timezone.localdate().replace(day=1),
+    )
+    return {rollup.direction.lower(): rollup for rollup in rollups}
+
 
-# function for  account
 def account_context(request):
     """
-    Retrieves the user's account information and context for rendering in a template.
+    Provides the account widgets shown on every page: balance, profile, bank
+    accounts, cards, recent history and payment requests.
+
+    Every value is lazy, so a page only pays for what its templates actually
+    render: the profile and online account are read off the session user, and
+    each list is a single query that runs only if a template iterates it.
+
+    The widgets are cached per user with ``{% cache %}``, varying on
+    ``widget_version``. Signals and the ledger bump that version when the
+    user's money, history, requests, cards or bank accounts change. An
+    unchanged page therefore renders its widgets without evaluating the lists.
 
     Args:
         request (HttpRequest): The HTTP request object.
 
     Returns:
-        dict: A dictionary containing the user's account information and context.
-            The dictionary may contain the following keys:
-                - 'online_account' (OnlineAccount): The user's online account information.
-                - 'user_profile' (UserProfile): The user's profile information.
-                - 'bank_accounts' (QuerySet): The user's bank accounts.
+        dict: A dictionary with the following keys for authenticated users:
+            - 'online_account' (OnlineAccount): The user's online account information.
+            - 'user_profile' (UserProfile): The user's profile information.
+            - 'bank_accounts' (QuerySet): The user's bank accounts.
+            - 'cards' (QuerySet): The user's cards.
+            - 'has_bank_accounts' / 'has_cards' (bool): Whether the user has any.
+            - 'latest_transaction_history' (QuerySet): The user's 5 latest transactions.
+            - 'payment_requests' (QuerySet): The 3 latest payment requests sent to the user.
+            - 'pending_payment_requests' (QuerySet): The 3 latest of those still pending.
+            - 'month_summary' (dict): This month's sent and received rollups.
+            - 'pending_request_counts' (PendingRequestCounter): Pending requests received and sent.
+            - 'widget_version' (str): Vary-on value for the cached widgets.
+        'widget_cache_seconds' and 'widget_cache_alias' are set for every user.
     """
-    context = {}
-    if request.user.is_authenticated:
-        user = request.user
-        try:
-            user_profile = UserProfile.objects.get(user=user)
-        except UserProfile.DoesNotExist:
-            # If UserProfile does not exist, create one
-            user_profile = UserProfile.objects.create(user=user)
-        except ObjectDoesNotExist:
-            # Handle other ObjectDoesNotExist exceptions if necessary
-            pass
-
-        try:
-            online_account = OnlineAccount.objects.get(user=user)
-            context['online_account'] = online_account
-        except OnlineAccount.DoesNotExist:
-            pass
-        
-        bank_accounts = BankAccount.objects.filter(user=user)
-        cards = Card.objects.filter(user=user)
-        context['user_profile'] = user_profile
-        context['bank_accounts'] = bank_accounts
-        context['cards'] = cards
-    return context
-
-
-def transaction_history_context(request):
-    context = {}
-    if request.user.is_authenticated:
-        transaction_history = TransactionHistory.objects.filter(sender=request.user).order_by('-created_at')
-        # get only 5 latest transactions
-        
-        current_transaction_history = TransactionHistory.objects.filter(sender=request.user).order_by('-created_at')[:5]
-        context['latest_transaction_history'] = current_transaction_history
-        context['transaction_history'] = transaction_history
-    return context
-
-
-def payment_request_list(request):
-    if request.user.is_authenticated:
-        payment_requests = PaymentRequest.objects.filter(recipient=request.user)[:3]
-    else:
-        payment_requests = None
-    return {'payment_requests': payment_requests}
+    cache_settings = {'widget_cache_seconds': fragments.timeout(), 'widget_cache_alias': fragments.ALIAS}
+    if not request.user.is_authenticated:
+        return {'payment_requests': None, 'pending_payment_requests': None, **cache_settings}
 
+    user = request.user
+    account_user = user
+    if not hasattr(user, 'has_cards'):
+        # signed in through another backend; one query loads what
+        # AccountBackend would have, instead of one query per widget
+        account_user = SimpleLazyObject(lambda: AccountBackend().get_user(user.pk) or user)
+    bank_accounts = BankAccount.objects.filter(user=user)
+    cards = Card.objects.filter(user=user)
+    return {
+        'user_profile': SimpleLazyObject(lambda: _related(account_user, 'userprofile')),
+        'online_account': SimpleLazyObject(lambda: _related(account_user, 'onlineaccount')),
+        'bank_accounts': bank_accounts,
+        'cards': cards,
+        'has_bank_accounts': SimpleLazyObject(lambda: _flag(account_user, 'has_bank_accounts', bank_accounts)),
+        'has_cards': SimpleLazyObject(lambda: _flag(account_user, 'has_cards', cards)),
+        'latest_transaction_history': latest_transaction_history(user),
+        'payment_requests': latest_payment_requests(user),
+        'pending_payment_requests': pending_payment_requests(user),
+        'month_summary': SimpleLazyObject(lambda: month_summary(account_user)),
+        'pending_request_counts': SimpleLazyObject(lambda: pending_request_counts(account_user)),
+        'widget_version': SimpleLazyObject(lambda: fragments.version(user.pk)),
+        **cache_settings,
+    }
@@ -0,0 +1,40 @@
+import factory
+from django.contrib.auth.hashers import make_password
+from factory.django import DjangoModelFactory
+
+from register.models import BankAccount, CustomUser
+from webapps2024.utils.choices import BankNames
+
+# Password every generated user can log in with.
+DEFAULT_PASSWORD = "pass1234"
+
+_password_hash = None
+
+
+def _hashed_password():
+    # hashed once per process; hashing per user would dominate seeding time
+    global _password_hash
+    if _password_hash is None:
+        _password_hash = make_password(DEFAULT_PASSWORD)
+    return _password_hash
+
+
+class CustomUserFactory(DjangoModelFactory):
+    class Meta:
+        model = CustomUser
+
+    username = factory.Sequence(lambda n: f"user{n}")
+    email = factory.LazyAttribute(lambda user: f"{user.username}@example.com")
+    first_name = factory.Faker("first_name")
+    last_name = factory.Faker("last_name")
+    password = factory.LazyFunction(_hashed_password)
+
+
+class BankAccountFactory(DjangoModelFactory):
+    class Meta:
+        model = BankAccount
+
+    user = factory.SubFactory(CustomUserFactory)
+    bank_name = factory.Iterator(BankNames.values)
+    account_number = factory.Faker("numerify", text="##########")
+    pin = factory.Faker("numerify", text="####")
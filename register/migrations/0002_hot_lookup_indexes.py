@@ -0,0 +1,21 @@
+# Generated by Django 4.2.3 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='bankaccount',
+            options={'ordering': ['created_at', 'id'], 'verbose_name_plural': 'Bank Accounts'},
+        ),
+        migrations.AddIndex(
+            model_name='bankaccount',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='bankaccount_user_created_idx'),
+        ),
+    ]
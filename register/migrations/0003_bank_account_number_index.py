@@ -0,0 +1,17 @@
+# Generated by Django 4.2.3 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0002_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bankaccount',
+            index=models.Index(fields=['account_number', 'created_at', 'id'], name='bankaccount_number_idx'),
+        ),
+    ]
@@ -89,6 +89,12 @@ class BankAccount(models.Model):
 
     class Meta:
         verbose_name_plural = "Bank Accounts"
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='bankaccount_user_created_idx'),
+            # exact account number searches in the admin, in order
+            models.Index(fields=['account_number', 'created_at', 'id'], name='bankaccount_number_idx'),
+        ]
 
     def __str__(self):
         return f"{self.bank_name}' xxxxxxxxxxx{self.account_number[-4:]}"
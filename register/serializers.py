@@ -1,7 +1,43 @@
 from rest_framework import serializers
 # from payapp.models import CurrencyConversion
 
+# Upper bound on conversions per batch request.
+MAX_CONVERSION_ITEMS = 20000
+
+
 class CurrencyConversionSerializer(serializers.Serializer):
     currency_from = serializers.CharField(max_length=3)
     currency_to = serializers.CharField(max_length=3)
-    amount_of_currency_from = serializers.DecimalField(max_digits=10, decimal_places=2)
\ No newline at end of file
+    amount_of_currency_from = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+
+class BatchConversionSerializer(serializers.Serializer):
+    """
+    Either ``items``, a list of ``{"currency_from", "currency_to", "amount"}``
+    objects, or a price vector: ``amounts`` in ``currency_from`` converted to
+    ``currency_to``.
+
+    Only the shape of the payload is checked here; amounts and currency pairs
+    are validated in bulk by ``RateTable.convert_many``, since a serializer
+    field per item is far too slow for tens of thousands of items.
+    """
+    items = serializers.ListField(required=False, allow_empty=False, max_length=MAX_CONVERSION_ITEMS)
+    amounts = serializers.ListField(required=False, allow_empty=False, max_length=MAX_CONVERSION_ITEMS)
+    currency_from = serializers.CharField(max_length=3, required=False)
+    currency_to = serializers.CharField(max_length=3, required=False)
+
+    def validate(self, attrs):
+        if ('items' in attrs) == ('amounts' in attrs):
+            raise serializers.ValidationError("Send either 'items' or 'amounts'.")
+        if 'items' in attrs:
+            if not all(isinstance(item, dict) for item in attrs['items']):
+                raise serializers.ValidationError({'items': "Every item must be an object."})
+            attrs['conversions'] = [
+                (item.get('amount'), item.get('currency_from'), item.get('currency_to')) for item in attrs['items']
+            ]
+        else:
+            if 'currency_from' not in attrs or 'currency_to' not in attrs:
+                raise serializers.ValidationError("'amounts' needs 'currency_from' and 'currency_to'.")
+            currency_from, currency_to = attrs['currency_from'], attrs['currency_to']
+            attrs['conversions'] = [(amount, currency_from, currency_to) for amount in attrs['amounts']]
+        return attrs
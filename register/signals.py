@@ -1,7 +1,9 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
+from django.contrib.auth.signals import user_logged_in
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
-from .models import UserProfile, CustomUser
+from webapps2024.utils import fragments
+from .models import BankAccount, OnlineAccount, UserProfile, CustomUser
 
 
 
@@ -10,9 +12,32 @@ def create_user_profile(sender, instance, created, **kwargs):
     if created:
         UserProfile.objects.create(user=instance)
 
+@receiver(post_save, sender=CustomUser)
+def start_widget_version(sender, instance, created, **kwargs):
+    # a new user may reuse the id of a deleted one; never show them its widgets
+    if created:
+        fragments.invalidate(instance.pk)
+
 @receiver(post_save, sender=CustomUser)
 def save_user_profile(sender, instance, **kwargs):
     try:
         instance.userprofile.save()
     except UserProfile.DoesNotExist:
-        pass  # UserProfile does not exist for this User, nothing to save
\ No newline at end of file
+        pass  # UserProfile does not exist for this User, nothing to save
+
+
+@receiver(user_logged_in)
+def ensure_user_profile(sender, user, **kwargs):
+    # accounts created before profiles existed get theirs on login, so page
+    # renders never have to create one
+    UserProfile.objects.get_or_create(user=user)
+
+
+@receiver(post_save, sender=OnlineAccount)
+@receiver(post_delete, sender=OnlineAccount)
+@receiver(post_save, sender=BankAccount)
+@receiver(post_delete, sender=BankAccount)
+def invalidate_owner_widgets(sender, instance, **kwargs):
+    # balances move through queryset.update(), which skips these signals;
+    # payapp.ledger invalidates the widgets itself
+    fragments.invalidate(instance.user_id)
@@ -1,3 +1,454 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.db import connection, router
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+
+from payapp import ledger, rates
+from payapp.models import Card, CurrencyConversion, PaymentRequest, TransactionHistory
+from register import views
+from register.models import CustomUser, UserProfile
+from webapps2024.utils import fragments, replicas, sessions
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class AccountContextTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="alice@example.com", username="alice", password="pass1234")
+        ledger.open_account(self.user, "USD", "100.00")
+        self.client.login(email="alice@example.com", password="pass1234")
+
+    def test_dashboard_query_budget(self):
+        # session, user (with profile, account and card/bank flags), payment
+        # requests, the month's rollups and the latest history
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse("user_dashboard"))
+
+        self.assertEqual(response.context["online_account"].balance, 100)
+        self.assertEqual(response.context["user_profile"].user, self.user)
+        self.assertFalse(response.context["has_cards"])
+
+    def test_navbar_lists_answered_and_pending_payment_requests(self):
+        bob = CustomUser.objects.create_user(email="bob@example.com", username="bob")
+        pending = PaymentRequest.objects.create(sender=bob, recipient=self.user, amount=1, status="PENDING")
+        answered = PaymentRequest.objects.create(sender=bob, recipient=self.user, amount=2, status="SUCCESS")
+
+        response = self.client.get(reverse("user_dashboard"))
+
+        self.assertEqual(list(response.context["payment_requests"]), [answered, pending])
+        self.assertEqual(list(response.context["pending_payment_requests"]), [pending])
+
+    @override_settings(SESSION_ENGINE="webapps2024.utils.sessions")
+    def test_write_behind_sessions_are_read_from_the_cache(self):
+        self.client.login(email="alice@example.com", password="pass1234")
+
+        with self.assertNumQueries(4):
+            self.client.get(reverse("user_dashboard"))
+
+    async def test_async_dashboard(self):
+        request = AsyncRequestFactory().get(reverse("user_dashboard"))
+        request.user = self.user
+
+        response = await views.user_dashboard_async(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "$100.00")
+
+    def test_anonymous_pages_run_no_account_queries(self):
+        self.client.logout()
+
+        with self.assertNumQueries(0):
+            self.client.get(reverse("user_login"))
+
+    def test_missing_profile_is_created_on_login_not_on_render(self):
+        UserProfile.objects.filter(user=self.user).delete()
+        self.client.logout()
+
+        self.client.login(email="alice@example.com", password="pass1234")
+
+        self.assertTrue(UserProfile.objects.filter(user=self.user).exists())
+
+    def test_sessions_signed_in_by_the_model_backend_still_work(self):
+        self.client.logout()
+        self.client.force_login(self.user, backend="django.contrib.auth.backends.ModelBackend")
+
+        # one more query than through AccountBackend, loading the account
+        # widgets' data, so these older sessions go over the dashboard's budget
+        with self.assertNumQueries(6), self.assertLogs("webapps2024.utils.instrumentation", "WARNING"):
+            response = self.client.get(reverse("user_dashboard"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["user"], self.user)
+        self.assertEqual(response.context["online_account"].balance, 100)
+
+
+LOCAL_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "sessions": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "sessions"},
+    "fragments": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "fragments"},
+}
+
+
+@override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage", CACHES=LOCAL_CACHES,
+)
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="alice@example.com", username="alice", password="pass1234")
+        self.bob = CustomUser.objects.create_user(email="bob@example.com", username="bob", password="pass1234")
+        ledger.open_account(self.user, "USD", "100.00")
+        ledger.open_account(self.bob, "USD", "100.00")
+        self.client.login(email="alice@example.com", password="pass1234")
+        self.client.get(reverse("user_dashboard"))
+
+    def dashboard(self):
+        return self.client.get(reverse("user_dashboard"))
+
+    def test_unchanged_dashboard_renders_widgets_from_cache(self):
+        # only the session and its user are loaded
+        with self.assertNumQueries(2):
+            response = self.dashboard()
+
+        self.assertContains(response, "$100.00")
+
+    def test_transfer_refreshes_both_users(self):
+        ledger.transfer(self.bob, self.user, "5.00")
+
+        response = self.dashboard()
+
+        self.assertContains(response, "$105.00")
+        self.assertContains(response, "Transfer (received)")
+
+    def test_new_payment_request_shows_in_the_navbar(self):
+        PaymentRequest.objects.create(sender=self.bob, recipient=self.user, amount="3.00", message="lunch", status="PENDING")
+
+        self.assertContains(self.dashboard(), "Payment request from")
+
+    def test_new_card_updates_the_checklist(self):
+        unchecked = self.dashboard().content.count(b"far fa-circle Verified-icon")
+
+        Card.objects.create(user=self.user, card_type="CREDIT", card_number="0123456789")
+
+        self.assertEqual(self.dashboard().content.count(b"far fa-circle Verified-icon"), unchecked - 1)
+
+    def test_large_invalidations_retire_every_user(self):
+        old = fragments.version(self.bob.pk)
+        with mock.patch.object(fragments, "BULK_INVALIDATION", 1):
+            fragments.invalidate(self.user.pk, 12345)
+
+        self.assertNotEqual(fragments.version(self.bob.pk), old)
+
+    def test_changes_are_invalidated_again_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            ledger.deposit(self.user, "1.00", "Deposit from bank account")
+        version = fragments.version(self.user.pk)
+
+        for callback in callbacks:
+            callback()
+
+        self.assertNotEqual(fragments.version(self.user.pk), version)
+
+    async def test_async_dashboard_skips_queries_for_cached_fragments(self):
+        request = AsyncRequestFactory().get(reverse("user_dashboard"))
+        request.user = self.user
+
+        self.assertTrue(await fragments.acached(self.user.pk, "latest_history", "payment_requests"))
+        with mock.patch.object(views, "alist") as alist:
+            response = await views.user_dashboard_async(request)
+
+        alist.assert_not_called()
+        self.assertContains(response, "$100.00")
+
+
+class ConvertCurrencyAPITests(TestCase):
+    def test_converts_through_the_rate_table(self):
+        response = self.client.get(reverse("conversion", args=["GBP", "GBP", "10.00"]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["converted_amount"], 10.0)
+
+    def test_converted_amount_is_not_rounded(self):
+        response = self.client.get(reverse("conversion", args=["USD", "EUR", "10.00"]))
+
+        self.assertEqual(response.json()["converted_amount"], 9.3335)
+
+    def test_unknown_currency(self):
+        response = self.client.get(reverse("conversion", args=["USD", "XYZ", "10.00"]))
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_items_and_price_vector(self):
+        response = self.client.post(reverse("batch_conversion"), {"items": [
+            {"currency_from": "USD", "currency_to": "EUR", "amount": "10.00"},
+            {"currency_from": "EUR", "currency_to": "EUR", "amount": 3},
+            {"currency_from": "GBP", "currency_to": "USD", "amount": 0.1},
+        ]}, content_type="application/json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"], ["9.33", "3.00", "0.12"])
+        self.assertIn("rate_version", response.json())
+
+        response = self.client.post(reverse("batch_conversion"), {
+            "currency_from": "USD", "currency_to": "GBP", "amounts": ["1.00", "2.50"],
+        }, content_type="application/json")
+        self.assertEqual(response.json()["results"], ["0.80", "2.00"])
+
+    def test_batch_rejects_bad_items(self):
+        response = self.client.post(reverse("batch_conversion"), {"items": [
+            {"currency_from": "USD", "currency_to": "EUR", "amount": "10.00"},
+            {"currency_from": "USD", "currency_to": "EUR", "amount": "-1"},
+        ]}, content_type="application/json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Item 1", response.json()["error"])
+
+
+class ConvertCurrencyCachingTests(TestCase):
+    def setUp(self):
+        rates.invalidate()
+        self.url = reverse("conversion", args=["USD", "EUR", "100"])
+
+    def tearDown(self):
+        rates.invalidate()
+
+    def test_emits_etag_and_max_age(self):
+        response = self.client.get(self.url)
+
+        self.assertTrue(response["ETag"].startswith('"r'))
+        self.assertIn("max-age=%d" % rates.REFRESH_SECONDS, response["Cache-Control"])
+        self.assertEqual(self.client.get(self.url)["ETag"], response["ETag"])
+        self.assertNotEqual(self.client.get(reverse("conversion", args=["USD", "EUR", "101"]))["ETag"], response["ETag"])
+
+    def test_matching_etag_skips_all_computation(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        with mock.patch("register.views.CurrencyConversionSerializer") as serializer, \
+                mock.patch.object(rates.RateTable, "convert") as convert, self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        serializer.assert_not_called()
+        convert.assert_not_called()
+
+    def test_not_modified_keeps_the_cache_headers(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertIn("max-age=%d" % rates.REFRESH_SECONDS, response["Cache-Control"])
+        self.assertIn("Accept", response["Vary"])
+
+    def test_rate_change_invalidates_etag(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CurrencyConversion.objects.create(currency_from="USD", currency_to="EUR", exchange_rate="0.5")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["converted_amount"], 50.0)
+
+    def test_errors_are_not_cacheable(self):
+        response = self.client.get(reverse("conversion", args=["USD", "XYZ", "100"]))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header("ETag"))
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create_superuser(email="admin@example.com", username="admin", password="pass1234")
+        for i in range(5):
+            user = CustomUser.objects.create_user(email=f"user{i}@example.com", username=f"user{i}", password="pass1234")
+            ledger.open_account(user, "USD", "10.00")
+        self.client.force_login(self.admin)
+
+    def test_user_admin_lists_currencies_without_n_plus_one(self):
+        response = self.client.get(reverse("admin:register_customuser_changelist"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([sql for sql in response.query_stats.duplicates if "register_onlineaccount" in sql])
+
+    @override_settings(DEBUG=True)
+    def test_debug_headers(self):
+        self.client.force_login(CustomUser.objects.get(username="user0"))
+        response = self.client.get(reverse("user_dashboard"))
+
+        self.assertEqual(response["X-View"], "user_dashboard")
+        self.assertEqual(response["X-SQL-Count"], str(response.query_stats.sql_count))
+        self.assertEqual(response["X-Query-Budget"], "5")
+        self.assertIn("X-Render-Time-ms", response)
+
+    def test_headers_are_debug_only_and_report_is_staff_only(self):
+        self.client.force_login(CustomUser.objects.get(username="user0"))
+        response = self.client.get(reverse("user_dashboard"))
+        self.assertNotIn("X-SQL-Count", response)
+        self.assertEqual(self.client.get(reverse("instrumentation_report")).status_code, 302)
+
+        self.client.force_login(self.admin)
+        report = self.client.get(reverse("instrumentation_report")).json()
+        self.assertIn("user_dashboard", [view["view"] for view in report["views"]])
+
+
+@override_settings(
+    CACHES={"sessions": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    SESSION_CACHE_ALIAS="sessions",
+)
+class SessionStoreTests(TestCase):
+    def setUp(self):
+        self.store = sessions.SessionStore()
+        self.store["step"] = 1
+        self.store.save()
+
+    def stored_in_db(self):
+        return Session.objects.get(session_key=self.store.session_key).get_decoded()
+
+    def test_new_session_is_written_through(self):
+        self.assertEqual(self.stored_in_db()["step"], 1)
+
+    def test_changes_within_the_window_stay_in_the_cache(self):
+        self.store["step"] = 2
+        with self.assertNumQueries(0):
+            self.store.save()
+
+        self.assertEqual(sessions.SessionStore(self.store.session_key)["step"], 2)
+        self.assertEqual(self.stored_in_db()["step"], 1)
+
+    def test_changes_reach_the_database_once_the_window_passes(self):
+        self.store["step"] = 2
+        with mock.patch.object(sessions, "WRITE_BEHIND_SECONDS", 0):
+            self.store.save()
+
+        self.assertEqual(self.stored_in_db()["step"], 2)
+
+    def test_cache_miss_falls_back_to_the_database(self):
+        caches["sessions"].clear()
+
+        self.assertEqual(sessions.SessionStore(self.store.session_key)["step"], 1)
+
+    def test_rekeying_writes_through(self):
+        old_key = self.store.session_key
+        self.store.cycle_key()
+
+        self.assertFalse(Session.objects.filter(session_key=old_key).exists())
+        self.assertEqual(self.stored_in_db()["step"], 1)
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class UserAdminTests(TestCase):
+    def setUp(self):
+        self.client.force_login(CustomUser.objects.create_superuser(
+            email="admin@example.com", username="admin", password="pass1234",
+        ))
+
+    def add_users(self, count, start):
+        for i in range(start, start + count):
+            user = CustomUser.objects.create_user(email=f"user{i}@example.com", username=f"user{i}", password="pass1234")
+            ledger.open_account(user, "EUR", "10.00")
+
+    def test_changelists_run_a_constant_number_of_queries(self):
+        urls = [reverse(f"admin:register_{model}_changelist") for model in ("customuser", "onlineaccount", "userprofile")]
+        self.add_users(2, 0)
+        with CaptureQueriesContext(connection) as few:
+            for url in urls:
+                self.client.get(url)
+        self.add_users(10, 2)
+
+        with CaptureQueriesContext(connection) as more:
+            response = self.client.get(urls[0])
+            for url in urls[1:]:
+                self.client.get(url)
+
+        self.assertEqual(len(more), len(few))
+        self.assertContains(response, "EUR")
+
+    def test_user_search_matches_username_prefixes_and_whole_emails(self):
+        self.add_users(11, 0)
+        url = reverse("admin:register_customuser_changelist")
+
+        for term, usernames in (
+            ("user1", ["user1", "user10"]), ("user1@example.com", ["user1"]), ("user10", ["user10"]),
+            ("ser1", []), ("user1@example", []),
+        ):
+            with self.subTest(term=term):
+                response = self.client.get(url, {"q": term})
+
+                self.assertEqual(sorted(user.username for user in response.context["cl"].result_list), usernames)
+
+
+@override_settings(REPLICA_DATABASE="replica")
+class ReplicaRoutingTests(SimpleTestCase):
+    def run_request(self, method="get", level=replicas.STALE_OK, cookies=None, write=None):
+        """Pass a request through the middleware; return where it read, before and after ``write``, and the response."""
+        def view(request):
+            pass
+        view.read_consistency = level
+        reads = []
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            reads.append(router.db_for_read(TransactionHistory))
+            if write is not None:
+                router.db_for_write(write)
+                reads.append(router.db_for_read(TransactionHistory))
+            return HttpResponse()
+
+        middleware = replicas.ReplicaMiddleware(get_response)
+        request = getattr(RequestFactory(), method)("/")
+        request.COOKIES.update(cookies or {})
+        response = middleware(request)
+        return reads, response
+
+    def test_stale_reads_go_to_the_replica(self):
+        reads, response = self.run_request()
+
+        self.assertEqual(reads, ["replica"])
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+
+    def test_other_views_and_methods_read_the_primary(self):
+        self.assertEqual(self.run_request(level=replicas.PRIMARY)[0], ["default"])
+        self.assertEqual(self.run_request(method="post")[0], ["default"])
+        self.assertEqual(router.db_for_read(TransactionHistory), "default")
+
+    def test_writers_read_their_writes(self):
+        reads, response = self.run_request(write=TransactionHistory)
+
+        self.assertEqual(reads, ["replica", "default"])
+        self.assertEqual(response.cookies[replicas.PIN_COOKIE]["max-age"], replicas.MAX_LAG_SECONDS)
+        self.assertEqual(self.run_request(cookies={replicas.PIN_COOKIE: "1"})[0], ["default"])
+
+    def test_session_saves_do_not_pin(self):
+        reads, response = self.run_request(write=Session)
+
+        self.assertEqual(reads, ["replica", "replica"])
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+
+    def test_fragments_from_the_replica_expire_with_the_lag(self):
+        def get_response(request):
+            middleware.process_view(request, views.user_dashboard, (), {})
+            return HttpResponse(str(fragments.timeout()))
+
+        middleware = replicas.ReplicaMiddleware(get_response)
+
+        self.assertEqual(int(middleware(RequestFactory().get("/")).content), replicas.MAX_LAG_SECONDS)
+        self.assertEqual(fragments.timeout(), fragments.TIMEOUT)
+
+    def test_history_dashboard_and_admin_lists_tolerate_staleness(self):
+        for path in (reverse("all_reansaction_history"), reverse("user_dashboard"),
+                     reverse("transaction_history_api"), reverse("admin:payapp_transactionhistory_changelist")):
+            self.assertEqual(replicas._level_of(resolve(path).func), replicas.STALE_OK, path)
+        self.assertEqual(replicas._level_of(resolve(reverse("request_money")).func), replicas.PRIMARY)
+
+    @override_settings(REPLICA_DATABASE=None)
+    def test_without_a_replica_nothing_changes(self):
+        reads, response = self.run_request(write=TransactionHistory)
+
+        self.assertEqual(reads, ["default", "default"])
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
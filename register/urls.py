@@ -1,8 +1,9 @@
+from django.conf import settings
 from django.urls import path
 from register.views import (
     user_registration_page, online_account_setup, 
-    user_login, user_logout, user_dashboard, administrator_create_view,
-    ConvertCurrencyAPIView
+    user_login, user_logout, user_dashboard, user_dashboard_async, administrator_create_view,
+    ConvertCurrencyAPIView, BatchConvertCurrencyAPIView
 )
 
 
@@ -12,11 +13,12 @@ urlpatterns = [
     path("online_account_setup", online_account_setup, name="online_account_views"),
     path("login", user_login, name="user_login"),
     path("logout", user_logout, name="user_logout"),
-    path("dashboard", user_dashboard, name="user_dashboard"),
+    path("dashboard", user_dashboard_async if settings.ASYNC_READ_VIEWS else user_dashboard, name="user_dashboard"),
 
     # API path
     path('conversion/<str:currency1>/<str:currency2>/<str:amount_of_currency1>/', ConvertCurrencyAPIView.as_view(), name='conversion'),
     # http://example.com/conversion/USD/EUR/100/
+    path('conversion/batch/', BatchConvertCurrencyAPIView.as_view(), name='batch_conversion'),
 # 
 ]
 
@@ -3,18 +3,25 @@ from register.forms import UserRegistrationForm, OnlineAccountForm, Administrato
 from register.models import OnlineAccount
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, logout, authenticate
-from payapp.models import CurrencyConversion
+from payapp import ledger, rates
 from django.urls import reverse
-from webapps2024.utils.manual_exchange import MANUAL_EXCHANGE_RATES
 from django.http import HttpResponseRedirect
 from django.contrib import messages
 from django.urls import reverse_lazy
 
 from rest_framework.views import APIView
 from rest_framework import status
-from .serializers import CurrencyConversionSerializer
+from .serializers import BatchConversionSerializer, CurrencyConversionSerializer
 from rest_framework.response import Response
 from decimal import Decimal
+import hashlib
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from webapps2024.utils.instrumentation import query_budget
+from webapps2024.utils.replicas import STALE_OK, read_consistency
+from webapps2024.utils.asynchronous import alist, arender, async_login_required
+from webapps2024.utils import fragments
+from register.context_processor import latest_payment_requests, latest_transaction_history
+import asyncio
 
 
 # Create your views here.\
@@ -74,29 +81,15 @@ def online_account_setup(request):
             # Fetch the appropriate exchange rate for the selected currency
             selected_currency = form.cleaned_data['currency']
             try:
-                # Fetch the CurrencyConversion object for the selected currency
-                conversion_rate = CurrencyConversion.objects.get(currency_to=selected_currency)
-
                 # Calculate the initial amount based on the baseline amount and exchange rate
-                baseline_amount = 1000  
-                initial_amount = baseline_amount * conversion_rate.exchange_rate
-            except CurrencyConversion.DoesNotExist:
-                # Handle the case where conversion rate for the selected currency doesn't exist
-                manual_exchange_rate = MANUAL_EXCHANGE_RATES.get(("USD", selected_currency))
-                if manual_exchange_rate is not None:
-                    # Calculate the initial amount using the manual exchange rate
-                    baseline_amount = 1000  
-                    initial_amount = baseline_amount * manual_exchange_rate
-                else:
-                    # Handle the case where neither automatic nor manual conversion rates are available
-                    error_message = "Conversion rate for the selected currency is not available."
-                    return redirect("online_account_views")
-
-            # Create or update the OnlineAccount for the user
-            online_account, created = OnlineAccount.objects.get_or_create(user=user)
-            online_account.currency = selected_currency
-            online_account.balance = initial_amount
-            online_account.save()
+                baseline_amount = 1000
+                initial_amount = baseline_amount * rates.rate("USD", selected_currency)
+            except rates.ExchangeRateNotFound:
+                # Handle the case where no conversion rate is available for the selected currency
+                return redirect("online_account_views")
+
+            # Create or update the OnlineAccount for the user, journaling the opening balance
+            ledger.open_account(user, selected_currency, initial_amount)
 
              # Redirect to the success URL
             return HttpResponseRedirect('/')
@@ -133,16 +126,77 @@ def user_logout(request):
     else:
         return render(request, "register/logout.html")
 
+@read_consistency(STALE_OK)
+@query_budget(5)
 @login_required(login_url=reverse_lazy("user_login"))
 def user_dashboard(request):
     return render(request, "register/user_dashboard.html")
 
 
+@read_consistency(STALE_OK)
+@query_budget(5)
+@async_login_required(login_url=reverse_lazy("user_login"))
+async def user_dashboard_async(request):
+    """
+    Async ``user_dashboard`` for the ASGI profile. The latest history and the
+    payment requests in the navbar are independent, so when their cached
+    fragments are stale both are fetched together instead of one after the
+    other while the template renders.
+    """
+    if await fragments.acached(request.user.pk, "latest_history", "payment_requests"):
+        return await arender(request, "register/user_dashboard.html")
+    history, payment_requests = await asyncio.gather(
+        alist(latest_transaction_history(request.user)),
+        alist(latest_payment_requests(request.user)),
+    )
+    return await arender(request, "register/user_dashboard.html", {
+        "latest_transaction_history": history,
+        "payment_requests": payment_requests,
+    })
+
+
 
 
 
 class ConvertCurrencyAPIView(APIView):
+    """
+    Convert one amount between two currencies.
+
+    A response only changes when the rate table does, so each one carries a
+    strong ETag built from the rate-table version and the request, and may
+    be cached for as long as workers trust their own table. Conditional
+    requests that still match are answered with 304 before any validation
+    or conversion happens.
+    """
+
     def get(self, request, currency1, currency2, amount_of_currency1):
+        table = rates.current_table()
+        digest = hashlib.md5(
+            f"{currency1}|{currency2}|{amount_of_currency1}|{request.META.get('HTTP_ACCEPT', '')}".encode(),
+            usedforsecurity=False,
+        ).hexdigest()
+        etag = f'"r{table.version}-{digest}"'
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return self._cacheable(not_modified, etag)
+
+        response = self._convert(table, currency1, currency2, amount_of_currency1)
+        if response.status_code == status.HTTP_200_OK:
+            self._cacheable(response, etag)
+        return response
+
+    def _cacheable(self, response, etag):
+        """
+        Mark a 200 or 304 as cacheable. A worker answers from its own table for
+        up to ``rates.REFRESH_SECONDS`` after a rate change, so a cached copy
+        kept that long is no staler than a fresh answer could be.
+        """
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=rates.REFRESH_SECONDS)
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+    def _convert(self, table, currency1, currency2, amount_of_currency1):
         serializer = CurrencyConversionSerializer(data={'currency_from': currency1, 'currency_to': currency2, 'amount_of_currency_from': amount_of_currency1})
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -151,12 +205,40 @@ class ConvertCurrencyAPIView(APIView):
         currency_to = serializer.validated_data['currency_to']
         amount_of_currency_from = Decimal(serializer.validated_data['amount_of_currency_from'])  # Convert to Decimal
         
-        if (currency_from, currency_to) in MANUAL_EXCHANGE_RATES:
-            exchange_rate = Decimal(MANUAL_EXCHANGE_RATES[(currency_from, currency_to)])  # Convert to Decimal
-            converted_amount = amount_of_currency_from * exchange_rate
-            return Response({'conversion_rate': exchange_rate, 'converted_amount': converted_amount}, status=status.HTTP_200_OK)
-        else:
+        try:
+            exchange_rate = table.rate(currency_from, currency_to)
+        except rates.ExchangeRateNotFound:
             return Response({'error': 'One or both currencies not supported'}, status=status.HTTP_400_BAD_REQUEST)
+        # not rounded to the cent, as this endpoint always answered; the
+        # ledger and the batch endpoint round
+        converted_amount = amount_of_currency_from * exchange_rate
+        return Response({'conversion_rate': exchange_rate, 'converted_amount': converted_amount}, status=status.HTTP_200_OK)
+
+
+class BatchConvertCurrencyAPIView(APIView):
+    """
+    Convert many amounts in one request against a single rate snapshot.
+
+    POST ``{"items": [{"currency_from": ..., "currency_to": ..., "amount": ...}, ...]}``
+    or a price vector ``{"currency_from": ..., "currency_to": ..., "amounts": [...]}``.
+    The response lists the converted amounts in request order, together with
+    the ``rate_version`` they were computed against.
+    """
+
+    def post(self, request):
+        serializer = BatchConversionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        table = rates.current_table()
+        try:
+            converted = table.convert_many(serializer.validated_data['conversions'])
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'rate_version': table.version,
+            'results': [str(amount) for amount in converted],
+        }, status=status.HTTP_200_OK)
 
 
 
@@ -51,6 +51,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so session and authentication queries are counted too
+    "webapps2024.utils.instrumentation.InstrumentationMiddleware",
+    "webapps2024.utils.replicas.ReplicaMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -71,8 +74,6 @@ TEMPLATES = [
         "OPTIONS": {
             "context_processors": [
                 "register.context_processor.account_context",
-                "register.context_processor.transaction_history_context",
-                "register.context_processor.payment_request_list",
                 "django.template.context_processors.debug",
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
@@ -92,9 +93,72 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # seconds a connection waits for the write lock before failing with
+        # "database is locked"
+        "OPTIONS": {"timeout": 20},
     }
 }
 
+# SQLite connections use write-ahead logging, so readers never wait for the
+# writer (see webapps2024.utils.group_commit.configure_sqlite).
+SQLITE_WAL = True
+
+# Funnel the ledger's postings from every thread of a process through one
+# writer thread that commits them in groups of up to
+# GROUP_COMMIT_MAX_OPERATIONS, with one commit (and fsync) per group.
+# Callers still wait for, and get, their own result.
+GROUP_COMMIT = False
+GROUP_COMMIT_MAX_OPERATIONS = 64
+
+# Views declared STALE_OK read from this alias of DATABASES; None reads
+# everything from "default". Users read from the primary for
+# REPLICA_MAX_LAG_SECONDS after they write. See webapps2024/settings_replica.py.
+DATABASE_ROUTERS = ["webapps2024.utils.replicas.ReplicaRouter"]
+REPLICA_DATABASE = None
+REPLICA_MAX_LAG_SECONDS = 5
+
+
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# Directory for the caches every worker on the host must share. Unset, each
+# process keeps them in its own memory, which suits a single process and the
+# tests; set CACHE_DIR when running more than one worker.
+CACHE_DIR = os.environ.get("CACHE_DIR")
+
+
+def _shared_cache(name):
+    if CACHE_DIR:
+        return {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": Path(CACHE_DIR) / name,
+            "OPTIONS": {"MAX_ENTRIES": 100000},
+        }
+    return {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": name}
+
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "sessions": _shared_cache("sessions"),
+    # per-user dashboard widgets; shared so every worker sees invalidations
+    "fragments": _shared_cache("fragments"),
+}
+
+FRAGMENT_CACHE_ALIAS = "fragments"
+FRAGMENT_CACHE_SECONDS = 600
+
+
+# Sessions are written through to the database by default. Set
+# SESSION_WRITE_BEHIND=1 to keep them in the "sessions" cache instead, writing
+# them to the database when created or re-keyed, then at most once every
+# SESSION_WRITE_BEHIND_SECONDS.
+if os.environ.get("SESSION_WRITE_BEHIND") == "1":
+    SESSION_ENGINE = "webapps2024.utils.sessions"
+SESSION_CACHE_ALIAS = "sessions"
+SESSION_WRITE_BEHIND_SECONDS = 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -146,6 +210,49 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 AUTH_USER_MODEL = "register.CustomUser"
 
+# loads the profile and online account together with the session user;
+# ModelBackend stays so that sessions it signed in keep working
+AUTHENTICATION_BACKENDS = [
+    "register.backends.AccountBackend",
+    "django.contrib.auth.backends.ModelBackend",
+]
+
+# seconds each worker trusts its in-memory exchange-rate table before
+# checking whether the rates were edited elsewhere
+EXCHANGE_RATES_REFRESH_SECONDS = 5
+
+# how long the response to an idempotent POST can be replayed for retries
+IDEMPOTENCY_KEY_TTL_SECONDS = 24 * 60 * 60
+
+# serve the dashboard, history and payment-request pages from their async
+# views; switched on by the ASGI profile (webapps2024/settings_asgi.py)
+ASYNC_READ_VIEWS = False
+
+# the /events stream of the ASGI profile: a keep-alive comment after this
+# many idle seconds, and a reconnect after this many seconds, which is also
+# how long a stream whose client went away is held
+LIVE_EVENTS_HEARTBEAT_SECONDS = 15
+LIVE_EVENTS_STREAM_SECONDS = 60
+
+# finished requests kept in memory for the /admin/instrumentation/ report
+INSTRUMENTATION_REPORT_SIZE = 500
+
+# Notifications are queued in the outbox with the transfer or payment request
+# they announce, once per channel, and sent by `manage.py deliver_outbox`.
+# Add "webhook": "payapp.outbox.WebhookChannel" and OUTBOX_WEBHOOK_URL to
+# post them to another service.
+OUTBOX_CHANNELS = {
+    "email": "payapp.outbox.EmailChannel",
+    "in_app": "payapp.outbox.InAppChannel",
+}
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 8
+
+# use "django.core.mail.backends.filebased.EmailBackend" and EMAIL_FILE_PATH
+# to keep the emails as files
+EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
+DEFAULT_FROM_EMAIL = "notifications@payapp.local"
+
 
 #   white noice 
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
@@ -0,0 +1,22 @@
+"""
+ASGI deployment profile, used by ``webapps2024/asgi.py``.
+
+Same as the default settings, except that the dashboard, transaction
+history and payment-request pages are served by their async views, the
+``/events`` stream pushes balances and payment requests to the browser, and
+the middleware stack is fully async-capable so requests never bounce
+between the event loop and a thread on the way in.
+
+Run it with one event loop per worker, for example::
+
+    uvicorn webapps2024.asgi:application --workers 4
+"""
+
+from webapps2024.settings import *  # noqa: F401,F403
+from webapps2024.settings import MIDDLEWARE
+
+ASYNC_READ_VIEWS = True
+
+# WhiteNoise 6.6 is WSGI-only; a synchronous middleware would push every
+# request onto a thread. Static files are served by the proxy in front.
+MIDDLEWARE = [name for name in MIDDLEWARE if name != "whitenoise.middleware.WhiteNoiseMiddleware"]
@@ -0,0 +1,26 @@
+"""
+Read replica profile for local testing.
+
+Same as the default settings, except that the views declared ``STALE_OK``
+read from a second SQLite file. Nothing replicates SQLite, so keep the copy
+in sync with::
+
+    python manage.py replay_to_replica --interval 1
+
+which stands in for streaming replication, including its lag.
+"""
+
+from webapps2024.settings import *  # noqa: F401,F403
+from webapps2024.settings import BASE_DIR, DATABASES
+
+DATABASES = {
+    **DATABASES,
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db-replica.sqlite3",
+        # tests read the replica's rows from the test primary
+        "TEST": {"MIRROR": "default"},
+    },
+}
+
+REPLICA_DATABASE = "replica"
@@ -21,10 +21,14 @@ from django.views.generic import RedirectView
 from django.conf.urls.static import static
 from django.conf import settings
 from django.conf.urls import handler404
+from django.contrib.admin.views.decorators import staff_member_required
+
+from webapps2024.utils.instrumentation import report_view
 
 from register import views 
 
 urlpatterns = [
+    path("admin/instrumentation/", staff_member_required(report_view), name="instrumentation_report"),
     path("admin/", admin.site.urls),
     path("", include("payapp.urls")),
     path("account/", include("register.urls")),
@@ -0,0 +1,27 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.shortcuts import render, resolve_url
+
+# Templates and the lazy context processor values they touch stay
+# synchronous, so rendering runs on the request's thread like the ORM.
+arender = sync_to_async(render)
+
+
+async def alist(queryset):
+    """Evaluate ``queryset`` through the async ORM."""
+    return [item async for item in queryset]
+
+
+def async_login_required(login_url):
+    """``login_required`` for async views, which Django 4.2's decorator does not support."""
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            # loads the lazy session user off the event loop
+            if not await sync_to_async(lambda: request.user.is_authenticated)():
+                return redirect_to_login(request.get_full_path(), resolve_url(login_url))
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
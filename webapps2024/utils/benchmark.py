@@ -0,0 +1,30 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+@contextmanager
+def scratch_database():
+    """
+    Run the enclosed block against a freshly migrated throwaway database.
+
+    Benchmarks create thousands of users and postings, so they never run
+    against the configured database. On SQLite the scratch database is a real
+    file (not the in-memory test database) so that concurrent threads see
+    the same locking behaviour as production.
+    """
+    settings_dict = connection.settings_dict
+    old_name = settings_dict["NAME"]
+    old_test_name = settings_dict["TEST"].get("NAME")
+    if connection.vendor == "sqlite":
+        fd, path = tempfile.mkstemp(prefix="payapp-bench-", suffix=".sqlite3")
+        os.close(fd)
+        settings_dict["TEST"]["NAME"] = path
+    try:
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        yield connection.settings_dict["NAME"]
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        settings_dict["TEST"]["NAME"] = old_test_name
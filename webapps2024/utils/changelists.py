@@ -0,0 +1,148 @@
+import operator
+from functools import reduce
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from webapps2024.utils.replicas import STALE_OK, read_consistency
+
+# Unfiltered tables estimated to hold at least this many rows are counted
+# from the database statistics instead of with COUNT(*).
+ESTIMATE_THRESHOLD = getattr(settings, "ADMIN_ESTIMATED_COUNT_THRESHOLD", 100_000)
+
+# Filtered changelists count at most this many matches; the pages after it
+# are not linked.
+COUNT_CAP = getattr(settings, "ADMIN_COUNT_CAP", 10_000)
+
+# The last code point; every string starting with a prefix sorts below the
+# prefix followed by it.
+_PREFIX_END = "\U0010ffff"
+
+
+def matching_users(term):
+    """
+    Users whose username starts with ``term``, or whose email is ``term``.
+
+    The prefix is a range on the unique username index, so unlike
+    ``istartswith``, whose ``LIKE`` scans the table on SQLite, it seeks the
+    index. Both matches are case-sensitive.
+    """
+    return get_user_model().objects.filter(
+        Q(username__gte=term, username__lt=term + _PREFIX_END) | Q(email=term),
+    )
+
+
+def estimated_count(model, using="default"):
+    """
+    The planner's row count estimate for ``model``'s table, or None when the
+    backend keeps none. On SQLite it is refreshed by ``ANALYZE``.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == "sqlite":
+        sql, params = "SELECT stat FROM sqlite_stat1 WHERE tbl = %s AND stat IS NOT NULL LIMIT 1", [table]
+    elif connection.vendor == "postgresql":
+        sql, params = "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [connection.ops.quote_name(table)]
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+    except DatabaseError:
+        # SQLite has no sqlite_stat1 table before the first ANALYZE
+        return None
+    if row is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator whose count never scans a huge table.
+
+    An unfiltered queryset on a table estimated to hold ``ESTIMATE_THRESHOLD``
+    rows or more is counted from the database statistics. A filtered one is
+    counted up to ``COUNT_CAP`` matches, through a ``LIMIT`` subquery.
+    Smaller tables get their exact count.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= ESTIMATE_THRESHOLD:
+                return estimate
+            return queryset.count()
+        return queryset.order_by()[:COUNT_CAP].count()
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin for tables that grow without bound.
+
+    Counts come from ``EstimatedCountPaginator``, and the second COUNT(*) of
+    the whole table beside the filtered count is skipped. Subclasses list the
+    foreign keys they display in ``list_select_related`` so that every page
+    runs the same number of queries. Listings are read from the replica,
+    when there is one.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # Foreign keys to users matched by the search box ("pk" on the user
+    # admin). A term is resolved to users with ``matching_users`` first, so
+    # the search seeks the foreign key indexes instead of scanning the table
+    # with LIKE.
+    user_search_fields = ()
+    # Other indexed fields the search box matches the whole term against.
+    exact_search_fields = ()
+
+    @read_consistency(STALE_OK)
+    def changelist_view(self, request, extra_context=None):
+        # reports over the whole table; a few seconds behind is fine
+        return super().changelist_view(request, extra_context)
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not self.user_search_fields or not search_term:
+            return super().get_search_results(request, queryset, search_term)
+        users = matching_users(search_term).values("pk")
+        found = list(users[:2])
+        # a single user compares with "=", so an index on (user, ordering)
+        # also returns the rows in order; more are matched by a subquery
+        lookup = "" if len(found) == 1 else "__in"
+        value = found[0]["pk"] if len(found) == 1 else users
+        matches = [Q(**{f"{field}{lookup}": value}) for field in self.user_search_fields] if found else []
+        matches += [Q(**{field: search_term}) for field in self.exact_search_fields]
+        if not matches:
+            return queryset.none(), False
+        return queryset.filter(reduce(operator.or_, matches)), False
+
+
+def values_filter(field_name, title, values):
+    """
+    A list filter offering the fixed ``(value, label)`` pairs ``values``.
+
+    Django's default filter for a field without choices lists the field's
+    distinct values, which means reading the whole table.
+    """
+    class ValuesListFilter(admin.SimpleListFilter):
+        parameter_name = field_name
+
+        def lookups(self, request, model_admin):
+            return values
+
+        def queryset(self, request, queryset):
+            if self.value() is not None:
+                return queryset.filter(**{field_name: self.value()})
+            return queryset
+
+    ValuesListFilter.title = title
+    return ValuesListFilter
@@ -38,6 +38,18 @@ class CARD_TYPE(TextChoices):
     CREDIT = ("CREDIT", "Credit")
 
 
+class SYSTEM_ACCOUNT(TextChoices):
+    BANK = ("BANK", "Bank transfers")
+    CARD = ("CARD", "Card payments")
+    FX = ("FX", "Currency exchange")
+    OPENING = ("OPENING", "Opening balances")
+
+
+class FLOW_DIRECTION(TextChoices):
+    SENT = ("SENT", "Sent")
+    RECEIVED = ("RECEIVED", "Received")
+
+
 class TRANSACTION_STATUS(TextChoices):
     PENDING = ("PENDING", "Pending")
     SUCCESS = ("SUCCESS", "Success")
@@ -0,0 +1,84 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+from django.db import transaction
+
+from webapps2024.utils import replicas
+
+# Cache holding the per-user template fragments and their versions. It must be
+# shared by every worker, or one worker's invalidation is invisible to others.
+ALIAS = getattr(settings, "FRAGMENT_CACHE_ALIAS", "default")
+
+# Upper bound on how long a fragment is kept; changes invalidate it sooner.
+TIMEOUT = getattr(settings, "FRAGMENT_CACHE_SECONDS", 600)
+
+# Invalidating more users than this retires everyone's fragments with a single
+# write instead of one write per user.
+BULK_INVALIDATION = 100
+
+_EPOCH_KEY = "fragments:epoch"
+
+
+def _version_key(user_id):
+    return f"fragments:version:{user_id}"
+
+
+def version(user_id):
+    """
+    The current version of ``user_id``'s widgets. Templates pass it to
+    ``{% cache %}`` as a vary-on value, so bumping it retires every cached
+    fragment of that user at once.
+    """
+    cache = caches[ALIAS]
+    keys = (_EPOCH_KEY, _version_key(user_id))
+    found = cache.get_many(keys)
+    return ":".join(
+        found[key] if key in found else cache.get_or_set(key, lambda: uuid.uuid4().hex, None)
+        for key in keys
+    )
+
+
+def timeout():
+    """
+    How long to keep the fragments rendered by the current request. Ones
+    rendered from the replica may predate an invalidation, so they are kept
+    no longer than the replica may lag.
+    """
+    if replicas.reading_from_replica():
+        return min(TIMEOUT, replicas.MAX_LAG_SECONDS)
+    return TIMEOUT
+
+
+def _bump(user_ids):
+    if len(user_ids) > BULK_INVALIDATION:
+        caches[ALIAS].set(_EPOCH_KEY, uuid.uuid4().hex, None)
+    else:
+        caches[ALIAS].set_many({_version_key(user_id): uuid.uuid4().hex for user_id in user_ids}, None)
+
+
+def invalidate(*user_ids):
+    """
+    Retire the cached widgets of ``user_ids``.
+
+    The version is bumped at once, so the rest of the current request sees
+    its own changes, and again on commit. The second bump drops any fragment
+    that another request rendered from the data as it was before the commit.
+    """
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if user_ids:
+        _bump(user_ids)
+        transaction.on_commit(lambda: _bump(user_ids))
+
+
+async def acached(user_id, *fragment_names):
+    """Whether every named fragment of ``user_id`` is cached at its current version."""
+    cache = caches[ALIAS]
+    keys = (_EPOCH_KEY, _version_key(user_id))
+    found = await cache.aget_many(keys)
+    if len(found) < len(keys):
+        return False
+    current = ":".join(found[key] for key in keys)
+    fragment_keys = [make_template_fragment_key(name, [user_id, current]) for name in fragment_names]
+    return len(await cache.aget_many(fragment_keys)) == len(fragment_keys)
@@ -0,0 +1,209 @@
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from webapps2024.utils import replicas
+
+logger = logging.getLogger(__name__)
+
+# Operations committed together at most; the rest wait for the next group.
+MAX_OPERATIONS = getattr(settings, "GROUP_COMMIT_MAX_OPERATIONS", 64)
+
+_STOP = object()
+_local = threading.local()
+_wrapper = ContextVar("group_commit_wrapper", default=None)
+
+
+def enabled():
+    return getattr(settings, "GROUP_COMMIT", False)
+
+
+def configure_sqlite(sender=None, connection=None, **kwargs):
+    """
+    Put new SQLite connections in write-ahead logging mode, where readers
+    never wait for the writer and a commit appends to the log instead of
+    rewriting pages. The mode is stored in the file; in-memory databases
+    keep theirs. Connected to ``connection_created`` by ``payapp``.
+    """
+    if connection.vendor == "sqlite" and getattr(settings, "SQLITE_WAL", True):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode = WAL")
+
+
+class Writer:
+    """
+    A thread that runs the write operations handed to it, many per
+    transaction.
+
+    Every operation runs in its own savepoint, so one that raises is rolled
+    back alone and its caller gets the exception. The others commit
+    together, with one commit and one fsync for the group, and their
+    callers get their results only after that commit. Operations arriving
+    while a group commits form the next group, so groups grow with the load
+    and a lone operation waits for nothing.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, max_operations=MAX_OPERATIONS):
+        self.using = using
+        self.max_operations = max_operations
+        self.groups = 0
+        self.operations = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="group-commit-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue ``fn(*args, **kwargs)``; the returned future resolves once it has committed."""
+        future = Future()
+        self._queue.put((fn, args, kwargs, future))
+        return future
+
+    def stop(self):
+        """Commit what is queued, then end the thread."""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        _local.writer = True
+        try:
+            while True:
+                group = [self._queue.get()]
+                while len(group) < self.max_operations:
+                    try:
+                        group.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stopping = _STOP in group
+                group = [operation for operation in group if operation is not _STOP]
+                if group:
+                    self._commit(group)
+                if stopping:
+                    return
+        finally:
+            connections[self.using].close()
+
+    def _commit(self, group):
+        outcomes = []
+        committed = []
+        try:
+            with transaction.atomic(using=self.using):
+                self._lock()
+                # registered first, so it runs first once the commit succeeds
+                transaction.on_commit(lambda: committed.append(True), using=self.using)
+                for fn, args, kwargs, future in group:
+                    try:
+                        with transaction.atomic(using=self.using):
+                            outcomes.append((future, fn(*args, **kwargs), None))
+                    except Exception as exc:
+                        outcomes.append((future, None, exc))
+        except Exception as exc:
+            if not committed:
+                # nothing in the group was written
+                connections[self.using].close()
+                for _, _, _, future in group:
+                    future.set_exception(exc)
+                return
+            # written, but an on-commit callback failed; the callers still
+            # get their results, or they would retry committed postings
+            logger.exception("An on-commit callback failed after a group commit")
+        self.groups += 1
+        self.operations += len(group)
+        for future, result, exc in outcomes:
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+
+    def _lock(self):
+        """
+        Take SQLite's write lock at the start of the group, as ``BEGIN
+        IMMEDIATE`` would. A transaction that reads first cannot wait for
+        the lock once another process has committed after its read; it
+        fails with "database is locked" at once, taking the group with it.
+        """
+        connection = connections[self.using]
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute(f"UPDATE {connection.ops.quote_name('django_migrations')} SET id = id WHERE 0")
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def writer():
+    """This process's writer, started on first use."""
+    global _writer, _writer_pid
+    with _writer_lock:
+        # a forked worker inherits the object but not the thread
+        if _writer is None or _writer_pid != os.getpid():
+            _writer, _writer_pid = Writer(), os.getpid()
+        return _writer
+
+
+def shutdown():
+    """Stop this process's writer, if it was started."""
+    global _writer
+    with _writer_lock:
+        if _writer is not None and _writer_pid == os.getpid():
+            _writer.stop()
+        _writer = None
+
+
+@contextmanager
+def wrapping(wrapper):
+    """
+    Hand every operation ``run`` is given in this context to
+    ``wrapper(fn, *args, **kwargs)``, which must call it. The wrapper runs
+    wherever the operation does, in its transaction, so what it writes
+    commits or rolls back with the operation; ``payapp.idempotency`` claims
+    its keys this way. Operations nested in another one that runs on this
+    thread reach the wrapper too, so it must let them through.
+    """
+    token = _wrapper.set(wrapper)
+    try:
+        yield
+    finally:
+        _wrapper.reset(token)
+
+
+def run(fn, *args, **kwargs):
+    """
+    Call ``fn(*args, **kwargs)`` and return its result once it has committed.
+
+    With ``settings.GROUP_COMMIT`` on, the call is handed to the process's
+    writer, which commits it together with those of other threads. It runs
+    directly when group commit is off, on the writer thread itself, and
+    inside a transaction the caller holds, since it must then commit or roll
+    back with that transaction. The writer's thread does not share the
+    request's context, so the request is marked as having written first.
+    """
+    wrapper = _wrapper.get()
+    if wrapper is not None:
+        fn, args = wrapper, (fn, *args)
+    direct = (
+        not enabled()
+        or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        or getattr(_local, "writer", False)
+    )
+    if direct:
+        return fn(*args, **kwargs)
+    replicas.note_write()
+    return writer().submit(fn, *args, **kwargs).result()
+
+
+def funneled(fn):
+    """Decorate a write operation so that every call goes through ``run``."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        return run(fn, *args, **kwargs)
+    return wrapper
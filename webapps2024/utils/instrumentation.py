@@ -0,0 +1,271 @@
+import logging
+import re
+import statistics
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import JsonResponse
+from django.template.backends.django import Template as DjangoBackendTemplate
+
+logger = logging.getLogger(__name__)
+
+# Finished requests kept for the in-memory report.
+REPORT_SIZE = getattr(settings, "INSTRUMENTATION_REPORT_SIZE", 500)
+
+_current = ContextVar("request_stats", default=None)
+_recent = deque(maxlen=REPORT_SIZE)
+_recent_lock = threading.Lock()
+
+_IN_LIST = re.compile(r"\(\s*%s(?:\s*,\s*%s)*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+_TRANSACTION_CONTROL = re.compile(r"(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE)\b", re.IGNORECASE)
+
+
+def query_budget(max_queries):
+    """
+    Declare how many SQL queries a view may run per request.
+
+    Works on function views in any position among their other decorators,
+    and on class-based and DRF views when applied to the class. Requests
+    that go over budget are logged and flagged on ``response.query_stats``.
+    """
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def fingerprint(sql):
+    """Normalise ``sql`` so that repeats differing only in parameters match."""
+    return _WHITESPACE.sub(" ", _IN_LIST.sub("(%s...)", sql)).strip()
+
+
+class RequestStats:
+    """
+    What one request cost: SQL statements (transaction control counted
+    apart) and time, template render time and total time.
+    """
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.view = None
+        self.budget = None
+        self.status = None
+        self.sql_count = 0
+        self.transaction_count = 0
+        self.sql_time = 0.0
+        self.render_time = 0.0
+        self.total_time = 0.0
+        self.fingerprints = Counter()
+        self._rendering = False
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            # BEGIN/SAVEPOINT/RELEASE depend on whether the caller already
+            # holds a transaction (tests always do), so they are not budgeted
+            if _TRANSACTION_CONTROL.match(sql):
+                self.transaction_count += 1
+            else:
+                self.sql_count += 1
+                self.fingerprints[fingerprint(sql)] += 1
+
+    @property
+    def duplicates(self):
+        """Fingerprints run more than once, typically an N+1 loop."""
+        return {sql: count for sql, count in self.fingerprints.items() if count > 1}
+
+    @property
+    def over_budget(self):
+        return self.budget is not None and self.sql_count > self.budget
+
+    def as_dict(self):
+        return {
+            "view": self.view,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "sql_count": self.sql_count,
+            "transaction_count": self.transaction_count,
+            "sql_ms": round(self.sql_time * 1000, 3),
+            "render_ms": round(self.render_time * 1000, 3),
+            "total_ms": round(self.total_time * 1000, 3),
+            "budget": self.budget,
+            "duplicates": self.duplicates,
+        }
+
+
+def _budget_of(view_func):
+    budget = getattr(view_func, "query_budget", None)
+    if budget is None:
+        view_class = getattr(view_func, "view_class", None) or getattr(view_func, "cls", None)
+        budget = getattr(view_class, "query_budget", None)
+    return budget
+
+
+_render_hooked = False
+
+
+def _hook_template_rendering():
+    """Time every top-level template render made while a request is instrumented."""
+    global _render_hooked
+    if _render_hooked:
+        return
+    render = DjangoBackendTemplate.render
+
+    @wraps(render)
+    def timed_render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None or stats._rendering:
+            return render(self, context, request)
+        stats._rendering = True
+        started = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            stats.render_time += time.perf_counter() - started
+            stats._rendering = False
+
+    DjangoBackendTemplate.render = timed_render
+    _render_hooked = True
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def _install_query_recorder(sender=None, connection=None, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class InstrumentationMiddleware:
+    """
+    Record SQL count and time, duplicate queries, render time and total time
+    for every request.
+
+    The numbers are attached to the response as ``response.query_stats`` for
+    tests, sent as ``X-*`` headers when ``DEBUG`` is on, and kept in a
+    rolling in-memory buffer summarised by ``report()``. Place it first in
+    ``MIDDLEWARE`` so that session and authentication queries are counted.
+
+    Works for sync and async views alike: every connection, in whichever
+    thread the ORM opens it, reports to the stats of the request in the
+    current context.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        _hook_template_rendering()
+        connection_created.connect(_install_query_recorder, dispatch_uid="instrumentation_query_recorder")
+        for connection in connections.all():
+            _install_query_recorder(connection=connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats(request.method, request.path)
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats = RequestStats(request.method, request.path)
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, stats, started)
+
+    def _finish(self, request, response, stats, started):
+        stats.total_time = time.perf_counter() - started
+        stats.status = response.status_code
+        match = request.resolver_match
+        stats.view = (match.view_name or match._func_path) if match else None
+        self._record(stats, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = _current.get()
+        if stats is not None:
+            stats.budget = _budget_of(view_func)
+
+    def _record(self, stats, response):
+        response.query_stats = stats
+        if stats.over_budget:
+            logger.warning(
+                "%s ran %d queries, over its budget of %d", stats.view, stats.sql_count, stats.budget
+            )
+        if settings.DEBUG:
+            response["X-View"] = stats.view or ""
+            response["X-SQL-Count"] = str(stats.sql_count)
+            response["X-SQL-Time-ms"] = f"{stats.sql_time * 1000:.2f}"
+            response["X-SQL-Duplicates"] = str(sum(count - 1 for count in stats.duplicates.values()))
+            response["X-Render-Time-ms"] = f"{stats.render_time * 1000:.2f}"
+            response["X-Total-Time-ms"] = f"{stats.total_time * 1000:.2f}"
+            if stats.budget is not None:
+                response["X-Query-Budget"] = str(stats.budget)
+        with _recent_lock:
+            _recent.append(stats.as_dict())
+
+
+def report():
+    """Summarise the recently recorded requests per view, worst first."""
+    with _recent_lock:
+        recent = list(_recent)
+    by_view = {}
+    for entry in recent:
+        by_view.setdefault(entry["view"], []).append(entry)
+
+    summary = []
+    for view, entries in by_view.items():
+        totals = [entry["total_ms"] for entry in entries]
+        duplicates = Counter()
+        for entry in entries:
+            duplicates.update(entry["duplicates"])
+        summary.append({
+            "view": view,
+            "requests": len(entries),
+            "sql_count_mean": round(statistics.fmean(entry["sql_count"] for entry in entries), 2),
+            "sql_count_max": max(entry["sql_count"] for entry in entries),
+            "sql_ms_mean": round(statistics.fmean(entry["sql_ms"] for entry in entries), 3),
+            "render_ms_mean": round(statistics.fmean(entry["render_ms"] for entry in entries), 3),
+            "total_ms_p95": round(
+                statistics.quantiles(totals, n=20, method="inclusive")[18] if len(totals) > 1 else totals[0], 3
+            ),
+            "budget": entries[-1]["budget"],
+            "over_budget": sum(
+                1 for entry in entries if entry["budget"] is not None and entry["sql_count"] > entry["budget"]
+            ),
+            "duplicates": dict(duplicates.most_common(5)),
+        })
+    summary.sort(key=lambda item: item["sql_count_mean"], reverse=True)
+    return summary
+
+
+def report_view(request):
+    return JsonResponse({"requests": len(_recent), "views": report()})
@@ -0,0 +1,89 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class KeysetPage:
+    """
+    One page of a queryset ordered newest first by ``(created_at, id)``.
+    """
+
+    def __init__(self, items, next_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(obj):
+    """Opaque cursor pointing just past ``obj`` in newest-first order."""
+    return urlsafe_b64encode(f"{obj.created_at.isoformat()}|{obj.pk}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor into ``(created_at, pk)``.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        created_at, pk = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(pk)
+    except (TypeError, UnicodeError, ValueError) as exc:
+        raise ValueError("Invalid cursor.") from exc
+
+
+def page_size_from(params, default=DEFAULT_PAGE_SIZE):
+    """Read the ``limit`` query parameter, clamped to ``MAX_PAGE_SIZE``."""
+    try:
+        return max(1, min(int(params.get("limit", default)), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return default
+
+
+def _after_cursor(queryset, cursor):
+    queryset = queryset.order_by("-created_at", "-id")
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        # (created_at, id) < (cursor) written as a range the index can seek
+        queryset = queryset.filter(created_at__lte=created_at).exclude(created_at=created_at, id__gte=pk)
+    return queryset
+
+
+def _page(items, page_size):
+    if len(items) > page_size:
+        return KeysetPage(items[:page_size], encode_cursor(items[page_size - 1]))
+    return KeysetPage(items)
+
+
+def keyset_paginate(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Return the page of ``queryset`` that follows ``cursor``.
+
+    Instead of an OFFSET, the page starts right after the last row of the
+    previous page, so with an index on ``(..., created_at, id)`` every page
+    costs the same however deep the user scrolls, and rows inserted while
+    paging never shift or repeat items.
+
+    Raises:
+        ValueError: If ``cursor`` is malformed.
+    """
+    queryset = _after_cursor(queryset, cursor)
+    return _page(list(queryset[:page_size + 1]), page_size)
+
+
+async def akeyset_paginate(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """Async version of ``keyset_paginate``."""
+    queryset = _after_cursor(queryset, cursor)
+    return _page([item async for item in queryset[:page_size + 1]], page_size)
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import threading
+from contextlib import asynccontextmanager
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+# Events buffered per connection. A connection that falls further behind
+# loses its oldest events; events carry current values (a whole balance, not
+# a change to it), so a later event supersedes a lost one.
+QUEUE_SIZE = 100
+
+# user id -> {(event loop, queue)} of the connections listening in this process
+_subscribers = {}
+_lock = threading.Lock()
+
+
+def listening(user_ids):
+    """Whether any connection in this process listens to one of ``user_ids``."""
+    return any(user_id in _subscribers for user_id in user_ids)
+
+
+@asynccontextmanager
+async def subscribe(user_id):
+    """
+    Listen to ``user_id``'s events for the duration of the block, through
+    the ``asyncio.Queue`` of ``(event, data)`` pairs it yields.
+
+    An idle subscriber costs a queue and a set entry; nothing polls.
+    """
+    subscriber = (asyncio.get_running_loop(), asyncio.Queue(QUEUE_SIZE))
+    with _lock:
+        _subscribers.setdefault(user_id, set()).add(subscriber)
+    try:
+        yield subscriber[1]
+    finally:
+        with _lock:
+            _subscribers[user_id].discard(subscriber)
+            if not _subscribers[user_id]:
+                del _subscribers[user_id]
+
+
+def _put(queue, item):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(item)
+
+
+def publish(user_id, event, data):
+    """Hand ``event`` to ``user_id``'s connections. Safe to call from any thread."""
+    with _lock:
+        subscribers = list(_subscribers.get(user_id, ()))
+    for loop, queue in subscribers:
+        try:
+            loop.call_soon_threadsafe(_put, queue, (event, data))
+        except RuntimeError:
+            # the connection's event loop has closed
+            pass
+
+
+def publish_on_commit(events):
+    """
+    Publish ``(user_id, event, data)`` events once the current transaction
+    commits. Costs nothing when none of the users is listening.
+    """
+    events = [event for event in events if event[0] in _subscribers]
+    if events:
+        transaction.on_commit(lambda: [publish(*event) for event in events])
+
+
+def sse(event, data, id=None):
+    """
+    Encode one server-sent event. The browser sends back the last ``id`` it
+    received as the ``Last-Event-ID`` header when it reconnects.
+    """
+    prefix = "" if id is None else f"id: {id}\n"
+    return f"{prefix}event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
@@ -0,0 +1,165 @@
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Read consistency levels a view can declare with ``read_consistency``.
+# PRIMARY reads see every committed write. STALE_OK reads may lag the
+# primary by up to ``MAX_LAG_SECONDS``.
+PRIMARY = "primary"
+STALE_OK = "stale_ok"
+
+# How far the replica may fall behind the primary. A user keeps reading from
+# the primary for this long after they write, so they always see their own
+# changes.
+MAX_LAG_SECONDS = getattr(settings, "REPLICA_MAX_LAG_SECONDS", 5)
+
+# Set on the responses of requests that wrote; while present, the browser's
+# requests read from the primary.
+PIN_COOKIE = "read_primary"
+
+_current = ContextVar("replica_reads", default=None)
+
+
+def replica_alias():
+    """The database alias of the read replica, or None when none is configured."""
+    return getattr(settings, "REPLICA_DATABASE", None)
+
+
+def read_consistency(level):
+    """
+    Declare how fresh the data a view reads must be.
+
+    Views declared ``STALE_OK`` read from the replica on GET and HEAD
+    requests, unless the user wrote in the last ``MAX_LAG_SECONDS`` or the
+    request has written since. Everything else reads from the primary. Works
+    on function views in any position among their other decorators, on
+    class-based and DRF views when applied to the class, and on ModelAdmin
+    views.
+    """
+    def decorator(view):
+        view.read_consistency = level
+        return view
+    return decorator
+
+
+def _level_of(view_func):
+    level = getattr(view_func, "read_consistency", None)
+    if level is None:
+        view_class = getattr(view_func, "view_class", None) or getattr(view_func, "cls", None)
+        level = getattr(view_class, "read_consistency", None)
+    return level or PRIMARY
+
+
+class _Reads:
+    """Where the current request reads from, and whether it has written."""
+
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.stale_ok = False
+        self.wrote = False
+
+    @property
+    def from_replica(self):
+        return self.stale_ok and not self.pinned and not self.wrote
+
+
+def note_write():
+    """
+    Record that the current request wrote, so it reads from the primary for
+    the rest of the request and its user is pinned there. For writes the
+    router does not see, such as those handed to another thread.
+    """
+    reads = _current.get()
+    if reads is not None:
+        reads.wrote = True
+
+
+def reading_from_replica():
+    """Whether reads in the current request go to the replica."""
+    reads = _current.get()
+    return replica_alias() is not None and reads is not None and reads.from_replica
+
+
+class ReplicaRouter:
+    """
+    Send the reads of ``STALE_OK`` views to ``settings.REPLICA_DATABASE``,
+    and everything else to the primary.
+
+    Reads stay on the primary inside a transaction, for related objects of
+    rows read from the primary, and for the rest of a request once it has
+    written. Replicas are never migrated; they copy the primary's schema.
+    """
+
+    def db_for_read(self, model, **hints):
+        replica = replica_alias()
+        if replica is None:
+            return None
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if reading_from_replica() and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        reads = _current.get()
+        # session saves are deferred and batched; they do not pin the user
+        if reads is not None and model._meta.label != "sessions.Session":
+            reads.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both databases hold the same rows
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db != replica_alias()
+
+
+class ReplicaMiddleware:
+    """
+    Route each request's reads according to its view's ``read_consistency``,
+    and pin users who wrote to the primary for ``MAX_LAG_SECONDS`` through a
+    cookie, so they read their own writes from any worker.
+
+    Does nothing unless ``settings.REPLICA_DATABASE`` is set.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        reads = _Reads(pinned=PIN_COOKIE in request.COOKIES)
+        token = _current.set(reads)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(response, reads)
+
+    async def __acall__(self, request):
+        reads = _Reads(pinned=PIN_COOKIE in request.COOKIES)
+        token = _current.set(reads)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(response, reads)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        reads = _current.get()
+        if reads is not None:
+            reads.stale_ok = request.method in ("GET", "HEAD") and _level_of(view_func) == STALE_OK
+
+    def _finish(self, response, reads):
+        if reads.wrote and replica_alias() is not None:
+            response.set_cookie(PIN_COOKIE, "1", max_age=MAX_LAG_SECONDS, httponly=True, samesite="Lax")
+        return response
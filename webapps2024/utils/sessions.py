@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+
+# Seconds a session may run ahead of its database row.
+WRITE_BEHIND_SECONDS = getattr(settings, "SESSION_WRITE_BEHIND_SECONDS", 60)
+
+# When the session was last written to the database, kept in the session itself.
+PERSISTED_AT = "_persisted_at"
+
+
+class SessionStore(CachedDBStore):
+    """
+    Cache-first sessions whose database writes are coalesced.
+
+    Opt in with ``SESSION_WRITE_BEHIND=1`` in the environment, which sets
+    ``SESSION_ENGINE = "webapps2024.utils.sessions"``. Reads come
+    from ``SESSION_CACHE_ALIAS`` and fall back to the database. Every save
+    updates the cache. The session row is written only when the session is
+    created or re-keyed (login, logout), and otherwise at most once every
+    ``SESSION_WRITE_BEHIND_SECONDS``. The steps of a multi-step flow
+    therefore cost no database writes.
+
+    Every worker process must share the cache, so set ``CACHE_DIR`` when
+    running more than one. If the cache loses an entry, the session falls
+    back to the copy last written to the database.
+    """
+    cache_key_prefix = "webapps2024.utils.sessions"
+
+    def save(self, must_create=False):
+        session = self._get_session(no_load=must_create)
+        persist_due = time.time() - session.get(PERSISTED_AT, 0) >= WRITE_BEHIND_SECONDS
+        if must_create or self.session_key is None or persist_due:
+            session[PERSISTED_AT] = int(time.time())
+            return super().save(must_create)
+        self._cache.set(self.cache_key, session, self.get_expiry_age())